@@ -0,0 +1,145 @@
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+from bson import ObjectId
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import server
+from logs import configure_logging
+from models.schemas import TimeOfDay
+from rules import CompiledRules
+
+"""
+@file bench_logging.py
+@brief benchmark of the rules endpoint's latency with logging at INFO and at DEBUG.
+
+@details
+calls get_user_rules directly against an in-memory routine, so the numbers only contain
+the handler's own work and its logging. the precomputed result is never stored, so every
+call evaluates the whole routine like a cache miss would. log records are written to
+os.devnull in the configured LOG_FORMAT.
+
+usage (from the backend directory):
+    python benchmarks/bench_logging.py [--products 20] [--iterations 500]
+"""
+
+TAGS = ["AHA", "BHA", "retinoid", "vitamin C", "niacinamide", "SPF", "peptide", "ceramide"]
+
+
+"""
+@class MemoryUsers
+@brief stand-in for the user repository discarding the precomputed rules.
+"""
+
+
+class MemoryUsers:
+    def __init__(self, user_doc):
+        self.user_doc = user_doc
+
+    async def find_routine_rules(self, auth0_id, day):
+        return None
+
+    async def set_routine_rules(self, auth0_id, day, state):
+        pass
+
+
+"""
+@class MemoryProducts
+@brief stand-in for the product repository serving products from memory.
+"""
+
+
+class MemoryProducts:
+    def __init__(self, products):
+        self.products = {product["_id"]: product for product in products}
+
+    async def find_by_ids(self, product_ids):
+        return [dict(self.products[product_id]) for product_id in product_ids]
+
+
+"""
+@class StaticRules
+@brief stand-in for the rule index returning a fixed rule snapshot.
+"""
+
+
+class StaticRules:
+    def __init__(self, compiled):
+        self.compiled = compiled
+
+    async def get(self):
+        return self.compiled
+
+
+def build_routine(product_count):
+    rule_docs = [
+        {
+            "_id": tag,
+            "rules": {
+                "avoid": [{"tag": other, "message": f"{tag} and {other} irritate together"}
+                          for other in TAGS if other != tag][:3],
+                "usewith": [{"tag": "SPF", "message": f"use {tag} with sunscreen"}],
+                "usewhen": [{"tag": "PM", "message": f"use {tag} at night"}],
+            },
+        }
+        for tag in TAGS
+    ]
+    products = [
+        {
+            "_id": ObjectId(),
+            "brand": f"Brand {index}",
+            "name": f"Product {index}",
+            "description": "a product description " * 10,
+            "ingredients": [f"ingredient {n}" for n in range(30)],
+            "image": None,
+            "tags": [TAGS[index % len(TAGS)], TAGS[(index * 3 + 1) % len(TAGS)]],
+        }
+        for index in range(product_count)
+    ]
+    user_doc = {
+        "auth0_id": "bench-user",
+        "skin_type": "oily",
+        "products": {"AM": [{"_id": product["_id"], "rating": 0} for product in products]},
+    }
+    return user_doc, products, CompiledRules(rule_docs)
+
+
+async def time_per_request(user_doc, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        await server.get_user_rules(TimeOfDay.AM, user_doc)
+    return (time.perf_counter() - start) / iterations * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark rules endpoint latency by log level")
+    parser.add_argument("--products", type=int, default=20)
+    parser.add_argument("--iterations", type=int, default=500)
+    args = parser.parse_args()
+
+    user_doc, products, compiled = build_routine(args.products)
+    server.user_repository = MemoryUsers(user_doc)
+    server.product_repository = MemoryProducts(products)
+    server.rule_index = StaticRules(compiled)
+
+    with open(os.devnull, "w") as devnull:
+        results = {}
+        for level in ("INFO", "DEBUG"):
+            configure_logging(level=level, levels={}, stream=devnull)
+            asyncio.run(time_per_request(user_doc, 10))
+            results[level] = asyncio.run(time_per_request(user_doc, args.iterations))
+        configure_logging(level="INFO", levels={})
+
+    print(f"rules endpoint, {args.products} products, {args.iterations} requests")
+    for level, ms in results.items():
+        print(f"{level:<6} {ms:>8.3f} ms per request")
+    print(f"DEBUG overhead: {results['DEBUG'] / results['INFO']:.2f}x")
+    logging.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,101 @@
+import argparse
+import json
+import os
+import sys
+import time
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from extractor import extract_product, extract_search_results
+
+"""
+@file bench_parse.py
+@brief benchmark of the Incidecoder page extraction against the saved fixture pages.
+
+@details
+times extractor.py on every page in tests/fixtures/incidecoder and, for reference, the
+full BeautifulSoup html.parser tree the scraper used to build for every extraction.
+pass --max-ms to fail (exit code 1) when the extractor's mean time per page exceeds it,
+so parse-time regressions can be caught in CI.
+
+usage (from the backend directory):
+    python benchmarks/bench_parse.py [--iterations 50] [--max-ms 5]
+"""
+
+FIXTURES_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests", "fixtures", "incidecoder"
+)
+
+
+def extract_with_soup(html):
+    soup = BeautifulSoup(html, "html.parser")
+    brand = soup.find("a", class_="underline")
+    name = soup.find("span", id="product-title")
+    description = soup.find("span", id="product-details")
+    section = soup.find("div", class_="showmore-section ingredlist-short-like-section")
+    ingredients = section.find_all("a", class_="ingred-link black") if section else []
+    picture = soup.find("picture")
+    image = picture.find("img") if picture else None
+    return {
+        "brand": brand.text.strip() if brand else "Brand not found",
+        "name": name.text.strip() if name else "Name not found",
+        "description": description.text.strip() if description else "Description not found",
+        "ingredients": [ingredient.text.strip() for ingredient in ingredients],
+        "image": image.get("src") if image else None,
+    }
+
+
+def search_with_soup(html, limit):
+    soup = BeautifulSoup(html, "html.parser")
+    return [result["href"] for result in soup.select("a.klavika.simpletextlistitem")[:limit]]
+
+
+def time_per_call(function, html, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        function(html)
+    return (time.perf_counter() - start) / iterations * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark Incidecoder page extraction")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--max-ms", type=float, default=None)
+    args = parser.parse_args()
+
+    with open(os.path.join(FIXTURES_DIR, "expected.json")) as f:
+        expected = json.load(f)
+
+    print(f"{'page':<70} {'KiB':>6} {'soup ms':>9} {'lxml ms':>9} {'speedup':>8}")
+    extractor_times = []
+    for page in sorted(expected):
+        with open(os.path.join(FIXTURES_DIR, page)) as f:
+            html = f.read()
+
+        if page.startswith("search_"):
+            limit = len(expected[page])
+            soup_function = lambda html: search_with_soup(html, limit)
+            fast_function = lambda html: extract_search_results(html, limit)
+        else:
+            soup_function = extract_with_soup
+            fast_function = extract_product
+
+        # both paths must agree with the recorded fields before their times mean anything
+        assert fast_function(html) == expected[page], page
+        assert soup_function(html) == expected[page], page
+
+        soup_ms = time_per_call(soup_function, html, args.iterations)
+        fast_ms = time_per_call(fast_function, html, args.iterations)
+        extractor_times.append(fast_ms)
+        print(f"{page:<70} {len(html) / 1024:>6.1f} {soup_ms:>9.2f} {fast_ms:>9.2f} {soup_ms / fast_ms:>7.1f}x")
+
+    mean_ms = sum(extractor_times) / len(extractor_times)
+    print(f"mean extractor time per page: {mean_ms:.2f} ms")
+    if args.max_ms is not None and mean_ms > args.max_ms:
+        print(f"regression: mean extractor time {mean_ms:.2f} ms exceeds {args.max_ms:.2f} ms")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
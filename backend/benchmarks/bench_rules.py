@@ -0,0 +1,126 @@
+import argparse
+import os
+import random
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from rules import CompiledRules, conflicting_candidates, find_routine_conflicts
+
+"""
+@file bench_rules.py
+@brief benchmark of the avoid checks on bitsets against pairwise set intersections.
+
+@details
+generates a synthetic rule set and products, then times:
+- routine: every avoid finding between the products of a routine, with find_routine_conflicts
+  and with the nested loops over tag sets it replaced.
+- candidates: which catalog products conflict with a routine, with conflicting_candidates on
+  bitsets encoded once per rule snapshot and with a loop over every candidate and routine pair.
+
+usage (from the backend directory):
+    python benchmarks/bench_rules.py [--tags 200] [--routine 10] [--catalog 20000]
+"""
+
+
+def build_rules(tag_count, avoids_per_tag):
+    tags = [f"tag {index}" for index in range(tag_count)]
+    rule_docs = [
+        {"_id": tag, "rules": {"avoid": [{"tag": other, "message": f"{tag} and {other}"}
+                                         for other in random.sample(tags, avoids_per_tag)]}}
+        for tag in tags
+    ]
+    return tags, CompiledRules(rule_docs)
+
+
+def build_products(tags, count):
+    return [{"id": index, "name": f"Product {index}", "tags": random.sample(tags, 3)} for index in range(count)]
+
+
+def loop_routine_conflicts(products, compiled):
+    avoid = []
+    for product in products:
+        avoid_tags = set()
+        for tag in product["tags"]:
+            avoid_tags |= compiled.avoid_tags.get(tag, frozenset())
+        for product_comp in products:
+            if product_comp is product:
+                continue
+            conflicts = avoid_tags.intersection(product_comp["tags"])
+            avoid.extend(
+                {"source": product["id"], "comp": product_comp["id"], "rule": avoid_rule}
+                for tag in product["tags"]
+                for avoid_rule in compiled.avoid.get(tag, [])
+                if avoid_rule["tag"] in conflicts
+            )
+    return avoid
+
+
+def loop_conflicting_candidates(routine, candidates, compiled):
+    def avoided(product):
+        avoid_tags = set()
+        for tag in product["tags"]:
+            avoid_tags |= compiled.avoid_tags.get(tag, frozenset())
+        return avoid_tags
+
+    routine_avoids = [avoided(product) for product in routine]
+    return [
+        any(avoided(candidate).intersection(product["tags"]) or avoid_tags.intersection(candidate["tags"])
+            for product, avoid_tags in zip(routine, routine_avoids))
+        for candidate in candidates
+    ]
+
+
+def timed(function, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        result = function()
+    return result, (time.perf_counter() - start) / iterations * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark bitset avoid checks")
+    parser.add_argument("--tags", type=int, default=200)
+    parser.add_argument("--avoids", type=int, default=2)
+    parser.add_argument("--routine", type=int, default=10)
+    parser.add_argument("--catalog", type=int, default=20000)
+    parser.add_argument("--iterations", type=int, default=20)
+    args = parser.parse_args()
+
+    random.seed(0)
+    tags, compiled = build_rules(args.tags, args.avoids)
+    routine = build_products(tags, args.routine)
+    catalog = build_products(tags, args.catalog)
+
+    loops, loop_ms = timed(lambda: loop_routine_conflicts(routine, compiled), args.iterations)
+    bitsets, bitset_ms = timed(lambda: find_routine_conflicts(routine, compiled), args.iterations)
+    assert len(loops) == len(bitsets)
+    print(f"routine of {args.routine} products, {len(bitsets)} findings")
+    print(f"loops   {loop_ms:>9.3f} ms")
+    print(f"bitsets {bitset_ms:>9.3f} ms")
+
+    # the catalog bitsets are encoded once per rule snapshot, not per request
+    # (from the tag postings, like RecommendationData.encoded)
+    postings = {}
+    for row, product in enumerate(catalog):
+        for tag in set(product["tags"]):
+            postings.setdefault(tag, []).append(row)
+    postings = {tag: np.array(rows, dtype=np.int64) for tag, rows in postings.items()}
+    (catalog_tags, catalog_avoids), encode_ms = timed(
+        lambda: compiled.encode_postings(postings, len(catalog)), 1
+    )
+    assert (catalog_tags == compiled.encode([product["tags"] for product in catalog])[0]).all()
+    loops, loop_ms = timed(lambda: loop_conflicting_candidates(routine, catalog, compiled), 1)
+    flagged, bitset_ms = timed(
+        lambda: conflicting_candidates(routine, catalog_tags, catalog_avoids, compiled), args.iterations
+    )
+    assert loops == flagged.tolist()
+    print(f"{args.catalog} candidates, {int(flagged.sum())} conflicting ({encode_ms:.1f} ms to encode once)")
+    print(f"loops   {loop_ms:>9.3f} ms")
+    print(f"bitsets {bitset_ms:>9.3f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
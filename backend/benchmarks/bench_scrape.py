@@ -0,0 +1,98 @@
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("SCRAPE_CACHE_BACKEND", "memory")
+import search
+from fixture_server import FixtureServer
+
+"""
+@file bench_scrape.py
+@brief benchmark of scrape throughput, retries and caching against the offline fixture server.
+
+@details
+starts fixture_server.py with the requested latency and error rate and runs the same set of
+searches twice through search.get_search_results: once against empty caches (every page is
+fetched) and once warm (answered from the caches). reports searches/sec, page fetches,
+injected errors retried and the cache hit ratios of each pass. runs are deterministic for a
+given --seed.
+
+usage (from the backend directory):
+    python benchmarks/bench_scrape.py [--searches 50] [--concurrency 10] [--latency-ms 50]
+        [--jitter-ms 10] [--error-rate 0.05] [--seed 1]
+"""
+
+
+async def run_pass(queries, concurrency):
+    limit = asyncio.Semaphore(concurrency)
+
+    async def one(query):
+        async with limit:
+            return await search.get_search_results(query, 5)
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(one(query) for query in queries))
+    return time.perf_counter() - started, results
+
+
+def cache_counts():
+    return {
+        "products": (search.product_cache.hits, search.product_cache.misses),
+        "searches": (search.search_cache.hits, search.search_cache.misses),
+    }
+
+
+def hit_ratio(before, after):
+    hits = after[0] - before[0]
+    lookups = hits + after[1] - before[1]
+    return hits / lookups if lookups else 0.0
+
+
+async def run(args, server):
+    search.BASE_URL = server.base_url
+    search.RETRY_BACKOFF = args.backoff_ms / 1000
+    queries = [f"query {index}" for index in range(args.searches)]
+
+    print(f"{args.searches} searches, concurrency {args.concurrency}, latency {args.latency_ms} ms "
+          f"+- {args.jitter_ms} ms, error rate {args.error_rate}")
+    print(f"{'pass':<6} {'seconds':>8} {'searches/s':>11} {'fetches':>8} {'errors':>7} "
+          f"{'product hits':>13} {'search hits':>12} {'empty':>6}")
+    for name in ("cold", "warm"):
+        fetches = sum(server.requests.values())
+        errors = sum(server.errors.values())
+        counts = cache_counts()
+        elapsed, results = await run_pass(queries, args.concurrency)
+        after = cache_counts()
+        print(f"{name:<6} {elapsed:>8.3f} {len(queries) / elapsed:>11.1f} "
+              f"{sum(server.requests.values()) - fetches:>8} {sum(server.errors.values()) - errors:>7} "
+              f"{hit_ratio(counts['products'], after['products']):>13.2f} "
+              f"{hit_ratio(counts['searches'], after['searches']):>12.2f} "
+              f"{sum(1 for result in results if not result):>6}")
+    await search.close_client()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark scraping against the fixture server")
+    parser.add_argument("--searches", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--jitter-ms", type=float, default=10)
+    parser.add_argument("--error-rate", type=float, default=0.05)
+    parser.add_argument("--backoff-ms", type=float, default=10, help="retry backoff factor")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    server = FixtureServer(
+        latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000,
+        error_rate=args.error_rate, seed=args.seed,
+    )
+    with server:
+        asyncio.run(run(args, server))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
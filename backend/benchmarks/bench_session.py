@@ -0,0 +1,131 @@
+import argparse
+import asyncio
+import os
+import secrets
+import sys
+import tempfile
+import time
+from starlette.applications import Starlette
+from starlette.middleware.sessions import SessionMiddleware
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sessions import MemorySessionStore, SQLiteSessionStore, ServerSessionMiddleware
+
+"""
+@file bench_session.py
+@brief benchmark of the session cookie size and session middleware overhead per request.
+
+@details
+logs in once through a route storing an Auth0-sized token in the session (as the callback
+does), then replays an authenticated read of the user id through:
+- cookie: starlette's SessionMiddleware, the whole token signed into the cookie.
+- memory / sqlite: ServerSessionMiddleware with the token in a MemorySessionStore or a
+  SQLiteSessionStore, the cookie only holding the session id.
+requests are sent straight to the ASGI app, so the timings only contain the middleware and
+the route. reports the Cookie request header size and the time per request.
+
+usage (from the backend directory):
+    python benchmarks/bench_session.py [--requests 5000]
+"""
+
+
+def auth0_token() -> dict:
+    """
+    returns a token shaped like the one authorize_access_token returns.
+    """
+    userinfo = {
+        "given_name": "Ada", "family_name": "Lovelace", "nickname": "ada", "name": "Ada Lovelace",
+        "picture": "https://lh3.googleusercontent.com/a/" + secrets.token_urlsafe(64),
+        "updated_at": "2024-11-01T12:00:00.000Z", "email": "ada@example.com",
+        "email_verified": True, "iss": "https://legallychemie.us.auth0.com/",
+        "aud": secrets.token_urlsafe(24), "iat": 1730462400, "exp": 1730498400,
+        "sub": "google-oauth2|" + "1" * 21, "sid": secrets.token_urlsafe(24),
+        "nonce": secrets.token_urlsafe(16),
+    }
+    return {
+        "access_token": secrets.token_urlsafe(600),
+        "id_token": secrets.token_urlsafe(900),
+        "scope": "openid profile email",
+        "expires_in": 86400,
+        "token_type": "Bearer",
+        "expires_at": 1730548800,
+        "userinfo": userinfo,
+    }
+
+
+def build_app(token):
+    async def login(request):
+        request.session["user"] = token
+        request.session["user_id"] = token["userinfo"]["sub"]
+        return JSONResponse({})
+
+    async def me(request):
+        return JSONResponse({"sub": request.session["user"]["userinfo"]["sub"]})
+
+    return Starlette(routes=[Route("/login", login), Route("/me", me)])
+
+
+async def call(app, path, cookie=None):
+    """
+    sends one GET request to the ASGI app and returns the status and Set-Cookie headers.
+    """
+    headers = [(b"host", b"localhost")]
+    if cookie is not None:
+        headers.append((b"cookie", cookie.encode("latin-1")))
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"",
+        "root_path": "", "headers": headers, "client": ("127.0.0.1", 1), "server": ("localhost", 80),
+    }
+    response = {}
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+            response["cookies"] = [value.decode("latin-1") for name, value in message["headers"]
+                                   if name == b"set-cookie"]
+
+    await app(scope, receive, send)
+    return response
+
+
+async def measure(app, requests: int):
+    login = await call(app, "/login")
+    cookie = login["cookies"][0].split(";", 1)[0]
+    assert (await call(app, "/me", cookie))["status"] == 200
+
+    started = time.perf_counter()
+    for _ in range(requests):
+        await call(app, "/me", cookie)
+    return len("cookie: " + cookie), (time.perf_counter() - started) / requests * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark session cookie size and overhead")
+    parser.add_argument("--requests", type=int, default=5000)
+    args = parser.parse_args()
+
+    token = auth0_token()
+    with tempfile.TemporaryDirectory() as directory:
+        setups = {
+            "cookie": lambda app: SessionMiddleware(app, secret_key="bench-secret"),
+            "memory": lambda app: ServerSessionMiddleware(app, store=MemorySessionStore()),
+            "sqlite": lambda app: ServerSessionMiddleware(
+                app, store=SQLiteSessionStore(os.path.join(directory, "sessions.sqlite3"))
+            ),
+        }
+        print(f"{args.requests} authenticated requests")
+        print(f"{'session':<8} {'cookie header':>14} {'per request':>12}")
+        for name, wrap in setups.items():
+            size, micros = asyncio.run(measure(wrap(build_app(token)), args.requests))
+            print(f"{name:<8} {size:>12} B {micros:>9.1f} us")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
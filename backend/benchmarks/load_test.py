@@ -0,0 +1,362 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import httpx
+from bson import ObjectId
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fixture_server import FixtureServer
+from indexes import ensure_indexes
+from ratings import empty_community_rating
+from repository import DB_NAME
+
+"""
+@file load_test.py
+@brief reproducible load test of the backend endpoints against a local MongoDB.
+
+@details
+seeds a scratch database (LegallyChemieBench by default, dropped first; names without
+"bench", "test" or "scratch", and the application's own DB_NAME, are refused) with users,
+products, rules and ingredients at the requested scale, boots the FastAPI app in process
+and replays a weighted mix of traffic through it concurrently:
+- routine reads (GET /{day}/products/) and bulk rating reads (GET /{day}/ratings).
+- rules checks (GET /{day}/rules/).
+- rating updates (PATCH /{day}/products/{id}/{rating}/{old_rating}).
+- searches (POST /search/), answered from the seeded catalog or scraped from the recorded
+  pages in tests/fixtures/incidecoder, replayed by fixture_server.py instead of incidecoder.com.
+requests are authenticated with sessions stored for the seeded users. the same
+--seed replays the same data and traffic. the report lists requests/sec and p50/p95/p99
+latency per endpoint; --max-p95-ms exits with code 1 when any endpoint is slower, so
+regressions can be caught in CI.
+
+mongomock does not implement the positional projections the rating updates use, so the
+suite needs a real mongod, e.g. `docker run -p 27017:27017 mongo`.
+
+usage (from the backend directory):
+    python benchmarks/load_test.py [--db-string mongodb://localhost:27017] [--users 200]
+        [--products 2000] [--requests 5000] [--concurrency 32] [--seed 1]
+        [--scrape-latency-ms 0] [--json results.json] [--max-p95-ms 50]
+"""
+
+TAGS = [
+    "AHA", "BHA", "retinoid", "vitamin C", "niacinamide", "SPF", "peptide", "ceramide",
+    "benzoyl peroxide", "hyaluronic acid", "fragrance", "alcohol",
+]
+SKIN_TYPES = ["oily", "dry", "normal", "combination", "sensitive"]
+BRANDS = ["CeraVe", "The Ordinary", "Paula's Choice", "La Roche-Posay", "Glossier", "Inkey List"]
+KINDS = ["Cleanser", "Serum", "Moisturizer", "Toner", "Sunscreen", "Exfoliant", "Cream", "Oil"]
+INGREDIENT_COUNT = 400
+
+# endpoint -> share of the replayed traffic
+TRAFFIC_MIX = {
+    "routine": 0.30,
+    "ratings": 0.10,
+    "rules": 0.30,
+    "rate": 0.15,
+    "search": 0.15,
+}
+SEARCH_QUERIES = ["cerave", "cleanser", "serum", "retinol", "ordinary serum", "sunscreen", "moisturiser"]
+
+
+"""
+@fn build_seed_data
+@brief generates the rules, ingredients, products and users of the scratch database.
+
+@param users number of users.
+@param products number of products.
+@param rng random.Random used for every choice, for reproducible runs.
+@return dictionary of collection name -> list of documents.
+"""
+
+
+def build_seed_data(users: int, products: int, rng: random.Random) -> dict:
+    rule_docs = [
+        {
+            "_id": tag,
+            "rules": {
+                "avoid": [
+                    {"tag": other, "message": f"do not combine {tag} with {other}"}
+                    for other in rng.sample([t for t in TAGS if t != tag], 2)
+                ],
+                "usewith": [{"tag": "SPF", "message": f"use {tag} with sunscreen"}] if rng.random() < 0.3 else [],
+                "usewhen": [{"tag": rng.choice(["AM", "PM"]), "message": f"only use {tag} at night"}]
+                if rng.random() < 0.3 else [],
+            },
+        }
+        for tag in TAGS
+    ]
+
+    ingredient_docs = [
+        {"_id": f"ingredient{index}", "categories": rng.sample(TAGS, rng.randint(0, 2))}
+        for index in range(INGREDIENT_COUNT)
+    ]
+
+    product_docs = []
+    for index in range(products):
+        brand = rng.choice(BRANDS)
+        kind = rng.choice(KINDS)
+        ingredients = [f"Ingredient {n}" for n in rng.sample(range(INGREDIENT_COUNT), 25)]
+        product_docs.append({
+            "_id": ObjectId(),
+            "brand": brand,
+            "name": f"{kind} {index}",
+            "description": f"A {kind.lower()} by {brand} for everyday use.",
+            "ingredients": ingredients,
+            "image": None,
+            "url": f"https://incidecoder.com/products/seeded-{index}",
+            "tags": rng.sample(TAGS, rng.randint(1, 3)),
+            "community_rating": empty_community_rating(),
+        })
+
+    user_docs = []
+    for index in range(users):
+        user_docs.append({
+            "auth0_id": f"bench|{index}",
+            "given_name": f"User {index}",
+            "skin_type": rng.choice(SKIN_TYPES),
+            "products": {
+                day: [
+                    {"_id": product["_id"], "rating": 0}
+                    for product in rng.sample(product_docs, min(len(product_docs), rng.randint(3, 8)))
+                ]
+                for day in ("AM", "PM")
+            },
+        })
+
+    return {
+        "rules": rule_docs,
+        "ingredients": ingredient_docs,
+        "products": product_docs,
+        "users": user_docs,
+    }
+
+
+# a database is only dropped when its name says it is disposable
+SCRATCH_MARKERS = ("bench", "test", "scratch")
+
+
+def is_scratch_database(db_name: str) -> bool:
+    return db_name != DB_NAME and any(marker in db_name.lower() for marker in SCRATCH_MARKERS)
+
+
+async def seed_database(database, seed_data: dict):
+    if not is_scratch_database(database.db.name):
+        raise ValueError(f"refusing to drop {database.db.name!r}, not a scratch database")
+    await database.client.drop_database(database.db.name)
+    for name, docs in seed_data.items():
+        if docs:
+            await database.db[name].insert_many(docs)
+    await ensure_indexes(database.db)
+
+
+"""
+@fn session_cookie
+@brief logs a user in by storing a session for them in the app's session store.
+@return the session id to send as the session cookie.
+"""
+
+
+def session_cookie(session_store, auth0_id: str) -> str:
+    return session_store.create({"user": {"userinfo": {"sub": auth0_id}}, "user_id": auth0_id})
+
+
+"""
+@class TrafficReplay
+@brief issues the weighted request mix and records the latency of every request.
+
+@param client httpx client bound to the app.
+@param users seeded user documents.
+@param session_store session store of the app.
+@param rng random.Random choosing the requests.
+"""
+
+
+class TrafficReplay:
+    def __init__(self, client, users, session_store, rng):
+        self.client = client
+        self.users = users
+        self.rng = rng
+        self.cookies = {user["auth0_id"]: session_cookie(session_store, user["auth0_id"]) for user in users}
+        # (auth0 id, day, product id) -> rating, so updates always change the rating
+        self.ratings = {}
+        self.latencies = {endpoint: [] for endpoint in TRAFFIC_MIX}
+        self.statuses = {endpoint: {} for endpoint in TRAFFIC_MIX}
+
+    def next_request(self):
+        """
+        returns the endpoint name and the arguments of the next request to send.
+        """
+        endpoint = self.rng.choices(list(TRAFFIC_MIX), weights=list(TRAFFIC_MIX.values()))[0]
+        user = self.rng.choice(self.users)
+        day = self.rng.choice(["AM", "PM"])
+        cookies = {"session": self.cookies[user["auth0_id"]]}
+
+        if endpoint == "routine":
+            return endpoint, ("GET", f"/{day}/products/"), {"cookies": cookies}
+        if endpoint == "ratings":
+            return endpoint, ("GET", f"/{day}/ratings"), {"cookies": cookies}
+        if endpoint == "rules":
+            return endpoint, ("GET", f"/{day}/rules/"), {"cookies": cookies}
+        if endpoint == "search":
+            return endpoint, ("POST", "/search/"), {"json": {"query": self.rng.choice(SEARCH_QUERIES)}}
+
+        product_id = self.rng.choice(user["products"][day])["_id"]
+        key = (user["auth0_id"], day, product_id)
+        old_rating = self.ratings.get(key, 0)
+        rating = self.rng.choice([value for value in range(1, 6) if value != old_rating])
+        self.ratings[key] = rating
+        path = f"/{day}/products/{product_id}/{rating}/{old_rating}"
+        return endpoint, ("PATCH", path), {"cookies": cookies}
+
+    async def send(self, endpoint, request, kwargs):
+        method, path = request
+        # cookies are passed per request, the shared client must not keep any
+        self.client.cookies.clear()
+        started = time.perf_counter()
+        response = await self.client.request(method, path, **kwargs)
+        self.latencies[endpoint].append(time.perf_counter() - started)
+        statuses = self.statuses[endpoint]
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    async def run(self, total: int, concurrency: int) -> float:
+        """
+        sends total requests with at most concurrency in flight and returns the elapsed seconds.
+        """
+        requests = [self.next_request() for _ in range(total)]
+        queue = asyncio.Queue()
+        for request in requests:
+            queue.put_nowait(request)
+
+        async def worker():
+            while not queue.empty():
+                await self.send(*queue.get_nowait())
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return time.perf_counter() - started
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+"""
+@fn summarize
+@brief computes throughput and latency percentiles per endpoint.
+@return dictionary of endpoint -> {"requests", "rps", "p50_ms", "p95_ms", "p99_ms", "statuses"}.
+"""
+
+
+def summarize(replay: TrafficReplay, elapsed: float) -> dict:
+    summary = {}
+    for endpoint, latencies in replay.latencies.items():
+        latencies = sorted(latencies)
+        summary[endpoint] = {
+            "requests": len(latencies),
+            "rps": len(latencies) / elapsed if elapsed else 0.0,
+            "p50_ms": percentile(latencies, 0.50) * 1000,
+            "p95_ms": percentile(latencies, 0.95) * 1000,
+            "p99_ms": percentile(latencies, 0.99) * 1000,
+            "statuses": {str(status): count for status, count in sorted(replay.statuses[endpoint].items())},
+        }
+    return summary
+
+
+async def run_load_test(args) -> dict:
+    # the app reads its configuration at import time
+    os.environ["DB_STRING"] = args.db_string
+    os.environ["DB_NAME"] = args.db_name
+    os.environ.setdefault("SESSION_BACKEND", "memory")
+    os.environ.setdefault("SCRAPE_CACHE_BACKEND", "memory")
+    # queued rating changes go to a scratch file, never the backend's own queue
+    queue_directory = tempfile.mkdtemp(prefix="load_test_")
+    os.environ.setdefault("RATING_QUEUE_PATH", os.path.join(queue_directory, "rating_queue.sqlite3"))
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    os.environ.setdefault("DB_SERVER_SELECTION_TIMEOUT_MS", "5000")
+    import search
+    import server
+
+    incidecoder = FixtureServer(latency=args.scrape_latency_ms / 1000, seed=args.seed).start()
+    search.BASE_URL = incidecoder.base_url
+
+    await server.database.client.admin.command("ping")
+    rng = random.Random(args.seed)
+    seed_data = build_seed_data(args.users, args.products, rng)
+    await seed_database(server.database, seed_data)
+
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        replay = TrafficReplay(client, seed_data["users"], server.session_store, rng)
+        # warming up the rule, ingredient and catalog indexes outside the measurement
+        await replay.run(min(200, args.requests), args.concurrency)
+        replay.latencies = {endpoint: [] for endpoint in TRAFFIC_MIX}
+        replay.statuses = {endpoint: {} for endpoint in TRAFFIC_MIX}
+        elapsed = await replay.run(args.requests, args.concurrency)
+
+    await search.close_client()
+    await server.database.close()
+    incidecoder.stop()
+    shutil.rmtree(queue_directory, ignore_errors=True)
+
+    return {
+        "users": args.users,
+        "products": args.products,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "elapsed_s": elapsed,
+        "rps": args.requests / elapsed if elapsed else 0.0,
+        "endpoints": summarize(replay, elapsed),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="load test the backend endpoints")
+    parser.add_argument("--db-string", default=os.getenv("BENCH_DB_STRING", "mongodb://localhost:27017"))
+    parser.add_argument("--db-name", default="LegallyChemieBench")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--products", type=int, default=2000)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--scrape-latency-ms", type=float, default=0)
+    parser.add_argument("--json", default=None, help="also write the results to this file")
+    parser.add_argument("--max-p95-ms", type=float, default=None)
+    args = parser.parse_args()
+    if not is_scratch_database(args.db_name):
+        parser.error(
+            f"--db-name {args.db_name!r} would be dropped: use a scratch database whose name"
+            f" contains one of {', '.join(SCRATCH_MARKERS)}"
+        )
+
+    results = asyncio.run(run_load_test(args))
+
+    print(f"{args.requests} requests, {args.users} users, {args.products} products, "
+          f"concurrency {args.concurrency}: {results['rps']:.1f} req/s")
+    print(f"{'endpoint':<10} {'requests':>8} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}  statuses")
+    for endpoint, stats in results["endpoints"].items():
+        print(f"{endpoint:<10} {stats['requests']:>8} {stats['rps']:>8.1f} {stats['p50_ms']:>8.2f} "
+              f"{stats['p95_ms']:>8.2f} {stats['p99_ms']:>8.2f}  {stats['statuses']}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.max_p95_ms is not None:
+        slow = [name for name, stats in results["endpoints"].items() if stats["p95_ms"] > args.max_p95_ms]
+        if slow:
+            print(f"regression: p95 latency of {', '.join(slow)} exceeds {args.max_p95_ms:.2f} ms")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
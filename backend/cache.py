@@ -0,0 +1,215 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+"""
+@file cache.py
+@brief module providing the TTL caches used for scraped Incidecoder pages and search results.
+
+@details
+two interchangeable backends are provided:
+- MemoryCache: per-process, size-bounded LRU with expiry.
+- SQLiteCache: disk-backed cache in a local SQLite file, shared by every uvicorn worker on
+  the machine and kept across restarts.
+
+values are JSON-serializable python objects. a cached value of None records a failed
+fetch (negative caching), so callers must compare the result of get() against MISS to
+tell a cached failure apart from a cache miss. both backends count hits and misses.
+
+coroutines use aget() and aset(), which run the SQLite backend's queries in a worker
+thread so a busy database file never blocks the event loop.
+"""
+
+# returned by get() when the key is absent or expired
+MISS = object()
+
+
+"""
+@class MemoryCache
+@brief in-process LRU cache whose entries expire after their TTL.
+
+@param max_entries maximum number of entries kept before the least recently used is evicted.
+"""
+
+
+class MemoryCache:
+    def __init__(self, max_entries: int = 500):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.time():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return MISS
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: str, value, ttl: float):
+        with self._lock:
+            self._entries[key] = (time.time() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    async def aget(self, key: str):
+        return self.get(key)
+
+    async def aset(self, key: str, value, ttl: float):
+        self.set(key, value, ttl)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+"""
+@class SQLiteCache
+@brief cache stored in a local SQLite database shared across processes.
+
+@details
+entries live in one table keyed by (namespace, key), so several logical caches can share
+a file. reads never write: the time of each hit is kept in memory and written in one batch
+when entries are evicted (every 100 writes), which drops expired entries and, once a
+namespace grows past max_entries, the least recently used ones.
+
+@param path path of the SQLite database file.
+@param namespace logical cache name stored alongside every key.
+@param max_entries maximum number of entries kept in the namespace.
+"""
+
+
+class SQLiteCache:
+    def __init__(self, path: str, namespace: str, max_entries: int = 10000):
+        self.path = path
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        self._writes = 0
+        # key -> time of its last hit, not yet written to accessed_at
+        self._accessed = {}
+        self._accessed_lock = threading.Lock()
+
+        with self._connection() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                " namespace TEXT NOT NULL,"
+                " key TEXT NOT NULL,"
+                " value TEXT NOT NULL,"
+                " expires_at REAL NOT NULL,"
+                " accessed_at REAL NOT NULL,"
+                " PRIMARY KEY (namespace, key))"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS cache_lru ON cache (namespace, accessed_at)"
+            )
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite connections must not be shared between threads
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            # WAL lets several workers read while one writes
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def get(self, key: str):
+        now = time.time()
+        row = self._connection().execute(
+            "SELECT value, expires_at FROM cache WHERE namespace = ? AND key = ?",
+            (self.namespace, key),
+        ).fetchone()
+        if row is None or row[1] <= now:
+            # expired entries are left to evict() or overwritten by set()
+            self.misses += 1
+            return MISS
+
+        with self._accessed_lock:
+            self._accessed[key] = now
+        self.hits += 1
+        return json.loads(row[0])
+
+    async def aget(self, key: str):
+        return await asyncio.to_thread(self.get, key)
+
+    async def aset(self, key: str, value, ttl: float):
+        await asyncio.to_thread(self.set, key, value, ttl)
+
+    def set(self, key: str, value, ttl: float):
+        now = time.time()
+        connection = self._connection()
+        connection.execute(
+            "INSERT OR REPLACE INTO cache (namespace, key, value, expires_at, accessed_at)"
+            " VALUES (?, ?, ?, ?, ?)",
+            (self.namespace, key, json.dumps(value), now + ttl, now),
+        )
+        self._writes += 1
+        # checking the size on every write would cost a count query each time
+        if self._writes % 100 == 0:
+            self.evict()
+
+    def evict(self):
+        connection = self._connection()
+        with self._accessed_lock:
+            accessed, self._accessed = self._accessed, {}
+        if accessed:
+            connection.executemany(
+                "UPDATE cache SET accessed_at = ? WHERE namespace = ? AND key = ? AND accessed_at < ?",
+                [(at, self.namespace, key, at) for key, at in accessed.items()],
+            )
+        connection.execute(
+            "DELETE FROM cache WHERE namespace = ? AND expires_at <= ?",
+            (self.namespace, time.time()),
+        )
+        connection.execute(
+            "DELETE FROM cache WHERE namespace = ? AND key IN ("
+            " SELECT key FROM cache WHERE namespace = ?"
+            " ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.namespace, self.namespace, self.max_entries),
+        )
+
+    def clear(self):
+        self._connection().execute("DELETE FROM cache WHERE namespace = ?", (self.namespace,))
+
+
+"""
+@fn create_cache
+@brief creates the cache backend configured through the environment.
+
+@details
+SCRAPE_CACHE_BACKEND selects "sqlite" (default) or "memory"; SCRAPE_CACHE_PATH sets the
+SQLite file (default "scrape_cache.sqlite3" next to this module).
+
+@param namespace logical cache name.
+@param max_entries maximum number of entries kept.
+@return a MemoryCache or SQLiteCache.
+"""
+
+
+def create_cache(namespace: str, max_entries: int):
+    backend = os.getenv("SCRAPE_CACHE_BACKEND", "sqlite")
+    if backend == "memory":
+        return MemoryCache(max_entries)
+
+    default_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "scrape_cache.sqlite3")
+    path = os.getenv("SCRAPE_CACHE_PATH", default_path)
+    return SQLiteCache(path, namespace, max_entries)
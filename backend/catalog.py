@@ -0,0 +1,309 @@
+import asyncio
+import bisect
+import logging
+import re
+import time
+import unicodedata
+from collections import defaultdict
+
+"""
+@file catalog.py
+@brief module providing full-text search over the products already stored in the database.
+
+@details
+every product a user adds is persisted in the 'products' collection, so searches are
+answered from an in-memory inverted index over brand, name, description and ingredients
+before falling back to scraping Incidecoder. query terms match indexed terms exactly, by
+prefix (e.g. "clean" -> "cleanser") or within one typo (e.g. "cerav" -> "cerave"), and
+every query term has to match for a product to be returned.
+"""
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+# how much a match in each field counts towards a product's score
+FIELD_WEIGHTS = {"name": 3.0, "brand": 2.0, "description": 1.0, "ingredients": 0.5}
+
+# how much each kind of term match counts, relative to an exact match
+EXACT_MATCH = 1.0
+PREFIX_MATCH = 0.7
+FUZZY_MATCH = 0.5
+
+# query terms shorter than these are not matched by prefix or within one typo
+MIN_PREFIX_LENGTH = 2
+MIN_FUZZY_LENGTH = 4
+
+logger = logging.getLogger(__name__)
+
+
+"""
+@fn tokenize
+@brief splits text into lowercase, accent-free alphanumeric terms.
+@param text text to tokenize.
+@return list of terms.
+"""
+
+
+def tokenize(text) -> list:
+    if not text:
+        return []
+    text = unicodedata.normalize("NFKD", str(text).lower())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return TOKEN_PATTERN.findall(text)
+
+
+"""
+@fn deletions
+@brief returns a term together with every variant of it missing one character.
+@param term indexed or queried term.
+@return set of variants used to find terms within one edit of each other.
+"""
+
+
+def deletions(term: str) -> set:
+    return {term} | {term[:i] + term[i + 1:] for i in range(len(term))}
+
+
+"""
+@fn within_one_edit
+@brief checks whether two terms differ by at most one insertion, deletion or substitution.
+"""
+
+
+def within_one_edit(a: str, b: str) -> bool:
+    if abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) > len(b):
+        a, b = b, a
+    i = j = edits = 0
+    while i < len(a) and j < len(b):
+        if a[i] != b[j]:
+            edits += 1
+            if edits > 1:
+                return False
+            if len(a) == len(b):
+                i += 1
+        else:
+            i += 1
+        j += 1
+    return edits + (len(b) - j) + (len(a) - i) <= 1
+
+
+"""
+@fn result_key
+@brief key used to deduplicate search results.
+@param product dictionary with "name" and "brand".
+@return tuple of the normalized name and brand.
+"""
+
+
+def result_key(product) -> tuple:
+    return (" ".join(tokenize(product.get("name"))), " ".join(tokenize(product.get("brand"))))
+
+
+"""
+@fn merge_results
+@brief merges catalog and scraped search results, dropping duplicates by name and brand.
+
+@param local results from the catalog index, kept first.
+@param remote results scraped from Incidecoder.
+@param limit maximum number of results to return.
+@return merged list of search results.
+"""
+
+
+def merge_results(local, remote, limit: int) -> list:
+    merged = []
+    seen = set()
+    for product in list(local) + list(remote):
+        key = result_key(product)
+        if key in seen:
+            continue
+        seen.add(key)
+        merged.append(product)
+        if len(merged) == limit:
+            break
+    return merged
+
+
+"""
+@class CatalogData
+@brief the inverted index itself.
+
+@details
+- postings: term -> {product id -> weight of the term in that product}.
+- products: product id -> search result returned for the product.
+- terms: sorted list of indexed terms, used for prefix matching.
+- variants: one-deletion variant -> indexed terms producing it, used for fuzzy matching.
+"""
+
+
+class CatalogData:
+    def __init__(self):
+        self.postings = defaultdict(dict)
+        self.products = {}
+        self.terms = []
+        self.variants = defaultdict(set)
+
+    @classmethod
+    def build(cls, product_docs):
+        data = cls()
+        for product in product_docs:
+            data.add(product)
+        return data
+
+    def add(self, product: dict):
+        # only products with a source page can be added through the search flow
+        if not product.get("url"):
+            return
+
+        product_id = str(product["_id"])
+        self.products[product_id] = {
+            "brand": product.get("brand"),
+            "name": product.get("name"),
+            "description": product.get("description"),
+            "image": product.get("image"),
+            "url": product.get("url"),
+        }
+
+        weights = defaultdict(float)
+        for field, field_weight in FIELD_WEIGHTS.items():
+            value = product.get(field)
+            texts = value if isinstance(value, list) else [value]
+            for text in texts:
+                for term in tokenize(text):
+                    weights[term] = max(weights[term], field_weight)
+
+        for term, weight in weights.items():
+            if term not in self.postings:
+                bisect.insort(self.terms, term)
+                if len(term) >= MIN_FUZZY_LENGTH:
+                    for variant in deletions(term):
+                        self.variants[variant].add(term)
+            self.postings[term][product_id] = weight
+
+    def matching_terms(self, query_term: str) -> dict:
+        """
+        returns indexed term -> match weight for every term the query term matches.
+        """
+        matches = {}
+        if query_term in self.postings:
+            matches[query_term] = EXACT_MATCH
+
+        if len(query_term) >= MIN_PREFIX_LENGTH:
+            start = bisect.bisect_right(self.terms, query_term)
+            for term in self.terms[start:]:
+                if not term.startswith(query_term):
+                    break
+                matches.setdefault(term, PREFIX_MATCH)
+
+        if not matches and len(query_term) >= MIN_FUZZY_LENGTH:
+            for variant in deletions(query_term):
+                for term in self.variants.get(variant, ()):
+                    if within_one_edit(query_term, term):
+                        matches.setdefault(term, FUZZY_MATCH)
+        return matches
+
+    def search(self, query: str, limit: int) -> list:
+        query_terms = list(dict.fromkeys(tokenize(query)))
+        if not query_terms:
+            return []
+
+        scores = None
+        for query_term in query_terms:
+            term_scores = defaultdict(float)
+            for term, match_weight in self.matching_terms(query_term).items():
+                for product_id, weight in self.postings[term].items():
+                    term_scores[product_id] = max(term_scores[product_id], match_weight * weight)
+
+            if scores is None:
+                scores = term_scores
+            else:
+                # every query term has to match
+                scores = {
+                    product_id: score + term_scores[product_id]
+                    for product_id, score in scores.items()
+                    if product_id in term_scores
+                }
+            if not scores:
+                return []
+
+        ranked = sorted(
+            scores.items(), key=lambda item: (-item[1], self.products[item[0]]["name"] or "")
+        )
+        return [dict(self.products[product_id]) for product_id, _ in ranked[:limit]]
+
+
+"""
+@class CatalogIndex
+@brief keeps a CatalogData index of the 'products' collection up to date.
+
+@details
+the index is built on first use. once older than refresh_interval seconds it is rebuilt in
+the background while searches keep being answered from the previous one, and the
+CPU-bound indexing runs in a worker thread, so neither blocks the event loop. products
+inserted by this worker are added straight away through add(), also to a rebuild under way.
+
+@param products_collection the MongoDB 'products' collection.
+@param refresh_interval seconds after which the index is rebuilt.
+"""
+
+
+class CatalogIndex:
+    PROJECTION = {field: 1 for field in ("brand", "name", "description", "ingredients", "image", "url")}
+
+    def __init__(self, products_collection, refresh_interval: float = 600):
+        self.products_collection = products_collection
+        self.refresh_interval = refresh_interval
+        self._data = None
+        self._loaded_at = 0.0
+        self._lock = asyncio.Lock()
+        self._refresh = None
+        # products added while a rebuild is under way, replayed into the new snapshot
+        self._added = None
+
+    async def reload(self) -> CatalogData:
+        self._added = []
+        try:
+            cursor = self.products_collection.find({"url": {"$exists": True}}, self.PROJECTION)
+            product_docs = await cursor.to_list(length=None)
+            data = await asyncio.to_thread(CatalogData.build, product_docs)
+            for product in self._added:
+                data.add(product)
+        finally:
+            self._added = None
+        self._data = data
+        self._loaded_at = time.monotonic()
+        return data
+
+    async def _refresh_in_background(self):
+        try:
+            await self.reload()
+        except Exception:
+            logger.exception("refreshing the catalog index failed")
+
+    async def get(self) -> CatalogData:
+        data = self._data
+        if data is None:
+            async with self._lock:
+                if self._data is not None:
+                    return self._data
+                return await self.reload()
+
+        stale = time.monotonic() - self._loaded_at >= self.refresh_interval
+        if stale and (self._refresh is None or self._refresh.done()):
+            self._refresh = asyncio.create_task(self._refresh_in_background())
+        return data
+
+    def add(self, product: dict):
+        if self._data is not None:
+            self._data.add(product)
+        if self._added is not None:
+            self._added.append(product)
+
+    async def close(self):
+        if self._refresh is not None:
+            self._refresh.cancel()
+
+    async def search(self, query: str, limit: int = 5) -> list:
+        data = await self.get()
+        return data.search(query, limit)
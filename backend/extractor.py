@@ -0,0 +1,88 @@
+from lxml import etree
+from lxml import html as lxml_html
+
+"""
+@file extractor.py
+@brief module extracting product fields from Incidecoder pages.
+
+@details
+pages are parsed with lxml's C parser and only the handful of elements the app needs are
+located with precompiled XPath expressions, instead of building a BeautifulSoup tree for
+every page. the extracted fields match what the previous BeautifulSoup lookups returned:
+- brand: first <a class="underline">.
+- name: <span id="product-title">.
+- description: <span id="product-details">.
+- ingredients: <a class="ingred-link black"> inside the short ingredient list.
+- image: src of the first <img> inside the first <picture>.
+the benchmark in benchmarks/bench_parse.py tracks the parse time against the saved pages in
+tests/fixtures/incidecoder.
+"""
+
+BRAND_XPATH = etree.XPath(
+    "(//a[contains(concat(' ', normalize-space(@class), ' '), ' underline ')])[1]"
+)
+TITLE_XPATH = etree.XPath("(//span[@id='product-title'])[1]")
+DETAILS_XPATH = etree.XPath("(//span[@id='product-details'])[1]")
+INGREDIENTS_XPATH = etree.XPath(
+    "(//div[@class='showmore-section ingredlist-short-like-section'])[1]"
+    "//a[@class='ingred-link black']"
+)
+IMAGE_XPATH = etree.XPath("(//picture)[1]//img[1]/@src")
+SEARCH_RESULT_XPATH = etree.XPath(
+    "//a[contains(concat(' ', normalize-space(@class), ' '), ' klavika ')"
+    " and contains(concat(' ', normalize-space(@class), ' '), ' simpletextlistitem ')]/@href"
+)
+
+
+# stands in for the parse tree of an empty page
+EMPTY_PAGE = lxml_html.fromstring("<html></html>")
+
+
+def _parse(html):
+    return lxml_html.fromstring(html) if html and html.strip() else EMPTY_PAGE
+
+
+def _first_text(root, xpath, default):
+    elements = xpath(root)
+    return elements[0].text_content().strip() if elements else default
+
+
+"""
+@fn extract_product(html)
+@brief extracts the brand, name, description, ingredients and image of a product page.
+
+@param html product page html.
+@return dictionary containing the product's brand, name, description, ingredients, and image URL.
+"""
+def extract_product(html):
+    root = _parse(html)
+    image = IMAGE_XPATH(root)
+    return {
+        "brand": _first_text(root, BRAND_XPATH, "Brand not found"),
+        "name": _first_text(root, TITLE_XPATH, "Name not found"),
+        "description": _first_text(root, DETAILS_XPATH, "Description not found"),
+        "ingredients": [link.text_content().strip() for link in INGREDIENTS_XPATH(root)],
+        "image": str(image[0]) if image else None,
+    }
+
+"""
+@fn is_parsed(product)
+@brief tells whether the name and brand of a product page were found.
+
+@param product dictionary returned by extract_product.
+@return False for pages extract_product only filled with placeholders, which must not be stored.
+"""
+def is_parsed(product):
+    return product["name"] != "Name not found" and product["brand"] != "Brand not found"
+
+"""
+@fn extract_search_results(html, limit)
+@brief extracts the product links of a search results page.
+
+@param html search results page html.
+@param limit maximum number of links to return.
+@return list of product page paths, in page order.
+"""
+def extract_search_results(html, limit):
+    root = _parse(html)
+    return [str(href) for href in SEARCH_RESULT_XPATH(root)[:limit]]
@@ -0,0 +1,194 @@
+import argparse
+import os
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+"""
+@file fixture_server.py
+@brief offline stand-in for Incidecoder replaying recorded search and product pages.
+
+@details
+serves the pages saved in tests/fixtures/incidecoder over real HTTP:
+- /search?query=... returns search_<query>.html when it was recorded (query lowercased,
+  non-alphanumerics replaced by "-"), otherwise the first recorded search page.
+- /products/<slug> returns product_<slug>.html, or 404 when it was not recorded.
+
+latency and failures can be injected to test the scraper's timeouts, retries and caches
+deterministically:
+- latency / jitter: seconds added to every response (uniform +- jitter).
+- error_rate: share of requests answered with error_status (default 503).
+- fail_first: the first n requests for every path are answered with error_status, so a
+  retry sequence can be reproduced exactly.
+the random choices use a seeded generator, and requests are counted per path.
+
+point the scraper at it with INCIDECODER_BASE_URL (see search.py), e.g.:
+    python fixture_server.py --port 8765 --latency-ms 50 --error-rate 0.05
+    INCIDECODER_BASE_URL=http://127.0.0.1:8765 uvicorn server:app
+"""
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tests", "fixtures", "incidecoder")
+
+
+def page_key(text: str) -> str:
+    return re.sub(r"[^a-z0-9]+", "-", text.lower()).strip("-")
+
+
+"""
+@class FixtureServer
+@brief threaded HTTP server replaying the recorded Incidecoder pages.
+
+@param fixtures_dir directory holding the recorded pages.
+@param host interface to listen on.
+@param port port to listen on, 0 picks a free port.
+@param latency seconds added to every response.
+@param jitter maximum random deviation from latency, in seconds.
+@param error_rate share of requests answered with error_status.
+@param fail_first number of requests per path answered with error_status before any succeeds.
+@param error_status HTTP status of injected failures.
+@param seed seed of the generator deciding latency and failures.
+"""
+
+
+class FixtureServer:
+    def __init__(
+        self,
+        fixtures_dir: str = FIXTURES_DIR,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        fail_first: int = 0,
+        error_status: int = 503,
+        seed: int = 0,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.fail_first = fail_first
+        self.error_status = error_status
+        self.requests = Counter()
+        self.errors = Counter()
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread = None
+
+        self.search_pages = {}
+        self.product_pages = {}
+        for name in sorted(os.listdir(fixtures_dir)):
+            if not name.endswith(".html"):
+                continue
+            with open(os.path.join(fixtures_dir, name)) as f:
+                html = f.read()
+            kind, _, slug = name[: -len(".html")].partition("_")
+            if kind == "search":
+                self.search_pages[slug] = html
+            elif kind == "product":
+                self.product_pages[slug] = html
+        self.default_search = next(iter(self.search_pages.values()), "<html></html>")
+
+        fixture_server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                status, body = fixture_server.respond(self.path)
+                payload = body.encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def respond(self, raw_path: str):
+        """
+        returns the status and body for a request, after the injected latency.
+        """
+        url = urlsplit(raw_path)
+        with self._lock:
+            self.requests[url.path] += 1
+            seen = self.requests[url.path]
+            delay = max(0.0, self.latency + self._rng.uniform(-self.jitter, self.jitter))
+            failed = seen <= self.fail_first or self._rng.random() < self.error_rate
+            if failed:
+                self.errors[url.path] += 1
+
+        if delay:
+            time.sleep(delay)
+        if failed:
+            return self.error_status, ""
+
+        if url.path == "/search":
+            query = parse_qs(url.query).get("query", [""])[0]
+            return 200, self.search_pages.get(page_key(query), self.default_search)
+        if url.path.startswith("/products/"):
+            page = self.product_pages.get(url.path[len("/products/"):])
+            return (200, page) if page is not None else (404, "")
+        return 404, ""
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="replay recorded Incidecoder pages")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--fixtures", default=FIXTURES_DIR)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--fail-first", type=int, default=0)
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    server = FixtureServer(
+        args.fixtures, args.host, args.port,
+        latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000,
+        error_rate=args.error_rate, fail_first=args.fail_first,
+        error_status=args.error_status, seed=args.seed,
+    )
+    print(f"serving {len(server.search_pages)} search and {len(server.product_pages)} product pages "
+          f"at {server.base_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+import argparse
+import asyncio
+import logging
+import os
+import sys
+from dotenv import load_dotenv
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+from models.schemas import SkinType
+from repository import Database
+
+"""
+@file indexes.py
+@brief indexes backing every query shape the server issues, and their bootstrap.
+
+@details
+query shapes and the index serving them:
+- users by auth0_id (every endpoint), alone or with products.{day}._id (rating
+  updates): unique auth0_id. a user has one document, so the auth0_id lookup
+  already narrows the routine match down to one document.
+- products by {name, brand} (add flow and ingestion upserts): unique name_brand.
+- products by url (add flow lookup, ingestion freshness check): url.
+- products by community_rating.<skin type>.score or .trend, descending (leaderboards):
+  <skin type>_score and <skin type>_trend, so a top-K query reads K index entries.
+- ratings by {product_id, auth0_id} (rating updates): unique product_auth0_id.
+- products, rules and ingredients by _id: the default _id index.
+loading the whole 'rules' and 'ingredients' collections and the catalog are meant to scan.
+
+the server creates missing indexes in the background on startup (see server.lifespan).
+as a migration step:
+    python indexes.py           creates missing indexes, then verifies them.
+    python indexes.py --verify  only verifies; exits with code 1 if any index is missing.
+the explain-plan test in tests/test_indexes.py fails when a repository query falls back to
+a collection scan.
+"""
+
+logger = logging.getLogger(__name__)
+
+# collection name -> indexes it needs
+INDEXES = {
+    "users": [
+        IndexModel([("auth0_id", ASCENDING)], name="auth0_id_unique", unique=True),
+    ],
+    "products": [
+        IndexModel([("name", ASCENDING), ("brand", ASCENDING)], name="name_brand_unique", unique=True),
+        IndexModel([("url", ASCENDING)], name="url"),
+        *(
+            IndexModel([(f"community_rating.{skin_type.value}.{field}", DESCENDING)],
+                       name=f"{skin_type.value}_{field}")
+            for skin_type in SkinType
+            for field in ("score", "trend")
+        ),
+    ],
+    "ratings": [
+        IndexModel(
+            [("product_id", ASCENDING), ("auth0_id", ASCENDING)], name="product_auth0_id_unique", unique=True
+        ),
+    ],
+}
+
+
+"""
+@fn ensure_indexes
+@brief creates the indexes of INDEXES that do not exist yet.
+@details each index is created on its own, so one that cannot be built (e.g. a unique index
+over duplicate documents) does not keep the others from being created.
+@param db the async database (repository.Database.db).
+@return dictionary of "collection.index" -> None when in place, or the error message.
+"""
+
+
+async def ensure_indexes(db) -> dict:
+    results = {}
+    for collection_name, indexes in INDEXES.items():
+        for index in indexes:
+            key = f"{collection_name}.{index.document['name']}"
+            try:
+                # a no-op when the index already exists with the same options
+                await db[collection_name].create_indexes([index])
+                results[key] = None
+            except OperationFailure as e:
+                results[key] = str(e)
+    return results
+
+
+"""
+@fn missing_indexes
+@brief lists the indexes of INDEXES that are absent or differ in keys or uniqueness.
+@param db the async database.
+@return list of "collection.index" names, empty when every index is in place.
+"""
+
+
+async def missing_indexes(db) -> list:
+    missing = []
+    for collection_name, indexes in INDEXES.items():
+        existing = await db[collection_name].index_information()
+        for index in indexes:
+            document = index.document
+            info = existing.get(document["name"])
+            if (
+                info is None
+                or list(info["key"]) != list(document["key"].items())
+                or bool(info.get("unique")) != bool(document.get("unique"))
+            ):
+                missing.append(f"{collection_name}.{document['name']}")
+    return missing
+
+
+"""
+@fn bootstrap_indexes
+@brief startup step creating the indexes, logging instead of failing the server.
+@details indexes that cannot be built are logged with the reason (for a unique index, the
+duplicate key to clean up) and the server keeps running without them.
+"""
+
+
+async def bootstrap_indexes(db):
+    try:
+        results = await ensure_indexes(db)
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        logger.exception("index bootstrap failed")
+        return
+    for key, error in results.items():
+        if error is not None:
+            logger.error("could not create index %s: %s", key, error)
+
+
+async def migrate(verify_only: bool) -> int:
+    database = Database(os.getenv("DB_STRING"))
+    try:
+        if not verify_only:
+            for key, error in (await ensure_indexes(database.db)).items():
+                print(f"{key}: {error or 'ok'}")
+        missing = await missing_indexes(database.db)
+    finally:
+        await database.close()
+
+    if missing:
+        print(f"missing or different indexes: {', '.join(missing)}")
+        return 1
+    print("all indexes present")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="create and verify the MongoDB indexes")
+    parser.add_argument("--verify", action="store_true", help="only check, do not create")
+    args = parser.parse_args()
+    load_dotenv()
+    return asyncio.run(migrate(args.verify))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
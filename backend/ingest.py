@@ -0,0 +1,233 @@
+import argparse
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from dotenv import load_dotenv
+import search
+from extractor import extract_product, is_parsed
+from ingredients import IngredientResolver
+from logs import configure_logging
+from ratings import empty_community_rating
+from repository import Database, ProductRepository
+
+"""
+@file ingest.py
+@brief background job pre-scraping and pre-tagging Incidecoder products into the database.
+
+@details
+crawls the Incidecoder search listings for a set of queries, fetches every product page it
+finds once, resolves the ingredient tags against the 'ingredients' collection and upserts
+the products into the 'products' collection with bulk_write. products the add flow finds
+there by url are added to a routine without scraping or tagging inside the request.
+products already stored are refreshed but keep their ingredients and tags, which the
+precomputed routine rules depend on.
+
+the crawl is polite: at most `concurrency` pages are fetched at a time, requests start at
+least `request_interval` seconds apart, failed fetches are retried with backoff by
+search.fetch_page, and pages ingested less than `max_age` ago are skipped.
+
+usage (from the backend directory):
+    python ingest.py --query cerave --query retinol [--pages 3] [--concurrency 4]
+        [--interval 0.5] [--batch-size 100] [--max-age-hours 168] [--every 86400]
+--every keeps the job running and repeats the crawl on that period (seconds). the queries
+can also be listed in a file with --queries-file, one per line.
+"""
+
+logger = logging.getLogger(__name__)
+
+
+"""
+@class IngestReport
+@brief counts of one ingestion run.
+"""
+
+
+@dataclass
+class IngestReport:
+    listed: int = 0
+    skipped: int = 0
+    fetched: int = 0
+    failed: int = 0
+    upserted: int = 0
+    modified: int = 0
+
+
+"""
+@class Pacer
+@brief spaces out request starts by at least interval seconds.
+"""
+
+
+class Pacer:
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self._lock:
+            now = time.monotonic()
+            if self._next > now:
+                await asyncio.sleep(self._next - now)
+            self._next = max(now, self._next) + self.interval
+
+
+"""
+@class Ingestor
+@brief crawls listings and bulk-upserts the products they link to.
+
+@param product_repository ProductRepository the products are written through.
+@param ingredient_resolver IngredientResolver used to tag the products.
+@param concurrency maximum number of pages fetched at a time.
+@param request_interval minimum seconds between two request starts.
+@param batch_size number of products per bulk_write.
+@param max_age seconds after which an ingested product is fetched again.
+"""
+
+
+class Ingestor:
+    def __init__(
+        self,
+        product_repository,
+        ingredient_resolver,
+        concurrency: int = 4,
+        request_interval: float = 0.5,
+        batch_size: int = 100,
+        max_age: float = 7 * 24 * 3600,
+    ):
+        self.product_repository = product_repository
+        self.ingredient_resolver = ingredient_resolver
+        self.batch_size = batch_size
+        self.max_age = max_age
+        self._limit = asyncio.Semaphore(concurrency)
+        self._pacer = Pacer(request_interval)
+
+    async def fetch(self, url, params=None):
+        async with self._limit:
+            await self._pacer.wait()
+            return await search.fetch_page(url, params)
+
+    async def list_products(self, query: str, pages: int = 1) -> list:
+        """
+        returns the product urls of the first pages of search results for query.
+        """
+        urls = []
+        for page in range(1, pages + 1):
+            params = {"query": query} if page == 1 else {"query": query, "page": page}
+            html = await self.fetch(f"{search.BASE_URL}/search", params)
+            if html is None:
+                break
+            page_urls = await asyncio.to_thread(search.parse_search_page, html, 1000)
+            if not page_urls:
+                break
+            urls.extend(page_urls)
+        return urls
+
+    async def scrape(self, url):
+        """
+        fetches, parses and tags one product page; None if it could not be fetched.
+        """
+        html = await self.fetch(url)
+        if html is None:
+            return None
+        product = await asyncio.to_thread(extract_product, html)
+        if not is_parsed(product):
+            return None
+        resolution = await self.ingredient_resolver.resolve(product["ingredients"])
+        product["tags"] = resolution.tags
+        product["url"] = url
+        product["ingested_at"] = datetime.now(timezone.utc)
+        return product
+
+    async def run(self, queries, pages: int = 1) -> IngestReport:
+        report = IngestReport()
+
+        queries = list(dict.fromkeys(queries))
+        listings = await asyncio.gather(*(self.list_products(query, pages) for query in queries))
+        urls = list(dict.fromkeys(url for listing in listings for url in listing))
+        report.listed = len(urls)
+
+        since = datetime.now(timezone.utc) - timedelta(seconds=self.max_age)
+        fresh = await self.product_repository.find_ingested_urls(urls, since) if urls else set()
+        urls = [url for url in urls if url not in fresh]
+        report.skipped = len(fresh)
+
+        # scraping and writing in batches keeps memory flat on large crawls
+        for start in range(0, len(urls), self.batch_size):
+            batch = urls[start:start + self.batch_size]
+            products = await asyncio.gather(*(self.scrape(url) for url in batch))
+            scraped = [product for product in products if product is not None]
+            report.fetched += len(scraped)
+            report.failed += len(batch) - len(scraped)
+            if scraped:
+                result = await self.product_repository.upsert_scraped(scraped, empty_community_rating())
+                report.upserted += result.upserted_count
+                report.modified += result.modified_count
+
+        logger.info("ingestion finished", extra={"report": vars(report)})
+        return report
+
+
+def read_queries(args) -> list:
+    queries = list(args.query or [])
+    if args.queries_file:
+        with open(args.queries_file) as f:
+            queries.extend(line.strip() for line in f if line.strip())
+    return list(dict.fromkeys(queries))
+
+
+async def run_job(args):
+    database = Database(os.getenv("DB_STRING"))
+    ingestor = Ingestor(
+        ProductRepository(database.products),
+        IngredientResolver(database.ingredients, preload=True),
+        concurrency=args.concurrency,
+        request_interval=args.interval,
+        batch_size=args.batch_size,
+        max_age=args.max_age_hours * 3600,
+    )
+    queries = read_queries(args)
+    try:
+        while True:
+            started = time.monotonic()
+            try:
+                report = await ingestor.run(queries, args.pages)
+                print(f"listed {report.listed}, skipped {report.skipped} fresh, fetched {report.fetched}, "
+                      f"failed {report.failed}, inserted {report.upserted}, updated {report.modified}")
+            except Exception:
+                if not args.every:
+                    raise
+                # a failed run must not stop the schedule
+                logger.exception("ingestion run failed")
+            if not args.every:
+                break
+            await asyncio.sleep(max(0.0, args.every - (time.monotonic() - started)))
+    finally:
+        await search.close_client()
+        await database.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="pre-scrape Incidecoder products into the database")
+    parser.add_argument("--query", action="append", help="search listing to crawl (repeatable)")
+    parser.add_argument("--queries-file", default=None)
+    parser.add_argument("--pages", type=int, default=1, help="result pages crawled per query")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--interval", type=float, default=0.5, help="seconds between request starts")
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--max-age-hours", type=float, default=7 * 24)
+    parser.add_argument("--every", type=float, default=None, help="repeat the crawl every N seconds")
+    args = parser.parse_args()
+    if not read_queries(args):
+        parser.error("give at least one --query or a --queries-file")
+
+    load_dotenv()
+    configure_logging()
+    asyncio.run(run_job(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+import asyncio
+import time
+from collections import Counter
+from typing import List, NamedTuple
+
+"""
+@file ingredients.py
+@brief module resolving a product's ingredient list into property tags.
+
+@details
+the 'ingredients' collection maps a normalized ingredient name to the property tags
+(categories) it belongs to. a whole ingredient list is resolved at once, either with a
+single $in query or from a preloaded in-process dictionary of the collection, and the
+ingredients that could not be resolved are reported so coverage gaps can be tracked.
+"""
+
+
+"""
+@class TagResolution
+@brief result of resolving an ingredient list.
+
+@details
+- tags: sorted, de-duplicated property tags of the resolved ingredients.
+- unresolved: normalized ingredient names missing from the 'ingredients' collection.
+"""
+
+
+class TagResolution(NamedTuple):
+    tags: List[str]
+    unresolved: List[str]
+
+
+"""
+@fn normalize_ingredient
+@brief normalizes an ingredient name into the key used by the 'ingredients' collection.
+@param ingredient ingredient name as scraped from the product page.
+@return lowercased ingredient name with spaces removed.
+"""
+
+
+def normalize_ingredient(ingredient: str) -> str:
+    return ingredient.lower().replace(" ", "")
+
+
+"""
+@class IngredientResolver
+@brief resolves ingredient lists to tags against the 'ingredients' collection.
+
+@param ingredients_collection the MongoDB 'ingredients' collection.
+@param preload if True, the whole collection is kept in memory and refreshed every
+       refresh_interval seconds instead of being queried per product.
+@param refresh_interval seconds after which the preloaded dictionary is reloaded.
+"""
+
+
+class IngredientResolver:
+    def __init__(self, ingredients_collection, preload: bool = False, refresh_interval: float = 3600):
+        self.ingredients_collection = ingredients_collection
+        self.preload = preload
+        self.refresh_interval = refresh_interval
+        # counts how often each unresolved ingredient was seen
+        self.coverage_gaps = Counter()
+        self._categories = None
+        self._loaded_at = 0.0
+        self._lock = asyncio.Lock()
+
+    async def reload(self) -> dict:
+        cursor = self.ingredients_collection.find({}, {"categories": 1})
+        categories = {doc["_id"]: doc.get("categories", []) async for doc in cursor}
+        self._categories = categories
+        self._loaded_at = time.monotonic()
+        return categories
+
+    async def _lookup(self, names) -> dict:
+        if self.preload:
+            categories = self._categories
+            if categories is None or time.monotonic() - self._loaded_at >= self.refresh_interval:
+                async with self._lock:
+                    if self._categories is categories:
+                        categories = await self.reload()
+                    else:
+                        categories = self._categories
+            return {name: categories[name] for name in names if name in categories}
+
+        cursor = self.ingredients_collection.find(
+            {"_id": {"$in": list(names)}}, {"categories": 1}
+        )
+        return {doc["_id"]: doc.get("categories", []) async for doc in cursor}
+
+    async def resolve(self, ingredients) -> TagResolution:
+        # keeping the first occurrence order for the unresolved report
+        names = list(dict.fromkeys(normalize_ingredient(i) for i in ingredients))
+        if not names:
+            return TagResolution(tags=[], unresolved=[])
+
+        found = await self._lookup(names)
+
+        tags = set()
+        unresolved = []
+        for name in names:
+            if name in found:
+                tags.update(found[name] or [])
+            else:
+                unresolved.append(name)
+
+        self.coverage_gaps.update(unresolved)
+        return TagResolution(tags=sorted(tags), unresolved=unresolved)
@@ -0,0 +1,147 @@
+import json
+import logging
+import os
+import random
+import sys
+import time
+
+"""
+@file logs.py
+@brief module configuring the backend's structured, leveled logging.
+
+@details
+every module logs through logging.getLogger(__name__) with %-style arguments, so payloads
+such as user documents or rule results are only turned into text when a handler actually
+emits the record. expensive summaries can be wrapped in Lazy so they are not even computed
+unless the level is enabled.
+
+configuration is read from the environment:
+- LOG_LEVEL: level of every module (default INFO).
+- LOG_LEVELS: per-module overrides, e.g. "search=DEBUG,rules=WARNING".
+- LOG_FORMAT: "json" (default, one object per line) or "text".
+- LOG_DEBUG_SAMPLE_RATE: fraction of DEBUG records emitted (default 1.0), so debug logging
+  can be left on for a busy worker without writing every record.
+"""
+
+# third-party loggers that log every request at INFO
+QUIET_LOGGERS = {"httpx": "WARNING", "httpcore": "WARNING"}
+
+# attributes every LogRecord has; anything else was passed through extra=
+RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName"}
+
+
+"""
+@class Lazy
+@brief defers computing a log argument until the record is formatted.
+
+@param function zero-argument callable returning the value to log.
+"""
+
+
+class Lazy:
+    __slots__ = ("function",)
+
+    def __init__(self, function):
+        self.function = function
+
+    def __str__(self):
+        return str(self.function())
+
+    __repr__ = __str__
+
+
+"""
+@class JsonFormatter
+@brief formats records as single-line JSON objects.
+@details fields passed with extra= are added to the object next to the message.
+"""
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created))
+            + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+"""
+@class DebugSampler
+@brief handler filter passing every record above DEBUG and a random sample of DEBUG ones.
+
+@param rate fraction of DEBUG records to keep, between 0 and 1.
+"""
+
+
+class DebugSampler(logging.Filter):
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG or self.rate >= 1:
+            return True
+        return random.random() < self.rate
+
+
+"""
+@fn parse_levels
+@brief parses a LOG_LEVELS specification.
+@param spec comma-separated "module=LEVEL" pairs.
+@return dictionary of logger name -> level name.
+"""
+
+
+def parse_levels(spec) -> dict:
+    levels = {}
+    for item in (spec or "").split(","):
+        if "=" not in item:
+            continue
+        name, level = item.split("=", 1)
+        levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+"""
+@fn configure_logging
+@brief installs the backend's log handler and levels on the root logger.
+
+@details
+calling it again replaces the handler it installed before, so levels can be changed at
+runtime (e.g. by the logging benchmark).
+
+@param level default level, LOG_LEVEL when not given.
+@param levels per-module levels, LOG_LEVELS when not given.
+@param stream stream the records are written to (default stderr).
+"""
+
+
+def configure_logging(level=None, levels=None, stream=None):
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if getattr(handler, "legallychemie", False):
+            root.removeHandler(handler)
+
+    handler = logging.StreamHandler(stream or sys.stderr)
+    handler.legallychemie = True
+    if os.getenv("LOG_FORMAT", "json") == "text":
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    else:
+        handler.setFormatter(JsonFormatter())
+    handler.addFilter(DebugSampler(float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "1"))))
+    root.addHandler(handler)
+
+    root.setLevel((level or os.getenv("LOG_LEVEL", "INFO")).upper())
+    if levels is None:
+        levels = parse_levels(os.getenv("LOG_LEVELS"))
+    for name, module_level in {**QUIET_LOGGERS, **levels}.items():
+        logging.getLogger(name).setLevel(module_level)
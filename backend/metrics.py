@@ -0,0 +1,161 @@
+import time
+from prometheus_client import CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from pymongo import monitoring
+
+"""
+@file metrics.py
+@brief module collecting the backend's Prometheus metrics.
+
+@details
+- http_request_duration_seconds: per-route request latency, recorded by the server's
+  timing middleware. routes are labelled by their path template (e.g. "/{day}/rules/"), so
+  ids in urls do not create new series.
+- mongodb_commands_total / mongodb_command_duration_seconds: every command the shared
+  AsyncMongoClient sends, through PyMongo command monitoring (see CommandMetrics).
+- scrape_fetches_total / scrape_fetch_duration_seconds: Incidecoder fetches by outcome.
+- scrape_coalesced_total: product fetches and searches that joined an identical one
+  already in flight instead of scraping again.
+- rule_evaluation_duration_seconds: full routine rule evaluations.
+- scrape_cache_hits_total / scrape_cache_misses_total / scrape_cache_hit_ratio: read from
+  the caches registered with track_cache() whenever /metrics is scraped.
+
+metrics live in REGISTRY and are per process; with several uvicorn workers each worker
+reports its own values.
+"""
+
+REGISTRY = CollectorRegistry()
+
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency by route.",
+    ["method", "route", "status"],
+    registry=REGISTRY,
+)
+MONGO_COMMANDS = Counter(
+    "mongodb_commands_total",
+    "MongoDB commands sent, by command name and outcome.",
+    ["command", "outcome"],
+    registry=REGISTRY,
+)
+MONGO_COMMAND_DURATION = Histogram(
+    "mongodb_command_duration_seconds",
+    "MongoDB command round-trip time by command name.",
+    ["command"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+    registry=REGISTRY,
+)
+SCRAPE_FETCHES = Counter(
+    "scrape_fetches_total",
+    "Incidecoder page fetches by outcome (HTTP status or 'error').",
+    ["outcome"],
+    registry=REGISTRY,
+)
+SCRAPE_COALESCED = Counter(
+    "scrape_coalesced_total",
+    "Scrapes answered by an identical scrape already in flight, by kind.",
+    ["kind"],
+    registry=REGISTRY,
+)
+SCRAPE_FETCH_DURATION = Histogram(
+    "scrape_fetch_duration_seconds",
+    "Incidecoder page fetch latency.",
+    registry=REGISTRY,
+)
+RULE_EVALUATION_DURATION = Histogram(
+    "rule_evaluation_duration_seconds",
+    "Time spent evaluating a whole routine against the rule index.",
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1),
+    registry=REGISTRY,
+)
+
+
+"""
+@class CommandMetrics
+@brief PyMongo command listener counting and timing every command.
+@details passed to the client through event_listeners (see repository.Database).
+"""
+
+
+class CommandMetrics(monitoring.CommandListener):
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        MONGO_COMMANDS.labels(event.command_name, "succeeded").inc()
+        MONGO_COMMAND_DURATION.labels(event.command_name).observe(event.duration_micros / 1e6)
+
+    def failed(self, event):
+        MONGO_COMMANDS.labels(event.command_name, "failed").inc()
+        MONGO_COMMAND_DURATION.labels(event.command_name).observe(event.duration_micros / 1e6)
+
+
+"""
+@class CacheCollector
+@brief exposes the hit and miss counters of the scrape caches.
+"""
+
+
+class CacheCollector:
+    def __init__(self):
+        self.caches = {}
+
+    def collect(self):
+        hits = CounterMetricFamily(
+            "scrape_cache_hits", "Scrape cache hits by cache.", labels=["cache"]
+        )
+        misses = CounterMetricFamily(
+            "scrape_cache_misses", "Scrape cache misses by cache.", labels=["cache"]
+        )
+        ratio = GaugeMetricFamily(
+            "scrape_cache_hit_ratio", "Share of scrape cache lookups that hit.", labels=["cache"]
+        )
+        for name, cache in self.caches.items():
+            hits.add_metric([name], cache.hits)
+            misses.add_metric([name], cache.misses)
+            lookups = cache.hits + cache.misses
+            ratio.add_metric([name], cache.hits / lookups if lookups else 0)
+        yield hits
+        yield misses
+        yield ratio
+
+
+cache_collector = CacheCollector()
+REGISTRY.register(cache_collector)
+
+
+"""
+@fn track_cache
+@brief registers a cache whose hits and misses are reported at /metrics.
+@param name label of the cache.
+@param cache any cache with hits and misses counters (see cache.py).
+"""
+
+
+def track_cache(name: str, cache):
+    cache_collector.caches[name] = cache
+
+
+"""
+@fn observe_request
+@brief records the latency of one HTTP request.
+@param method HTTP method.
+@param route path template of the matched route.
+@param status response status code.
+@param started time.perf_counter() value taken when the request arrived.
+"""
+
+
+def observe_request(method: str, route: str, status: int, started: float):
+    REQUEST_DURATION.labels(method, route, str(status)).observe(time.perf_counter() - started)
+
+
+"""
+@fn render
+@brief renders every metric in the Prometheus text exposition format.
+@return the metrics page as bytes.
+"""
+
+
+def render() -> bytes:
+    return generate_latest(REGISTRY)
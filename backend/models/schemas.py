@@ -18,4 +18,8 @@ class SkinType(str, Enum):
     normal = "normal"
     combination = "combination" 
     sensitive = "sensitive"
-    
\ No newline at end of file
+    
+
+class LeaderboardKind(str, Enum):
+    top = "top"
+    trending = "trending"
@@ -0,0 +1,180 @@
+import asyncio
+import os
+import secrets
+import sqlite3
+import threading
+from collections import defaultdict
+
+"""
+@file rating_queue.py
+@brief durable local queue of community rating changes waiting to be folded into MongoDB.
+
+@details
+rating changes ({product, skin type, sum change, count change}) are appended to a SQLite
+table shared by every uvicorn worker on the machine, and a background task folds them into
+the products in batches (see ratings.CommunityRatingsManager.flush). a burst of ratings on
+one product then costs one product update per batch instead of one per rating.
+
+folding is exactly-once across crashes and concurrent folders. a batch is claimed as "every
+event up to sequence number N" before it is written, and kept claimed until its events are
+deleted, so a folder restarting after a crash replays the very same batch. every product
+update records N under rating_queue.<queue id> and only applies while the stored value is
+lower, so a replayed or concurrently folded batch is applied once.
+
+the queue id is drawn at random when the SQLite file is created and stored in it. sequence
+numbers start again at 1 in a new file, so a new file must never reuse the id the products
+already record a higher N for, or its batches would be skipped.
+
+SQLite calls block while another worker holds the write lock, so the event loop uses the
+a-prefixed variants, which run them in a worker thread.
+"""
+
+
+"""
+@class RatingQueue
+@brief SQLite-backed queue of rating changes.
+@param path path of the SQLite database file.
+@param queue_id identifier of the queue, the one stored in the file when not given.
+"""
+
+
+class RatingQueue:
+    def __init__(self, path: str, queue_id: str = None):
+        self.path = path
+        self._local = threading.local()
+
+        connection = self._connection()
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS rating_events ("
+            " seq INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " product_id TEXT NOT NULL,"
+            " skin_type TEXT NOT NULL,"
+            " sum_change INTEGER NOT NULL,"
+            " count_change INTEGER NOT NULL)"
+        )
+        connection.execute(
+            "CREATE INDEX IF NOT EXISTS rating_events_product ON rating_events (product_id)"
+        )
+        # at most one claimed batch, as the highest sequence number it covers
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS rating_claim (id INTEGER PRIMARY KEY CHECK (id = 1), upto INTEGER NOT NULL)"
+        )
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS rating_queue_meta (id INTEGER PRIMARY KEY CHECK (id = 1), queue_id TEXT NOT NULL)"
+        )
+        # the first worker opening a new file picks its id, the others read it back
+        connection.execute(
+            "INSERT OR IGNORE INTO rating_queue_meta (id, queue_id) VALUES (1, ?)", (secrets.token_hex(8),)
+        )
+        stored_id = connection.execute("SELECT queue_id FROM rating_queue_meta WHERE id = 1").fetchone()[0]
+        self.queue_id = queue_id or stored_id
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite connections must not be shared between threads
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            # WAL lets several workers read while one writes
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def append(self, product_id, changes: dict):
+        """
+        queues the sum and count changes of one rating (skin type -> (sum change, count change)).
+        """
+        self._connection().executemany(
+            "INSERT INTO rating_events (product_id, skin_type, sum_change, count_change) VALUES (?, ?, ?, ?)",
+            [(str(product_id), skin_type, sum_change, count_change)
+             for skin_type, (sum_change, count_change) in changes.items()],
+        )
+
+    def pending(self, product_ids) -> dict:
+        """
+        returns the queued changes of the given products, summed per product and skin type.
+        """
+        product_ids = [str(product_id) for product_id in product_ids]
+        if not product_ids:
+            return {}
+        rows = self._connection().execute(
+            "SELECT product_id, skin_type, SUM(sum_change), SUM(count_change) FROM rating_events"
+            f" WHERE product_id IN ({', '.join('?' * len(product_ids))})"
+            " GROUP BY product_id, skin_type",
+            product_ids,
+        ).fetchall()
+        return self._group(rows)
+
+    def claim(self, limit: int):
+        """
+        returns the claimed batch as (upto, {product id: {skin type: (sum, count)}}), claiming
+        the next limit events first if no batch is claimed; None when the queue is empty.
+        """
+        connection = self._connection()
+        connection.execute(
+            "INSERT OR IGNORE INTO rating_claim (id, upto)"
+            " SELECT 1, upto FROM (SELECT MAX(seq) AS upto FROM"
+            " (SELECT seq FROM rating_events ORDER BY seq LIMIT ?)) WHERE upto IS NOT NULL",
+            (limit,),
+        )
+        row = connection.execute("SELECT upto FROM rating_claim WHERE id = 1").fetchone()
+        if row is None:
+            return None
+        upto = row[0]
+        rows = connection.execute(
+            "SELECT product_id, skin_type, SUM(sum_change), SUM(count_change) FROM rating_events"
+            " WHERE seq <= ? GROUP BY product_id, skin_type",
+            (upto,),
+        ).fetchall()
+        return upto, self._group(rows)
+
+    def acknowledge(self, upto: int):
+        """
+        drops the events of a batch once it has been folded and releases its claim.
+        """
+        connection = self._connection()
+        connection.execute("DELETE FROM rating_events WHERE seq <= ?", (upto,))
+        # a concurrent folder may already have claimed the next batch
+        connection.execute("DELETE FROM rating_claim WHERE id = 1 AND upto = ?", (upto,))
+
+    def size(self) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM rating_events").fetchone()[0]
+
+    async def aappend(self, product_id, changes: dict):
+        await asyncio.to_thread(self.append, product_id, changes)
+
+    async def apending(self, product_ids) -> dict:
+        return await asyncio.to_thread(self.pending, list(product_ids))
+
+    async def aclaim(self, limit: int):
+        return await asyncio.to_thread(self.claim, limit)
+
+    async def aacknowledge(self, upto: int):
+        await asyncio.to_thread(self.acknowledge, upto)
+
+    @staticmethod
+    def _group(rows) -> dict:
+        grouped = defaultdict(dict)
+        for product_id, skin_type, sum_change, count_change in rows:
+            grouped[product_id][skin_type] = (sum_change, count_change)
+        return dict(grouped)
+
+
+"""
+@fn create_rating_queue
+@brief creates the rating queue configured through the environment.
+
+@details
+RATING_WRITE_BEHIND=0 disables the queue, so ratings are folded into the products at once;
+RATING_QUEUE_PATH sets the SQLite file (default "rating_queue.sqlite3" next to this module).
+
+@return a RatingQueue, or None when write-behind is disabled.
+"""
+
+
+def create_rating_queue():
+    if os.getenv("RATING_WRITE_BEHIND", "1") == "0":
+        return None
+
+    default_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "rating_queue.sqlite3")
+    return RatingQueue(os.getenv("RATING_QUEUE_PATH", default_path))
@@ -1,70 +1,376 @@
+import asyncio
+import logging
+import math
+from datetime import datetime, timezone
+from typing import Optional
 from bson import ObjectId
+from pymongo import ReturnDocument, UpdateOne
+from models.schemas import SkinType
 
 """
 @file ratings.py
 @brief Module providing functionalities to manage community ratings for products.
 
 @details
-methods to add or update user-specific ratings for products 
-and retrieve the aggregated community ratings, categorized by skin types.
+a product's community_rating holds {"sum", "count", "average"} per skin type. the average
+is maintained at write time, so reads project the totals (RATING_TOTALS_PROJECTION) and
+never average over ratings. every change is a single pipeline update on the product
+document, so concurrent ratings of the same product never overwrite each other's changes.
+
+with a rating queue (see rating_queue.py), rate() only records the user's rating and
+queues the change; flush() folds the queued changes into the products in batched
+bulk_writes, run periodically by run_folding(). reads add the changes still queued on this
+machine to the stored totals (community_averages' pending argument), so a user sees their
+rating counted at once.
+
+each user's own rating of a product is a document of the 'ratings' collection
+({product_id, auth0_id, skin_type, rating, updated_at}, unique per product and user), so
+product documents stay the same size however many people rate them.
+
+for the leaderboards, every rated skin type also keeps:
+- score: bayesian average (PRIOR_WEIGHT * PRIOR_MEAN + sum) / (PRIOR_WEIGHT + count), so a
+  product with a few high ratings does not outrank one with many. the prior is fixed, so a
+  rating change only updates the product it rates.
+- trend: ln of the number of ratings received, each decayed with a half-life of
+  TREND_HALF_LIFE_DAYS. it is stored in log space relative to TREND_EPOCH, so older
+  ratings never have to be decayed in place and products still compare correctly.
+both are maintained by the same update as the totals and served from descending indexes
+(see indexes.py and ProductRepository.find_leaderboard).
+
+products written before this model keep [sum, count] pairs per skin type, or the older
+communityRatings structure with its per-user userRatings map; migrate() converts them.
+"""
+
+logger = logging.getLogger(__name__)
+
+# bayesian average prior: PRIOR_WEIGHT virtual ratings of PRIOR_MEAN
+PRIOR_MEAN = 3.0
+PRIOR_WEIGHT = 5
+# trending ratings count half as much after this many days
+TREND_HALF_LIFE_DAYS = 3.0
+TREND_EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+# projection of the rating totals and precomputed average of every skin type
+RATING_TOTALS_PROJECTION = {
+    f"community_rating.{skin_type.value}.{field}": 1
+    for skin_type in SkinType
+    for field in ("sum", "count", "average")
+}
+
+
+"""
+@fn empty_community_rating
+@brief community_rating of a new product: no ratings for any skin type.
+"""
+
+
+def empty_community_rating() -> dict:
+    return {skin_type.value: {"sum": 0, "count": 0, "average": 0} for skin_type in SkinType}
+
+
+"""
+@fn community_averages
+@brief reads the average rating per skin type out of a product's community_rating.
+@details the stored average is used as is unless changes to the skin type are still queued,
+in which case the average is taken over the stored totals plus the queued changes.
+@param community_rating the product's stored (or projected) community_rating.
+@param pending queued changes of the product, skin type -> (sum change, count change).
+@return dictionary of skin type -> average rating (0 when nobody rated it yet).
+"""
+
+
+def community_averages(community_rating: dict, pending: dict = None) -> dict:
+    pending = pending or {}
+    averages = {}
+    for skin_type in {**community_rating, **pending}:
+        rating = community_rating.get(skin_type, {})
+        if skin_type not in pending:
+            averages[skin_type] = rating.get("average", 0)
+            continue
+        sum_change, count_change = pending[skin_type]
+        rating_sum = rating.get("sum", 0) + sum_change
+        rating_count = rating.get("count", 0) + count_change
+        averages[skin_type] = rating_sum / rating_count if rating_count > 0 else 0
+    return averages
+
+
+"""
+@fn bayesian_score
+@brief leaderboard score of a skin type's ratings, pulled towards PRIOR_MEAN when few.
+"""
+
+
+def bayesian_score(rating_sum: float, rating_count: int) -> float:
+    return (PRIOR_WEIGHT * PRIOR_MEAN + rating_sum) / (PRIOR_WEIGHT + rating_count)
+
+
+"""
+@fn trend_term
+@brief log-space weight of count new ratings received at now (see the file description).
+"""
+
+
+def trend_term(count: int, now: datetime) -> float:
+    days = (now - TREND_EPOCH).total_seconds() / 86400
+    return math.log(count) + days * math.log(2) / TREND_HALF_LIFE_DAYS
+
+
+"""
+@fn fold_pipeline
+@brief update pipeline adding rating sums and counts per skin type and refreshing the
+averages, leaderboard scores and trends.
+@param changes dictionary of skin type -> (sum change, count change).
+@param now time the new ratings were received (default: now).
+@return the update pipeline, applied atomically to one product document.
+"""
+
+
+def fold_pipeline(changes: dict, now: datetime = None) -> list:
+    now = now or datetime.now(timezone.utc)
+    totals = {}
+    averages = {}
+    for skin_type, (sum_change, count_change) in changes.items():
+        field = f"community_rating.{skin_type}"
+        totals[f"{field}.sum"] = {"$add": [{"$ifNull": [f"${field}.sum", 0]}, sum_change]}
+        totals[f"{field}.count"] = {"$add": [{"$ifNull": [f"${field}.count", 0]}, count_change]}
+        if count_change > 0:
+            # ln(e^trend + e^term), computed around the larger term so it cannot overflow
+            term = trend_term(count_change, now)
+            trend = f"${field}.trend"
+            high = {"$max": [trend, term]}
+            low = {"$min": [trend, term]}
+            totals[f"{field}.trend"] = {
+                "$cond": [
+                    {"$eq": [{"$ifNull": [trend, None]}, None]},
+                    term,
+                    {"$add": [high, {"$ln": {"$add": [1, {"$exp": {"$subtract": [low, high]}}]}}]},
+                ]
+            }
+        averages[f"{field}.average"] = {
+            "$cond": [
+                {"$gt": [f"${field}.count", 0]},
+                {"$divide": [f"${field}.sum", f"${field}.count"]},
+                0,
+            ]
+        }
+        averages[f"{field}.score"] = {
+            "$divide": [
+                {"$add": [PRIOR_WEIGHT * PRIOR_MEAN, f"${field}.sum"]},
+                {"$add": [PRIOR_WEIGHT, f"${field}.count"]},
+            ]
+        }
+    return [{"$set": totals}, {"$set": averages}]
+
+
+"""
+@fn fold_updates
+@brief product updates folding a claimed batch of the rating queue, each applied only once.
+@details every update records upto under rating_queue.<queue_id> and only matches while
+the product records a lower value, so a replayed batch leaves the product unchanged.
+@param queue_id identifier of the queue the batch was claimed from.
+@param upto highest sequence number of the batch.
+@param changes product id -> {skin type -> (sum change, count change)}.
+@param now time the new ratings were received (default: now).
+@return list of (filter, update pipeline) pairs, one per product.
+"""
+
+
+def fold_updates(queue_id: str, upto: int, changes: dict, now: datetime = None) -> list:
+    now = now or datetime.now(timezone.utc)
+    applied_field = f"rating_queue.{queue_id}"
+    updates = []
+    for product_id, product_changes in changes.items():
+        pipeline = fold_pipeline(product_changes, now)
+        pipeline[0]["$set"][applied_field] = upto
+        updates.append(
+            ({"_id": ObjectId(product_id), applied_field: {"$not": {"$gte": upto}}}, pipeline)
+        )
+    return updates
+
+
+"""
+@fn rating_changes
+@brief sum and count changes of the community ratings when a user's rating changes.
+@param previous the user's previous rating document, None if they had not rated it.
+@param skin_type the user's current skin type.
+@param rating the new rating.
+@return dictionary of skin type -> (sum change, count change).
+"""
+
+
+def rating_changes(previous: Optional[dict], skin_type: str, rating: int) -> dict:
+    if previous is None:
+        return {skin_type: (rating, 1)}
+    if previous["skin_type"] == skin_type:
+        return {skin_type: (rating - previous["rating"], 0)}
+    # the user changed skin type since: the rating moves to the new skin type
+    return {previous["skin_type"]: (-previous["rating"], -1), skin_type: (rating, 1)}
+
+
+"""
+@class CommunityRatingsManager
+@brief records users' ratings and keeps the products' community ratings in step.
+@param products_collection the async 'products' collection.
+@param ratings_collection the async 'ratings' collection of per-user ratings.
+@param queue optional RatingQueue the changes are written behind to.
 """
 
 
 class CommunityRatingsManager:
-    def __init__(self, products_collection):
+    def __init__(self, products_collection, ratings_collection, queue=None):
         self.products_collection = products_collection
+        self.ratings_collection = ratings_collection
+        self.queue = queue
 
-    def add_or_update_rating(self, product_id: ObjectId, user_id: str, skin_type: str, rating: int) -> str:
-        #find product in database
-        product = self.products_collection.find_one({"_id": product_id})
-        if not product:
+    async def fold(self, product_id: ObjectId, changes: dict) -> bool:
+        """
+        applies rating sum and count changes to a product; False if the product does not exist.
+        """
+        update_result = await self.products_collection.update_one(
+            {"_id": product_id}, fold_pipeline(changes)
+        )
+        return update_result.matched_count > 0
+
+    async def rate(self, product_id: ObjectId, user_id: str, skin_type: str, rating: int) -> str:
+        """
+        records a user's rating of a product and folds the difference into the community
+        rating. returns "added", "updated", "unchanged" or "product_not_found".
+        """
+        previous = await self.ratings_collection.find_one_and_update(
+            {"product_id": product_id, "auth0_id": user_id},
+            {"$set": {"skin_type": skin_type, "rating": rating, "updated_at": datetime.now(timezone.utc)}},
+            projection={"_id": 0, "skin_type": 1, "rating": 1},
+            upsert=True,
+            return_document=ReturnDocument.BEFORE,
+        )
+        if previous is not None and previous["skin_type"] == skin_type and previous["rating"] == rating:
+            return "unchanged"
+
+        changes = rating_changes(previous, skin_type, rating)
+        if self.queue is not None:
+            # folded by flush(); queued ratings of a missing product are dropped there
+            await self.queue.aappend(product_id, changes)
+        elif not await self.fold(product_id, changes):
+            await self.ratings_collection.delete_one({"product_id": product_id, "auth0_id": user_id})
             return "product_not_found"
+        return "added" if previous is None else "updated"
 
-        #initialize communityRatings structure
-        if "communityRatings" not in product:
-            product["communityRatings"] = {}
+    async def pending(self, product_ids) -> dict:
+        """
+        returns the queued changes of the products by product id string (empty without a queue).
+        """
+        return await self.queue.apending(product_ids) if self.queue is not None else {}
 
-        if skin_type not in product["communityRatings"]:
-            product["communityRatings"][skin_type] = {
-                #track user-specific ratings
-                "userRatings": {},  
-                "totalRating": 0,
-                "ratingCount": 0,
-            }
+    async def flush(self, batch_size: int = 1000) -> int:
+        """
+        folds one batch of queued changes into the products with a single bulk_write; returns
+        the number of products in the batch (at least 1), or 0 once the queue is empty.
+        """
+        if self.queue is None:
+            return 0
+        batch = await self.queue.aclaim(batch_size)
+        if batch is None:
+            return 0
 
-        skin_type_data = product["communityRatings"][skin_type]
+        upto, changes = batch
+        requests = [
+            UpdateOne(query, pipeline)
+            for query, pipeline in fold_updates(self.queue.queue_id, upto, changes)
+        ]
+        if requests:
+            await self.products_collection.bulk_write(requests, ordered=False)
+        await self.queue.aacknowledge(upto)
+        return max(len(requests), 1)
 
-        if 'userRatings' not in skin_type_data:
-            skin_type_data['userRatings'] = {}
+    async def run_folding(self, interval: float = 1.0, batch_size: int = 1000):
+        """
+        background task flushing the queue every interval seconds until cancelled.
+        """
+        while True:
+            try:
+                while await self.flush(batch_size):
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # the batch stays claimed and is retried on the next round
+                logger.exception("folding queued ratings failed")
+            await asyncio.sleep(interval)
 
-        #default action if new rating
-        action = "added"  
+    async def get_community_ratings(self, product_id: ObjectId) -> dict:
+        """
+        returns the product's average and number of ratings per skin type.
+        """
+        product = await self.products_collection.find_one({"_id": product_id}, RATING_TOTALS_PROJECTION)
+        if not product:
+            return {}
+        community_rating = product.get("community_rating", {})
+        pending = (await self.pending([product_id])).get(str(product_id), {})
+        return {
+            skin_type: {
+                "average": average,
+                "count": community_rating.get(skin_type, {}).get("count", 0) + pending.get(skin_type, (0, 0))[1],
+            }
+            for skin_type, average in community_averages(community_rating, pending).items()
+        }
 
-        #check if user previously rated the product
-        previous_rating = skin_type_data["userRatings"].get(user_id)
-        if previous_rating is not None:
-            #adjust totalRating
-            skin_type_data["totalRating"] -= previous_rating
-            action = "updated"
-        else:
-            #increment ratingCount
-            skin_type_data["ratingCount"] += 1
+    async def migrate(self) -> int:
+        """
+        converts products still using an older rating structure; returns how many changed.
+        each update only matches the product while it still has the old structure, so
+        concurrent runs (e.g. one per worker) do not fold the same ratings twice.
+        """
+        migrated = 0
+        legacy = {"$or": [
+            {"communityRatings": {"$exists": True}},
+            *({f"community_rating.{skin_type.value}": {"$type": "array"}} for skin_type in SkinType),
+            # rated before leaderboard scores were kept
+            *({
+                f"community_rating.{skin_type.value}.count": {"$gt": 0},
+                f"community_rating.{skin_type.value}.score": {"$exists": False},
+            } for skin_type in SkinType),
+        ]}
+        cursor = self.products_collection.find(legacy, {"community_rating": 1, "communityRatings": 1})
+        async for product in cursor:
+            community_rating = empty_community_rating()
+            for skin_type, rating in product.get("community_rating", {}).items():
+                if isinstance(rating, list):
+                    community_rating[skin_type] = {"sum": rating[0], "count": rating[1]}
+                else:
+                    community_rating[skin_type] = dict(rating)
 
-        #update new rating
-        skin_type_data["userRatings"][user_id] = rating
-        skin_type_data["totalRating"] += rating
+            user_ratings = []
+            for skin_type, ratings in product.get("communityRatings", {}).items():
+                entry = community_rating.setdefault(skin_type, {"sum": 0, "count": 0})
+                entry["sum"] += ratings.get("totalRating", 0)
+                entry["count"] += ratings.get("ratingCount", 0)
+                user_ratings.extend(
+                    (user_id, skin_type, rating) for user_id, rating in ratings.get("userRatings", {}).items()
+                )
+            for entry in community_rating.values():
+                entry["average"] = entry["sum"] / entry["count"] if entry["count"] > 0 else 0
+                if entry["count"] > 0:
+                    entry["score"] = bayesian_score(entry["sum"], entry["count"])
 
-        #updated product data in the database
-        update_result = self.products_collection.update_one(
-            {"_id": product_id},
-            {"$set": {f"communityRatings.{skin_type}": skin_type_data}}
-        )
+            if user_ratings:
+                await self.ratings_collection.bulk_write([
+                    UpdateOne(
+                        {"product_id": product["_id"], "auth0_id": user_id},
+                        {"$setOnInsert": {
+                            "skin_type": skin_type, "rating": rating,
+                            "updated_at": datetime.now(timezone.utc),
+                        }},
+                        upsert=True,
+                    )
+                    for user_id, skin_type, rating in user_ratings
+                ], ordered=False)
 
-        return action if update_result.modified_count > 0 else "update_failed"
+            update_result = await self.products_collection.update_one(
+                {"_id": product["_id"], **legacy},
+                {"$set": {"community_rating": community_rating}, "$unset": {"communityRatings": ""}},
+            )
+            migrated += update_result.modified_count
 
-    def get_community_ratings(self, product_id: ObjectId) -> dict:
-        product = self.products_collection.find_one(
-            {"_id": product_id},
-            {"communityRatings": 1}  # Only retrieve the communityRatings field
-        )
-        return product.get("communityRatings", {}) if product else {}
+        if migrated:
+            logger.info("migrated community ratings", extra={"products": migrated})
+        return migrated
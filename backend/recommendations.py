@@ -0,0 +1,234 @@
+import asyncio
+import logging
+import time
+import numpy as np
+from ratings import bayesian_score
+from rules import conflicting_candidates
+
+"""
+@file recommendations.py
+@brief module recommending catalog products that can be added to a routine without conflict.
+
+@details
+the products a user can add (the ones with a source page, see catalog.py) are kept in memory
+as numbered rows, with an inverted index from every property tag to the rows carrying it and
+one array of community rating scores per skin type.
+
+a product conflicts with a routine when it carries a tag the routine's avoid rules name, or
+when one of its own avoid rules names a tag of the routine. the catalog's tag and avoid
+bitsets (see rules.py) are encoded from the postings once per compiled rule snapshot, so a
+request only encodes its routine and runs conflicting_candidates over the whole catalog; the
+safe products are the rows left, ranked by score with NumPy. rule changes need no rebuild of
+the index, only a new encoding on the next request.
+
+scores are the bayesian averages kept on the products (see ratings.py) as of the last
+refresh, so recently folded ratings are reflected within refresh_interval.
+"""
+
+logger = logging.getLogger(__name__)
+
+
+"""
+@class RecommendationData
+@brief snapshot of the candidate products.
+
+@details
+- products: row -> result returned for the product (id, brand, name, image, url).
+- ratings: row -> community rating of the product, per skin type.
+- rows: product id -> row.
+- postings: tag -> int array of the rows carrying that tag.
+- scores: skin type -> float array of the rows' bayesian scores for that skin type.
+- bitsets: (rules version, tags, avoids) the rows were last encoded with, see bitsets().
+"""
+
+
+class RecommendationData:
+    def __init__(self, skin_types):
+        self.products = []
+        self.ratings = []
+        self.rows = {}
+        self.postings = {}
+        self.scores = {skin_type: np.empty(0) for skin_type in skin_types}
+        self.bitsets = None
+
+    @classmethod
+    def build(cls, product_docs, skin_types):
+        data = cls(skin_types)
+        postings = {}
+        scores = {skin_type: [] for skin_type in skin_types}
+        for product in product_docs:
+            row = data._add_row(product)
+            if row is None:
+                continue
+            for tag in set(product.get("tags", [])):
+                postings.setdefault(tag, []).append(row)
+            for skin_type, values in scores.items():
+                values.append(cls.score(product, skin_type))
+
+        data.postings = {tag: np.array(rows, dtype=np.int64) for tag, rows in postings.items()}
+        data.scores = {skin_type: np.array(values, dtype=np.float64) for skin_type, values in scores.items()}
+        return data
+
+    @staticmethod
+    def score(product, skin_type) -> float:
+        rating = product.get("community_rating", {}).get(skin_type, {})
+        if "score" in rating:
+            return rating["score"]
+        # products not folded since scores were introduced, and unrated ones at the prior
+        return bayesian_score(rating.get("sum", 0), rating.get("count", 0))
+
+    def _add_row(self, product):
+        # only products with a source page can be added to a routine
+        product_id = str(product["_id"])
+        if not product.get("url") or product_id in self.rows:
+            return None
+
+        row = len(self.products)
+        self.rows[product_id] = row
+        self.products.append({
+            "id": product_id,
+            "brand": product.get("brand"),
+            "name": product.get("name"),
+            "image": product.get("image"),
+            "url": product.get("url"),
+        })
+        self.ratings.append(product.get("community_rating", {}))
+        return row
+
+    def add(self, product: dict):
+        """
+        appends a product inserted after the snapshot was built.
+        """
+        row = self._add_row(product)
+        if row is None:
+            return
+        for tag in set(product.get("tags", [])):
+            self.postings[tag] = np.append(self.postings.get(tag, np.empty(0, dtype=np.int64)), row)
+        for skin_type in self.scores:
+            self.scores[skin_type] = np.append(self.scores[skin_type], self.score(product, skin_type))
+        # the next request encodes the rows again, new one included
+        self.bitsets = None
+
+    def encoded(self, compiled):
+        """
+        returns the (tags, avoids) bitsets of the rows for the compiled rule snapshot,
+        encoding them only when the rules or the rows changed since the last call.
+        """
+        bitsets = self.bitsets
+        if bitsets is None or bitsets[0] != compiled.version:
+            tags, avoids = compiled.encode_postings(self.postings, len(self.products))
+            bitsets = self.bitsets = (compiled.version, tags, avoids)
+        return bitsets[1], bitsets[2]
+
+    def safe_rows(self, routine_products, routine_ids, compiled):
+        """
+        returns a boolean array, True for the rows that conflict with no routine product and
+        are not in the routine already.
+        """
+        tags, avoids = self.encoded(compiled)
+        safe = ~conflicting_candidates(routine_products, tags, avoids, compiled)
+        for product_id in routine_ids:
+            row = self.rows.get(str(product_id))
+            if row is not None:
+                safe[row] = False
+        return safe
+
+    def recommend(self, routine_products, routine_ids, compiled, skin_type: str, limit: int) -> list:
+        """
+        returns the limit best scored safe products for the skin type, routine_products being
+        the routine's product documents with their "tags".
+        """
+        candidates = np.flatnonzero(self.safe_rows(routine_products, routine_ids, compiled))
+        scores = self.scores[skin_type][candidates]
+        if len(candidates) > limit:
+            # only the best limit rows need sorting
+            best = np.argpartition(-scores, limit - 1)[:limit]
+            candidates, scores = candidates[best], scores[best]
+        order = np.lexsort((candidates, -scores))
+
+        results = []
+        for row in candidates[order]:
+            rating = self.ratings[row].get(skin_type, {})
+            results.append({
+                **self.products[row],
+                "community_rating": rating.get("average", 0),
+                "rating_count": rating.get("count", 0),
+                "score": float(self.scores[skin_type][row]),
+            })
+        return results
+
+
+"""
+@class RecommendationIndex
+@brief keeps a RecommendationData snapshot of the 'products' collection up to date.
+
+@details
+the snapshot is built on first use. once older than refresh_interval seconds it is rebuilt
+in the background while requests keep being answered from the previous one, and the
+CPU-bound build runs in a worker thread, so neither blocks the event loop. products inserted
+by this worker are added straight away through add(), also to a rebuild under way.
+
+@param products_collection the MongoDB 'products' collection.
+@param skin_types skin types scores are kept for.
+@param refresh_interval seconds after which the snapshot is rebuilt.
+"""
+
+
+class RecommendationIndex:
+    def __init__(self, products_collection, skin_types, refresh_interval: float = 300):
+        self.products_collection = products_collection
+        self.skin_types = list(skin_types)
+        self.refresh_interval = refresh_interval
+        self.projection = {"brand": 1, "name": 1, "image": 1, "url": 1, "tags": 1}
+        for skin_type in self.skin_types:
+            for field in ("sum", "count", "average", "score"):
+                self.projection[f"community_rating.{skin_type}.{field}"] = 1
+        self._data = None
+        self._loaded_at = 0.0
+        self._lock = asyncio.Lock()
+        self._refresh = None
+        # products added while a rebuild is under way, replayed into the new snapshot
+        self._added = None
+
+    async def reload(self) -> RecommendationData:
+        self._added = []
+        try:
+            cursor = self.products_collection.find({"url": {"$exists": True}}, self.projection)
+            product_docs = await cursor.to_list(length=None)
+            data = await asyncio.to_thread(RecommendationData.build, product_docs, self.skin_types)
+            for product in self._added:
+                data.add(product)
+        finally:
+            self._added = None
+        self._data = data
+        self._loaded_at = time.monotonic()
+        return data
+
+    async def _refresh_in_background(self):
+        try:
+            await self.reload()
+        except Exception:
+            logger.exception("refreshing the recommendation index failed")
+
+    async def get(self) -> RecommendationData:
+        data = self._data
+        if data is None:
+            async with self._lock:
+                if self._data is not None:
+                    return self._data
+                return await self.reload()
+
+        stale = time.monotonic() - self._loaded_at >= self.refresh_interval
+        if stale and (self._refresh is None or self._refresh.done()):
+            self._refresh = asyncio.create_task(self._refresh_in_background())
+        return data
+
+    def add(self, product: dict):
+        if self._data is not None:
+            self._data.add(product)
+        if self._added is not None:
+            self._added.append(product)
+
+    async def close(self):
+        if self._refresh is not None:
+            self._refresh.cancel()
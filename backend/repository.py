@@ -0,0 +1,335 @@
+import os
+from typing import Dict, List, Optional, TypedDict
+from bson import ObjectId
+from pymongo import AsyncMongoClient, ReturnDocument, UpdateOne
+from cache import MISS
+from metrics import CommandMetrics
+from models.schemas import TimeOfDay
+from ratings import RATING_TOTALS_PROJECTION
+
+"""
+@file repository.py
+@brief async data access layer for the 'LegallyChemie' MongoDB database.
+
+@details
+all collections are accessed through a single shared AsyncMongoClient, so one worker can
+keep many queries in flight without blocking the event loop. the connection pool and
+timeouts are configurable through environment variables:
+- DB_NAME (default "LegallyChemie"), e.g. to point a benchmark at a scratch database.
+- DB_MAX_POOL_SIZE (default 100) and DB_MIN_POOL_SIZE (default 0).
+- DB_MAX_IDLE_TIME_MS, DB_CONNECT_TIMEOUT_MS, DB_SOCKET_TIMEOUT_MS,
+  DB_SERVER_SELECTION_TIMEOUT_MS and DB_WAIT_QUEUE_TIMEOUT_MS.
+
+every command the client sends is counted and timed by metrics.CommandMetrics.
+
+the repositories wrap the queries the endpoints issue, so route handlers never build
+MongoDB queries themselves. user reads project only the fields the endpoints use instead of
+loading the whole document, and are cached per auth0_id and routine for a few seconds (see
+UserRepository).
+"""
+
+DB_NAME = "LegallyChemie"
+
+# environment variable -> AsyncMongoClient option
+POOL_OPTIONS = {
+    "DB_MAX_POOL_SIZE": "maxPoolSize",
+    "DB_MIN_POOL_SIZE": "minPoolSize",
+    "DB_MAX_IDLE_TIME_MS": "maxIdleTimeMS",
+    "DB_CONNECT_TIMEOUT_MS": "connectTimeoutMS",
+    "DB_SOCKET_TIMEOUT_MS": "socketTimeoutMS",
+    "DB_SERVER_SELECTION_TIMEOUT_MS": "serverSelectionTimeoutMS",
+    "DB_WAIT_QUEUE_TIMEOUT_MS": "waitQueueTimeoutMS",
+}
+
+
+"""
+@fn pool_options
+@brief reads the connection pool and timeout settings from the environment.
+@return dictionary of AsyncMongoClient keyword arguments.
+"""
+
+
+def pool_options() -> dict:
+    options = {"maxPoolSize": 100, "minPoolSize": 0}
+    for env_name, option in POOL_OPTIONS.items():
+        value = os.getenv(env_name)
+        if value:
+            options[option] = int(value)
+    return options
+
+
+"""
+@class Database
+@brief owns the shared client and exposes the application's collections.
+
+@param db_string MongoDB connection string.
+@param client optional already constructed async client (e.g. for tests).
+@param db_name database name, DB_NAME (default "LegallyChemie") when not given.
+"""
+
+
+class Database:
+    def __init__(self, db_string: str = None, client=None, db_name: str = None):
+        self.client = client if client is not None else AsyncMongoClient(
+            db_string, event_listeners=[CommandMetrics()], **pool_options()
+        )
+        self.db = self.client[db_name or os.getenv("DB_NAME", DB_NAME)]
+        self.products = self.db.get_collection("products")
+        self.users = self.db.get_collection("users")
+        self.rules = self.db.get_collection("rules")
+        self.ingredients = self.db.get_collection("ingredients")
+        self.ratings = self.db.get_collection("ratings")
+
+    async def close(self):
+        await self.client.close()
+
+
+"""
+@brief shape of the user document the endpoints work with, returned by UserRepository.
+@details
+- RoutineEntry: one product of a routine and the user's rating of it.
+- UserContext: the user's skin type and the one routine the endpoint works on, without the
+  profile fields (given_name, ...) or the other routine. the precomputed rules are left out
+  too: they hold whole product lists and findings, and only the rules endpoint reads them,
+  one day at a time (see find_routine_rules).
+"""
+
+
+class RoutineEntry(TypedDict):
+    _id: ObjectId
+    rating: int
+
+
+class UserContext(TypedDict, total=False):
+    _id: ObjectId
+    auth0_id: str
+    skin_type: str
+    products: Dict[str, List[RoutineEntry]]
+
+
+# fields of a user document read by every endpoint, see context_projection for the routine
+USER_CONTEXT_PROJECTION = {"auth0_id": 1, "skin_type": 1}
+
+
+def context_projection(day: Optional[str] = None) -> dict:
+    if day is None:
+        return USER_CONTEXT_PROJECTION
+    return {**USER_CONTEXT_PROJECTION, f"products.{day}": 1}
+
+
+"""
+@class UserRepository
+@brief queries and updates on the 'users' collection.
+
+@details
+find_context reads through an optional in-process cache keyed by auth0_id and routine (a
+cache.MemoryCache), and every write method drops the user's entries, so a worker always
+sees its own writes. writes made by another worker are seen once the entry expires, so the
+cache TTL bounds how stale a read can be. cached documents are shared between requests and
+must not be modified.
+
+@param users_collection the async 'users' collection.
+@param cache optional MemoryCache for user documents.
+@param ttl seconds a cached user document is served.
+"""
+
+
+class UserRepository:
+    def __init__(self, users_collection, cache=None, ttl: float = 5.0):
+        self.users_collection = users_collection
+        self.cache = cache
+        self.ttl = ttl
+        # bumped on every invalidation, so a read racing a write does not cache the old document
+        self._generation = 0
+
+    def invalidate(self, auth0_id: str):
+        self._generation += 1
+        if self.cache is not None:
+            for day in (None, *(time_of_day.value for time_of_day in TimeOfDay)):
+                self.cache.delete(self._context_key(auth0_id, day))
+
+    @staticmethod
+    def _context_key(auth0_id: str, day: Optional[str]) -> str:
+        return f"{auth0_id}/{day}" if day is not None else auth0_id
+
+    async def create(self, user_doc: dict):
+        self.invalidate(user_doc["auth0_id"])
+        return await self.users_collection.insert_one(user_doc)
+
+    async def exists(self, auth0_id: str) -> bool:
+        return await self.users_collection.find_one({"auth0_id": auth0_id}, {"_id": 1}) is not None
+
+    async def find_context(self, auth0_id: str, day: Optional[str] = None) -> Optional[UserContext]:
+        """
+        returns the skin type and, given a day, that day's routine, from the cache when
+        possible; None if the user does not exist (not cached, so a new user is seen at once).
+        """
+        key = self._context_key(auth0_id, day)
+        if self.cache is not None:
+            user_doc = self.cache.get(key)
+            if user_doc is not MISS:
+                return user_doc
+
+        generation = self._generation
+        user_doc = await self.users_collection.find_one(
+            {"auth0_id": auth0_id}, context_projection(day)
+        )
+        if self.cache is not None and user_doc is not None and generation == self._generation:
+            self.cache.set(key, user_doc, self.ttl)
+        return user_doc
+
+    async def find_routine_rules(self, auth0_id: str, day: str) -> Optional[dict]:
+        """
+        returns the precomputed rules of one routine, None if there are none.
+        """
+        user_doc = await self.users_collection.find_one(
+            {"auth0_id": auth0_id}, {"_id": 0, f"rules_cache.{day}": 1}
+        )
+        return (user_doc or {}).get("rules_cache", {}).get(day)
+
+    async def add_product(self, auth0_id: str, day: str, product_id: ObjectId):
+        """
+        adds a product to the routine and returns the routine and cached rules as they
+        were before the update; None if the user does not exist or the routine already has
+        the product (whatever its rating), so concurrent adds cannot duplicate it.
+        """
+        self.invalidate(auth0_id)
+        return await self.users_collection.find_one_and_update(
+            {"auth0_id": auth0_id, f"products.{day}._id": {"$ne": product_id}},
+            {"$push": {f"products.{day}": {"_id": product_id, "rating": 0}}},
+            projection={f"products.{day}": 1, f"rules_cache.{day}": 1},
+            return_document=ReturnDocument.BEFORE,
+        )
+
+    async def remove_product(self, auth0_id: str, day: str, product_id: ObjectId):
+        """
+        removes a product from the routine and returns the routine and cached rules as
+        they were before the update (None if the user does not exist).
+        """
+        self.invalidate(auth0_id)
+        return await self.users_collection.find_one_and_update(
+            {"auth0_id": auth0_id},
+            {"$pull": {f"products.{day}": {"_id": product_id}}},
+            projection={f"products.{day}": 1, f"rules_cache.{day}": 1},
+            return_document=ReturnDocument.BEFORE,
+        )
+
+    async def set_routine_rules(self, auth0_id: str, day: str, state: dict):
+        self.invalidate(auth0_id)
+        return await self.users_collection.update_one(
+            {"auth0_id": auth0_id}, {"$set": {f"rules_cache.{day}": state}}
+        )
+
+    async def set_product_rating(self, auth0_id: str, day: str, product_id: ObjectId, rating: int):
+        """
+        sets the user's rating of a routine product and returns the user's skin type and
+        the routine entry as they were before the update (None if the product is not in
+        the routine).
+        """
+        self.invalidate(auth0_id)
+        return await self.users_collection.find_one_and_update(
+            {"auth0_id": auth0_id, f"products.{day}._id": product_id},
+            {"$set": {f"products.{day}.$.rating": rating}},
+            projection={"skin_type": 1, f"products.{day}.$": 1},
+            return_document=ReturnDocument.BEFORE,
+        )
+
+    async def set_skin_type(self, auth0_id: str, skin_type: str):
+        self.invalidate(auth0_id)
+        return await self.users_collection.update_one(
+            {"auth0_id": auth0_id}, {"$set": {"skin_type": skin_type}}
+        )
+
+
+# product fields upsert_scraped never overwrites on existing products
+INSERT_ONLY_FIELDS = ("ingredients", "tags")
+
+
+"""
+@class ProductRepository
+@brief queries and updates on the 'products' collection.
+"""
+
+
+class ProductRepository:
+    def __init__(self, products_collection):
+        self.products_collection = products_collection
+
+    async def find_by_id(self, product_id: ObjectId):
+        return await self.products_collection.find_one({"_id": product_id})
+
+    async def find_by_ids(self, product_ids) -> list:
+        cursor = self.products_collection.find({"_id": {"$in": list(product_ids)}})
+        return await cursor.to_list(length=None)
+
+    async def find_tags(self, product_ids) -> list:
+        """
+        returns the products' property tags only.
+        """
+        cursor = self.products_collection.find({"_id": {"$in": list(product_ids)}}, {"tags": 1})
+        return await cursor.to_list(length=None)
+
+    async def find_community_ratings(self, product_ids) -> list:
+        """
+        returns the products' community rating totals and averages only.
+        """
+        cursor = self.products_collection.find(
+            {"_id": {"$in": list(product_ids)}}, RATING_TOTALS_PROJECTION
+        )
+        return await cursor.to_list(length=None)
+
+    async def find_leaderboard(self, skin_type: str, field: str, limit: int) -> list:
+        """
+        returns the limit products with the highest community_rating.<skin_type>.<field>
+        ("score" or "trend"), read in order from its descending index.
+        """
+        key = f"community_rating.{skin_type}.{field}"
+        cursor = self.products_collection.find(
+            {key: {"$exists": True}},
+            {"name": 1, "brand": 1, "image": 1, f"community_rating.{skin_type}": 1},
+        ).sort(key, -1).limit(limit)
+        return await cursor.to_list(length=None)
+
+    async def find_by_url(self, url: str):
+        return await self.products_collection.find_one({"url": url})
+
+    async def find_ingested_urls(self, urls, since) -> set:
+        """
+        returns the urls among urls whose product was ingested at or after since.
+        """
+        cursor = self.products_collection.find(
+            {"url": {"$in": list(urls)}, "ingested_at": {"$gte": since}}, {"url": 1}
+        )
+        return {doc["url"] async for doc in cursor}
+
+    async def upsert_scraped(self, product_docs, community_rating: dict):
+        """
+        inserts or refreshes scraped products in one unordered bulk_write. products are
+        matched on name and brand like the add flow does, so products added by users are
+        updated instead of duplicated, and existing community ratings are kept.
+
+        ingredients and tags are only written on insert: the precomputed rules of routines
+        (see rules.RoutineRules) are keyed on product ids, so re-tagging a product already in
+        routines would leave their results stale.
+        """
+        # two urls resolving to the same product would both upsert it and collide on
+        # name_brand_unique, so only the last of them is written
+        latest = {(product_doc["name"], product_doc["brand"]): product_doc for product_doc in product_docs}
+        requests = []
+        for product_doc in latest.values():
+            refreshed = {field: value for field, value in product_doc.items() if field not in INSERT_ONLY_FIELDS}
+            on_insert = {field: product_doc[field] for field in INSERT_ONLY_FIELDS if field in product_doc}
+            on_insert["community_rating"] = community_rating
+            requests.append(UpdateOne(
+                {"name": product_doc["name"], "brand": product_doc["brand"]},
+                {"$set": refreshed, "$setOnInsert": on_insert},
+                upsert=True,
+            ))
+        return await self.products_collection.bulk_write(requests, ordered=False)
+
+    async def find_by_name_brand(self, name: str, brand: str):
+        return await self.products_collection.find_one({"name": name, "brand": brand})
+
+    async def insert(self, product_doc: dict) -> ObjectId:
+        result = await self.products_collection.insert_one(product_doc)
+        return result.inserted_id
@@ -0,0 +1,503 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from collections import Counter
+import numpy as np
+
+"""
+@file rules.py
+@brief module providing a compiled, in-memory index of the ingredient compatibility rules.
+
+@details
+the 'rules' collection maps a property tag (e.g. "AHA") to its "avoid", "usewith" and
+"usewhen" rules. instead of querying the collection once per tag per product, the whole
+collection is compiled into per-tag lookup tables once and swapped atomically whenever
+the collection changes (via a change stream when the deployment supports one, otherwise
+by reloading after a refresh interval). routine checks are then evaluated in memory.
+
+avoid checks run on bitsets: every tag named by an avoid rule gets a bit in the snapshot's
+vocabulary, a product's tags become a row of uint64 words and its avoid rules the row of
+tags it must not be combined with. conflicts across a routine, or between a routine and a
+whole candidate set, are then a few NumPy bitwise operations instead of nested loops over
+tag strings. bits are assigned per snapshot, so bitsets are computed in memory from the
+product tags and never stored.
+"""
+
+# bits per bitset word
+WORD_BITS = 64
+WORD_MASK = (1 << WORD_BITS) - 1
+
+logger = logging.getLogger(__name__)
+
+
+"""
+@class CompiledRules
+@brief immutable snapshot of the rules collection keyed by tag.
+
+@details
+- avoid: tag -> list of avoid rules ({"tag", "message"}) declared on that tag.
+- avoid_tags: tag -> frozenset of tags that tag must not be combined with.
+- usewith: tag -> list of usewith rules declared on that tag.
+- usewhen: tag -> list of usewhen rules declared on that tag.
+- version: hash of the rule documents, changes whenever the rules do.
+- tag_bits: tag -> bit of every tag named by an avoid rule, as a one-bit python int.
+- avoid_bits: tag -> bitmask (python int) of the tags that tag must not be combined with.
+- avoided_by: tag -> frozenset of tags whose avoid rules name it (avoid_tags reversed).
+- words: number of uint64 words of the bitsets.
+"""
+
+
+class CompiledRules:
+    __slots__ = ("avoid", "avoid_tags", "usewith", "usewhen", "size", "version", "tag_bits", "avoid_bits", "avoided_by", "words")
+
+    def __init__(self, rule_docs=()):
+        self.avoid = {}
+        self.avoid_tags = {}
+        self.usewith = {}
+        self.usewhen = {}
+        self.size = 0
+
+        rule_docs = list(rule_docs)
+        # content hash, identical across workers that loaded the same rules
+        self.version = hashlib.sha1(
+            json.dumps(
+                sorted(rule_docs, key=lambda rule_doc: str(rule_doc.get("_id"))),
+                sort_keys=True,
+                default=str,
+            ).encode()
+        ).hexdigest()
+
+        for rule_doc in rule_docs:
+            tag = rule_doc.get("_id")
+            rules = rule_doc.get("rules", {}) or {}
+            avoid = list(rules.get("avoid", []) or [])
+            usewith = list(rules.get("usewith", []) or [])
+            usewhen = list(rules.get("usewhen", []) or [])
+
+            if avoid:
+                self.avoid[tag] = avoid
+                self.avoid_tags[tag] = frozenset(rule["tag"] for rule in avoid)
+            if usewith:
+                self.usewith[tag] = usewith
+            if usewhen:
+                self.usewhen[tag] = usewhen
+            self.size += 1
+
+        vocabulary = sorted(set(self.avoid_tags) | {tag for tags in self.avoid_tags.values() for tag in tags}, key=str)
+        self.tag_bits = {tag: 1 << bit for bit, tag in enumerate(vocabulary)}
+        self.avoid_bits = {
+            tag: sum(self.tag_bits[avoided] for avoided in avoided_tags)
+            for tag, avoided_tags in self.avoid_tags.items()
+        }
+        self.words = max(1, -(-len(vocabulary) // WORD_BITS))
+
+        avoided_by = {}
+        for tag, avoided_tags in self.avoid_tags.items():
+            for avoided in avoided_tags:
+                avoided_by.setdefault(avoided, set()).add(tag)
+        self.avoided_by = {tag: frozenset(tags) for tag, tags in avoided_by.items()}
+
+    def encode(self, tag_lists):
+        """
+        returns the tag bitsets and avoid bitsets of the tag lists, as two (len(tag_lists),
+        words) uint64 arrays. tags outside the vocabulary take part in no avoid rule and
+        are left out.
+        """
+        tags = np.zeros((len(tag_lists), self.words), dtype=np.uint64)
+        avoids = np.zeros((len(tag_lists), self.words), dtype=np.uint64)
+        for row, product_tags in enumerate(tag_lists):
+            tag_mask = avoid_mask = 0
+            for tag in product_tags:
+                tag_mask |= self.tag_bits.get(tag, 0)
+                avoid_mask |= self.avoid_bits.get(tag, 0)
+            for word in range(self.words):
+                shift = word * WORD_BITS
+                tags[row, word] = (tag_mask >> shift) & WORD_MASK
+                avoids[row, word] = (avoid_mask >> shift) & WORD_MASK
+        return tags, avoids
+
+    def encode_postings(self, postings, size: int):
+        """
+        same as encode() for size products given as an inverted index (tag -> int array of
+        the rows carrying it), with one NumPy operation per vocabulary tag instead of a
+        python loop per product. used to encode a whole catalog once per snapshot.
+        """
+        tags = np.zeros((size, self.words), dtype=np.uint64)
+        avoids = np.zeros((size, self.words), dtype=np.uint64)
+        for tag, tag_mask in self.tag_bits.items():
+            rows = postings.get(tag)
+            if rows is None or not len(rows):
+                continue
+            for word in range(self.words):
+                shift = word * WORD_BITS
+                tag_part = (tag_mask >> shift) & WORD_MASK
+                avoid_part = (self.avoid_bits.get(tag, 0) >> shift) & WORD_MASK
+                if tag_part:
+                    tags[rows, word] |= np.uint64(tag_part)
+                if avoid_part:
+                    avoids[rows, word] |= np.uint64(avoid_part)
+        return tags, avoids
+
+
+"""
+@class RuleIndex
+@brief keeps a CompiledRules snapshot of the 'rules' collection up to date.
+
+@param rules_collection the MongoDB 'rules' collection.
+@param refresh_interval seconds after which the snapshot is reloaded when no change
+       stream is watching the collection.
+"""
+
+
+class RuleIndex:
+    def __init__(self, rules_collection, refresh_interval: float = 300):
+        self.rules_collection = rules_collection
+        self.refresh_interval = refresh_interval
+        self._compiled = None
+        self._loaded_at = 0.0
+        self._lock = asyncio.Lock()
+        self._watcher = None
+        self._watching = False
+
+    async def reload(self) -> CompiledRules:
+        rule_docs = await self.rules_collection.find({}).to_list(length=None)
+        # swapping the reference is atomic, readers never see a half-built index
+        compiled = CompiledRules(rule_docs)
+        self._compiled = compiled
+        self._loaded_at = time.monotonic()
+        return compiled
+
+    async def get(self) -> CompiledRules:
+        compiled = self._compiled
+        if compiled is not None and (
+            self._watching
+            or time.monotonic() - self._loaded_at < self.refresh_interval
+        ):
+            return compiled
+
+        async with self._lock:
+            # another request may have reloaded while we were waiting on the lock
+            if self._compiled is not compiled:
+                return self._compiled
+            return await self.reload()
+
+    def watch(self):
+        """
+        starts a background task reloading the index on every change to the collection.
+        if the deployment does not support change streams the task exits and the
+        index falls back to reloading after refresh_interval.
+        """
+        if self._watcher is not None:
+            return
+
+        async def consume():
+            try:
+                async with await self.rules_collection.watch() as stream:
+                    await self.reload()
+                    self._watching = True
+                    async for _ in stream:
+                        await self.reload()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("rules change stream unavailable, polling instead: %s", e)
+            finally:
+                self._watching = False
+
+        self._watcher = asyncio.create_task(consume())
+
+    async def close(self):
+        if self._watcher is not None:
+            self._watcher.cancel()
+            try:
+                await self._watcher
+            except asyncio.CancelledError:
+                pass
+            self._watcher = None
+
+
+"""
+@fn conflict_matrix
+@brief tells which sources have an avoid rule triggered by which targets.
+@param avoids (n, words) avoid bitsets of the sources (see CompiledRules.encode).
+@param tags (m, words) tag bitsets of the targets.
+@return (n, m) boolean array, True where source i must not be combined with target j.
+"""
+
+
+def conflict_matrix(avoids, tags):
+    return ((avoids[:, None, :] & tags[None, :, :]) != 0).any(axis=2)
+
+
+"""
+@fn conflicting_candidates
+@brief tells which candidate products conflict with a routine, in either direction.
+
+@details
+a candidate conflicts when it avoids a tag of the routine or the routine avoids one of its
+tags, so only the union of the routine's tags and avoids is needed: one AND per candidate.
+
+@param routine_products serialized products of the routine (dicts with "tags").
+@param tags (m, words) tag bitsets of the candidates.
+@param avoids (m, words) avoid bitsets of the candidates.
+@param compiled CompiledRules snapshot the bitsets were encoded with.
+@return (m,) boolean array, True where the candidate conflicts with the routine.
+"""
+
+
+def conflicting_candidates(routine_products, tags, avoids, compiled: CompiledRules):
+    routine_tags, routine_avoids = compiled.encode([product.get("tags", []) for product in routine_products])
+    union_tags = np.bitwise_or.reduce(routine_tags, axis=0)
+    union_avoids = np.bitwise_or.reduce(routine_avoids, axis=0)
+    return ((avoids & union_tags) != 0).any(axis=1) | ((tags & union_avoids) != 0).any(axis=1)
+
+
+"""
+@fn pair_findings
+@brief lists the avoid rules of one product triggered by another product.
+@details only called for the pairs conflict_matrix flagged.
+"""
+
+
+def pair_findings(product, product_comp, compiled: CompiledRules) -> list:
+    comp_tags = set(product_comp.get("tags", []))
+    return [
+        {"source": product["id"], "comp": product_comp["id"], "rule": avoid_rule}
+        for tag in product.get("tags", [])
+        for avoid_rule in compiled.avoid.get(tag, [])
+        if avoid_rule["tag"] in comp_tags
+    ]
+
+
+"""
+@fn find_conflicts_between
+@brief finds the avoid findings of every source product against every target product.
+
+@param sources serialized source products (dicts with "id" and "tags").
+@param targets serialized products compared against; a product is never compared with itself.
+@param compiled CompiledRules snapshot to evaluate against.
+@return list of avoid findings ({"source", "comp", "rule"}) with product ids.
+"""
+
+
+def find_conflicts_between(sources, targets, compiled: CompiledRules) -> list:
+    if not sources or not targets:
+        return []
+    _, avoids = compiled.encode([product.get("tags", []) for product in sources])
+    tags, _ = compiled.encode([product.get("tags", []) for product in targets])
+
+    avoid = []
+    # np.nonzero walks the matrix row by row, so findings keep the source order
+    for index, comp_index in zip(*np.nonzero(conflict_matrix(avoids, tags))):
+        product, product_comp = sources[index], targets[comp_index]
+        if product["id"] != product_comp["id"]:
+            avoid.extend(pair_findings(product, product_comp, compiled))
+    return avoid
+
+
+"""
+@fn build_rules_result
+@brief combines avoid findings with the usewith and usewhen rules of a routine.
+
+@details
+usewith and usewhen rules only depend on each product's own tags and on which tags the
+rest of the routine provides, so they are cheap to derive once the (pairwise) avoid
+findings are known.
+
+@param products list of serialized products (dicts with "id", "name" and "tags").
+@param avoid avoid findings between products of the routine, with product ids.
+@param day time of day ("AM" or "PM") the routine is used at.
+@param compiled CompiledRules snapshot to evaluate against.
+@return dictionary with "avoid", "usewith" and "usewhen" lists, in the format the
+        frontend expects.
+"""
+
+
+def build_rules_result(products, avoid, day: str, compiled: CompiledRules) -> dict:
+    product_rules = {"avoid": list(avoid), "usewith": [], "usewhen": []}
+
+    tag_sets = [frozenset(product.get("tags", [])) for product in products]
+    # number of products in the routine carrying each tag
+    tag_counts = Counter(tag for tag_set in tag_sets for tag in tag_set)
+
+    for product, own_tags in zip(products, tag_sets):
+        for tag in product.get("tags", []):
+            for rule_data in compiled.usewith.get(tag, []):
+                # satisfied when some other product in the routine carries the tag
+                other_count = tag_counts[rule_data["tag"]] - (rule_data["tag"] in own_tags)
+                if other_count <= 0:
+                    product_rules["usewith"].append(
+                        {"rule": rule_data, "source": product["id"]}
+                    )
+
+            for rule_data in compiled.usewhen.get(tag, []):
+                if rule_data.get("tag") != day:
+                    product_rules["usewhen"].append(
+                        {"rule": rule_data, "source": product["id"]}
+                    )
+
+    # convert product IDs to names for output
+    product_names = {product["id"]: product["name"] for product in products}
+
+    product_rules["avoid"] = [
+        {
+            **rule,
+            "source": product_names.get(rule["source"]),
+            "source_id:": rule["source"],
+            "comp": product_names.get(rule["comp"]),
+            "comp_id": rule["comp"],
+        }
+        for rule in product_rules["avoid"]
+    ]
+    product_rules["usewith"] = [
+        {
+            **rule,
+            "source": product_names.get(rule["source"]),
+            "source_id:": rule["source"],
+        }
+        for rule in product_rules["usewith"]
+    ]
+    product_rules["usewhen"] = [
+        {
+            **rule,
+            "source": product_names.get(rule["source"]),
+            "source_id:": rule["source"],
+        }
+        for rule in product_rules["usewhen"]
+    ]
+
+    return product_rules
+
+
+"""
+@fn find_routine_conflicts
+@brief finds the avoid findings between every ordered pair of products in a routine.
+"""
+
+
+def find_routine_conflicts(products, compiled: CompiledRules) -> list:
+    return find_conflicts_between(products, products, compiled)
+
+
+"""
+@fn evaluate_rules
+@brief evaluates the avoid, usewith and usewhen rules for every product in a routine.
+
+@details
+the check is a single in-memory pass: each product's tags are encoded as bitsets, avoid
+conflicts between every pair are found with one vectorized AND of the products' avoid
+bitsets against the others' tag bitsets, and usewith rules are dropped when any other
+product in the routine already provides the tag they ask for.
+
+@param products list of serialized products (dicts with "id", "name" and "tags").
+@param day time of day ("AM" or "PM") the routine is used at.
+@param compiled CompiledRules snapshot to evaluate against.
+@return dictionary with "avoid", "usewith" and "usewhen" lists, in the format the
+        frontend expects.
+"""
+
+
+def evaluate_rules(products, day: str, compiled: CompiledRules) -> dict:
+    return build_rules_result(products, find_routine_conflicts(products, compiled), day, compiled)
+
+
+"""
+@fn routine_hash
+@brief hashes the set of products in a routine.
+@param product_ids ids of the products in the routine, in any order; duplicates count once.
+@return hex digest identifying the routine.
+"""
+
+
+def routine_hash(product_ids) -> str:
+    digest = hashlib.sha1()
+    for product_id in sorted({str(product_id) for product_id in product_ids}):
+        digest.update(product_id.encode())
+        digest.update(b",")
+    return digest.hexdigest()
+
+
+"""
+@class RoutineRules
+@brief precomputed rules result of one user's AM or PM routine.
+
+@details
+the state is stored on the user document ("rules_cache.<day>") so reads can return
+"result" directly while "hash" (see routine_hash) and "version" (see CompiledRules) still
+match the routine and the rules. when a product is added or removed, only the avoid pairs
+involving that product are (re)evaluated:
+- hash: routine_hash of the routine entry ids the state was computed for. these are the ids
+  is_current is later called with, including duplicate entries and entries whose product
+  no longer exists, so such routines are not recomputed on every read.
+- version: CompiledRules.version the state was computed with.
+- products: {"id", "name", "tags"} of every product in the routine.
+- avoid: pairwise avoid findings, with product ids.
+- result: output of build_rules_result, returned by the rules endpoint.
+"""
+
+
+class RoutineRules:
+    def __init__(self, state: dict):
+        self.state = state
+
+    @classmethod
+    def compute(cls, products, routine_ids, day: str, compiled: CompiledRules) -> "RoutineRules":
+        """
+        evaluates the loaded products of a routine whose entries have the ids routine_ids.
+        """
+        products = [
+            {"id": product["id"], "name": product.get("name"), "tags": list(product.get("tags", []))}
+            for product in products
+        ]
+        return cls._build(products, routine_ids, find_routine_conflicts(products, compiled), day, compiled)
+
+    @classmethod
+    def _build(cls, products, routine_ids, avoid, day: str, compiled: CompiledRules) -> "RoutineRules":
+        return cls(
+            {
+                "hash": routine_hash(routine_ids),
+                "version": compiled.version,
+                "products": products,
+                "avoid": avoid,
+                "result": build_rules_result(products, avoid, day, compiled),
+            }
+        )
+
+    def is_current(self, product_ids, compiled: CompiledRules) -> bool:
+        return (
+            self.state.get("version") == compiled.version
+            and self.state.get("hash") == routine_hash(product_ids)
+        )
+
+    def add_product(self, product, routine_ids, day: str, compiled: CompiledRules) -> "RoutineRules":
+        """
+        adds a product to the routine whose entries had the ids routine_ids before.
+        """
+        product = {"id": product["id"], "name": product.get("name"), "tags": list(product.get("tags", []))}
+        products = [p for p in self.state["products"] if p["id"] != product["id"]]
+
+        avoid = [
+            finding for finding in self.state["avoid"]
+            if product["id"] not in (finding["source"], finding["comp"])
+        ]
+        # only the pairs involving the new product need evaluating
+        avoid.extend(find_conflicts_between([product], products, compiled))
+        avoid.extend(find_conflicts_between(products, [product], compiled))
+
+        routine_ids = list(routine_ids) + [product["id"]]
+        return self._build(products + [product], routine_ids, avoid, day, compiled)
+
+    def remove_product(self, product_id: str, routine_ids, day: str, compiled: CompiledRules) -> "RoutineRules":
+        """
+        removes a product (every entry of it) from the routine whose entries had the ids
+        routine_ids before.
+        """
+        products = [p for p in self.state["products"] if p["id"] != product_id]
+        avoid = [
+            finding for finding in self.state["avoid"]
+            if product_id not in (finding["source"], finding["comp"])
+        ]
+        routine_ids = [routine_id for routine_id in routine_ids if str(routine_id) != product_id]
+        return self._build(products, routine_ids, avoid, day, compiled)
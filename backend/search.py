@@ -1,30 +1,12 @@
-from bs4 import BeautifulSoup
-import requests
-import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
-from concurrent.futures import ThreadPoolExecutor
-from functools import lru_cache
-
-# Create session with retry strategy
-session = requests.Session()
-retry_strategy = Retry(
-    total=3,
-    backoff_factor=1,
-    status_forcelist=[500, 502, 503, 504]
-)
-adapter = HTTPAdapter(max_retries=retry_strategy, pool_maxsize=10)
-session.mount("http://", adapter)
-session.mount("https://", adapter)
-
-@lru_cache(maxsize=500)
-def get_cached_response(url):
-    return session.get(url, timeout=5)
-
-@lru_cache(maxsize=500)
-def search_products_cached(user_input, limit=5):
-    """Cached version of search function"""
-    return search_products(user_input, limit)
+import asyncio
+import logging
+import os
+import time
+import httpx
+from extractor import extract_product, extract_search_results
+from cache import MISS, create_cache
+from metrics import SCRAPE_COALESCED, SCRAPE_FETCHES, SCRAPE_FETCH_DURATION, track_cache
+from singleflight import SingleFlight
 
 """
 @file search.py
@@ -32,89 +14,187 @@ def search_products_cached(user_input, limit=5):
 
 @details
 enables searching for a product by name, extracting details such as brand name, product name, description, ingredients, and image.
-uses BeautifulSoup and requests to scrape data from the  Incidecoder website based on user input. 
+uses an async httpx client to scrape data from the  Incidecoder website based on user input, and the lxml-based
+extractor (see extractor.py) to pull fields out of the pages. every product page is fetched and parsed exactly once,
+and all fields are extracted from that single parse tree.
+parsed pages and search results are kept in TTL caches (see cache.py) shared by all workers; failed fetches are cached briefly too.
+fetches share one pooled client and a concurrency limit, so the FastAPI handlers can await them without blocking the loop.
+concurrent misses for the same product page or search share one scrape (see singleflight.py) instead of each scraping it.
 primary purpose is to support product data retrieval for applications requiring skincare product information.
 """
 
-BASE_URL = "https://incidecoder.com"
+logger = logging.getLogger(__name__)
+
+# INCIDECODER_BASE_URL points scraping at another host, e.g. the offline fixture_server.py
+BASE_URL = os.getenv("INCIDECODER_BASE_URL", "https://incidecoder.com").rstrip("/")
+
+# pool and concurrency limits for requests against Incidecoder
+MAX_CONNECTIONS = 10
+MAX_CONCURRENT_FETCHES = 10
+FETCH_TIMEOUT = 5
+
+# retry strategy: retried statuses, number of retries and exponential backoff factor
+RETRY_STATUSES = {500, 502, 503, 504}
+RETRY_TOTAL = 3
+RETRY_BACKOFF = 1
+
+# cache sizes and time to live (seconds) of scraped product pages, search results and failures
+PRODUCT_CACHE_SIZE = 10000
+SEARCH_CACHE_SIZE = 5000
+PRODUCT_CACHE_TTL = int(os.getenv("PRODUCT_CACHE_TTL", 7 * 24 * 3600))
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", 24 * 3600))
+NEGATIVE_CACHE_TTL = int(os.getenv("NEGATIVE_CACHE_TTL", 300))
+
+_client = None
+_fetch_limit = None
+
 
 """
-@fn extract_name_brand_description(product_url)
-@brief extracts the brand name, product name, and description from a product page on Incidecoder.
+@fn create_client
+@brief creates an async http client with the Incidecoder pool limits.
+@param transport optional httpx transport (e.g. a mock transport in tests).
+@return httpx.AsyncClient with connection pooling.
+"""
 
-@param product_url URL of the product page.
-@return tuple containing the brand name, product name, and description.
+
+def create_client(transport=None) -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        timeout=FETCH_TIMEOUT,
+        follow_redirects=True,
+        limits=httpx.Limits(
+            max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_CONNECTIONS
+        ),
+        transport=transport,
+    )
+
+
+"""
+@fn get_client
+@brief returns the shared async http client, creating it on first use.
+@return httpx.AsyncClient shared by every fetch.
 """
-def extract_name_brand_description(product_url):
-    response = get_cached_response(product_url)
-    # response = requests.get(product_url)
-    soup = BeautifulSoup(response.text, 'html.parser')
-    brand_name_section = soup.find('a', class_='underline')
-    brand_name = brand_name_section.text.strip() if brand_name_section else "Brand not found"
-    product_name_section = soup.find('span', id='product-title')
-    product_name = product_name_section.text.strip() if product_name_section else "Name not found"
-    description_section = soup.find('span', id='product-details')
-    description = description_section.text.strip() if description_section else "Description not found"
-    return brand_name, product_name, description
+
+
+def get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None or _client.is_closed:
+        _client = create_client()
+    return _client
+
 
 """
-@fn extract_ingredients(product_url)
-@brief extracts the list of ingredients from a product page on Incidecoder.
+@fn close_client
+@brief closes the shared async http client.
+"""
+
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
 
-@param product_url URL of the product page.
-@return list of ingredients for the product.
 """
-def extract_ingredients(product_url):
-    response = session.get(product_url, timeout=5)
-    soup = BeautifulSoup(response.text, 'html.parser')
-    
-    ingredients_section = soup.find('div', class_='showmore-section ingredlist-short-like-section')
-    ingredients = ingredients_section.find_all('a', class_='ingred-link black')
-    
-    ingredient_list = [ingredient.text.strip() for ingredient in ingredients]
-    return ingredient_list
+@fn fetch_page
+@brief fetches a page, retrying connection errors and 5xx responses with exponential backoff.
 
+@param url URL of the page.
+@param params optional query parameters.
+@return page html, or None if the page could not be fetched.
 """
-@fn extract_image(product_url)
-@brief extracts the image URL of a product from its page on Incidecoder.
+
+
+async def fetch_page(url, params=None):
+    global _fetch_limit
+    client = get_client()
+    if _fetch_limit is None:
+        _fetch_limit = asyncio.Semaphore(MAX_CONCURRENT_FETCHES)
+    for attempt in range(RETRY_TOTAL + 1):
+        try:
+            async with _fetch_limit:
+                started = time.perf_counter()
+                response = await client.get(url, params=params)
+                SCRAPE_FETCH_DURATION.observe(time.perf_counter() - started)
+            SCRAPE_FETCHES.labels(str(response.status_code)).inc()
+            if response.status_code not in RETRY_STATUSES:
+                return response.text if response.status_code == 200 else None
+        except httpx.TransportError as e:
+            SCRAPE_FETCHES.labels("error").inc()
+            if attempt == RETRY_TOTAL:
+                logger.warning("error fetching %s: %s", url, e)
+                return None
+        if attempt < RETRY_TOTAL:
+            await asyncio.sleep(RETRY_BACKOFF * (2 ** attempt))
+    return None
+
+
+product_cache = create_cache("products", PRODUCT_CACHE_SIZE)
+search_cache = create_cache("searches", SEARCH_CACHE_SIZE)
+track_cache("products", product_cache)
+track_cache("searches", search_cache)
+
+# in-flight scrapes by product url and by search cache key
+product_flights = SingleFlight()
+search_flights = SingleFlight()
+
+
+"""
+@fn parse_search_page(html, limit)
+@brief extracts the product page URLs from a search results page.
+
+@param html search results page html.
+@param limit maximum number of URLs to return.
+@return list of product page URLs.
+"""
+def parse_search_page(html, limit):
+    return [f"{BASE_URL}{href}" for href in extract_search_results(html, limit)]
+
+"""
+@fn fetch_product_page(product_url)
+@brief fetches and parses a product page, reusing the cached parse if available.
 
 @param product_url URL of the product page.
-@return URL of the product image.
+@return dictionary of product fields, or None if the page could not be fetched.
 """
-def extract_image(product_url):
-    response = session.get(product_url, timeout=5)
-    soup = BeautifulSoup(response.text, 'html.parser')
-    picture_tag = soup.find('picture')
-    image_tag = picture_tag.find('img')
-    image_url = image_tag.get('src')
-    return image_url
+async def fetch_product_page(product_url):
+    product_data = await product_cache.aget(product_url)
+    if product_data is not MISS:
+        return product_data
+
+    if product_flights.in_flight(product_url):
+        SCRAPE_COALESCED.labels("product").inc()
+    return await product_flights.do(product_url, scrape_product_page, product_url)
+
+"""
+@fn scrape_product_page(product_url)
+@brief fetches, parses and caches a product page; called once per page however many requests wait for it.
+"""
+async def scrape_product_page(product_url):
+    html = await fetch_page(product_url)
+    if html is None:
+        # negative caching, so a broken page is not refetched on every request
+        await product_cache.aset(product_url, None, NEGATIVE_CACHE_TTL)
+        return None
+    # parsing is CPU bound, keep it off the event loop
+    product_data = await asyncio.to_thread(extract_product, html)
+    await product_cache.aset(product_url, product_data, PRODUCT_CACHE_TTL)
+    return product_data
 
 """
 @fn get_product_data_by_url(product_url)
 @brief combines product details including brand, name, description, ingredients, and image into a dictionary.
 
-@param user_input name of the product to search for.
+@param product_url URL of the product page.
 @return dictionary containing the product's brand, name, description, ingredients, and image URL, or None if no product is found.
 """
-    
-def get_product_data_by_url(product_url):
+
+async def get_product_data_by_url(product_url):
     try:
-        # Extract all product information using existing functions
-        brand, name, description = extract_name_brand_description(product_url)
-        ingredients = extract_ingredients(product_url)
-        image_url = extract_image(product_url)
-        
-        # Create product data dictionary
-        product_data = {
-            "brand": brand,
-            "name": name,
-            "description": description,
-            "ingredients": ingredients,
-            "image": image_url
-        }
-        return product_data
+        product_data = await fetch_product_page(product_url)
+        return dict(product_data) if product_data else None
     except Exception as e:
-        print(f"Error getting product data from URL: {e}")
+        logger.exception("error getting product data from %s", product_url)
         return None
 
 """
@@ -125,7 +205,7 @@ def get_product_data_by_url(product_url):
 @param limit maximum number of search results to return (default 5).
 
 @return list of dictionaries, each containing basic product details:
-       - brand: product brand name 
+       - brand: product brand name
        - name: product name
        - description: truncated product description
        - image: URL of product image
@@ -133,33 +213,44 @@ def get_product_data_by_url(product_url):
        Returns empty list if no products found or search fails.
 """
 
-def search_products(user_input, limit=5):
-    search_url = f"{BASE_URL}/search?query={user_input}"
-    response = session.get(search_url, timeout=5)
+async def search_products(user_input, limit=5):
+    html = await fetch_page(f"{BASE_URL}/search", params={"query": user_input})
+    if html is None:
+        return []
+
+    product_urls = await asyncio.to_thread(parse_search_page, html, limit)
+
+    # product pages are fetched concurrently, bounded by the shared fetch limit
+    pages = await asyncio.gather(*(fetch_product_page(url) for url in product_urls))
+
     products = []
-    
-    if response.status_code == 200:
-        html_product = BeautifulSoup(response.text, 'html.parser')
-        results = html_product.select('a.klavika.simpletextlistitem')[:limit]
-        
-        def fetch_product_data(result):
-            product_link = result['href']
-            product_url = f"{BASE_URL}{product_link}"
-            brand, name, description = extract_name_brand_description(product_url)
-            image_url = extract_image(product_url)
-            return {
-                "brand": brand,
-                "name": name,
-                "description": description,
-                "image": image_url,
-                "url": product_url
-            }
-            
-        with ThreadPoolExecutor(max_workers=limit) as executor:
-            products = list(executor.map(fetch_product_data, results))
-    
+    for product_url, product_data in zip(product_urls, pages):
+        if product_data is None:
+            continue
+        products.append({
+            "brand": product_data["brand"],
+            "name": product_data["name"],
+            "description": product_data["description"],
+            "image": product_data["image"],
+            "url": product_url
+        })
     return products
 
-def get_search_results(query, n_results=5):
-    results = search_products_cached(query, n_results)
-    return results
\ No newline at end of file
+async def get_search_results(query, n_results=5):
+    key = f"{n_results}:{query}"
+    results = await search_cache.aget(key)
+    if results is MISS:
+        if search_flights.in_flight(key):
+            SCRAPE_COALESCED.labels("search").inc()
+        results = await search_flights.do(key, scrape_search_results, key, query, n_results)
+    return results
+
+"""
+@fn scrape_search_results(key, query, n_results)
+@brief runs a search and caches its results under key; called once per key however many requests wait for it.
+"""
+async def scrape_search_results(key, query, n_results):
+    results = await search_products(query, n_results)
+    # empty results (including failed searches) expire quickly
+    await search_cache.aset(key, results, SEARCH_CACHE_TTL if results else NEGATIVE_CACHE_TTL)
+    return results
@@ -1,18 +1,33 @@
 from dotenv import load_dotenv
-from pymongo import MongoClient
-from fastapi import FastAPI, Request, HTTPException
+from fastapi import Depends, FastAPI, Query, Request, HTTPException
 from bson import ObjectId
-from search import get_search_results, get_product_data_by_url
+from pymongo.errors import DuplicateKeyError
+from search import get_search_results, get_product_data_by_url, close_client
+from extractor import is_parsed
 from urllib.parse import quote_plus, urlencode
 from authlib.integrations.starlette_client import OAuth
-from fastapi.responses import RedirectResponse, JSONResponse
+from fastapi.responses import RedirectResponse, JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
-from starlette.middleware.sessions import SessionMiddleware
 import uvicorn
 import os
-from ratings import CommunityRatingsManager
+import time
+import asyncio
+import logging
+from logs import configure_logging
+from cache import MemoryCache
+from metrics import RULE_EVALUATION_DURATION, observe_request, render
+from rating_queue import create_rating_queue
+from ratings import CommunityRatingsManager, community_averages, empty_community_rating
+from rules import RuleIndex, RoutineRules
+from ingredients import IngredientResolver
+from catalog import CatalogIndex, merge_results
+from recommendations import RecommendationIndex
+from sessions import ServerSessionMiddleware, create_session_store, rotate_session
+from repository import Database, UserRepository, ProductRepository, UserContext
+from indexes import bootstrap_indexes
 from typing import Dict
-from models.schemas import ProductUrlInput, SearchInput, TimeOfDay, SkinType
+from contextlib import asynccontextmanager
+from models.schemas import LeaderboardKind, ProductUrlInput, SearchInput, TimeOfDay, SkinType
 
 """
 @file server.py
@@ -34,29 +49,151 @@ key functionalities:
 
 # loading .env file & initializing the Flask app
 load_dotenv()
+configure_logging()
+logger = logging.getLogger(__name__)
+
+
+"""
+@fn lifespan
+@brief startup and shutdown hooks for the application.
+@details creates missing indexes and converts products still using an older community
+rating structure in the background, folds queued rating changes into the products
+periodically, starts watching the 'rules' collection
+so the rule index stays current and closes the shared database and scraping clients on
+shutdown.
+"""
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    index_bootstrap = asyncio.create_task(bootstrap_indexes(database.db))
+    rating_migration = asyncio.create_task(migrate_community_ratings())
+    rating_folding = asyncio.create_task(community_ratings_manager.run_folding(rating_fold_interval))
+    rule_index.watch()
+    yield
+    index_bootstrap.cancel()
+    rating_migration.cancel()
+    rating_folding.cancel()
+    # folding what is still queued, so ratings do not wait for the next start
+    try:
+        while await community_ratings_manager.flush():
+            pass
+    except Exception:
+        logger.exception("folding queued ratings on shutdown failed")
+    await rule_index.close()
+    await recommendation_index.close()
+    await catalog_index.close()
+    await close_client()
+    await database.close()
+
+
 # initialize FastAPI
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 
 """
 @brief adds session middleware to the app for secure session management.
-@details uses a secret key from the environment variables.
+@details the session (including the Auth0 token) is kept server-side in the store selected
+by SESSION_BACKEND (see sessions.py); the cookie only carries an opaque session id.
+"""
+session_store = create_session_store()
+app.add_middleware(ServerSessionMiddleware, store=session_store)
+
+
+"""
+@fn time_requests
+@brief middleware recording the latency of every request by route template.
 """
-secret_key = os.getenv("APP_SECRET_KEY")
-app.add_middleware(SessionMiddleware, secret_key=secret_key)
+
+
+@app.middleware("http")
+async def time_requests(request: Request, call_next):
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        observe_request(
+            request.method, route.path if route is not None else "unmatched", status, started
+        )
 
 
 """
-@brief initializes the MongoDB client and connects to the 'LegallyChemie' database.
-@details collections for 'products', 'users', 'rules', and 'ingredients' are initialized.
+@brief initializes the shared async MongoDB client and connects to the 'LegallyChemie' database.
+@details collections for 'products', 'users', 'rules', and 'ingredients' are initialized and
+the endpoints access them through the user and product repositories.
 """
 db_string = os.getenv("DB_STRING")
-client = MongoClient(db_string)
-db = client.LegallyChemie
-products_collection = db.get_collection("products")
-users_collection = db.get_collection("users")
-rules_collection = db.get_collection("rules")
-ingredients_collection = db.get_collection("ingredients")
+database = Database(db_string)
+products_collection = database.products
+users_collection = database.users
+rules_collection = database.rules
+ingredients_collection = database.ingredients
+
+"""
+@brief user documents are cached per auth0_id for USER_CACHE_TTL seconds (default 5).
+@details writes through the repository drop the entry at once; the TTL only bounds how long
+another worker's writes can go unseen. USER_CACHE_TTL=0 disables the cache.
+"""
+user_cache_ttl = float(os.getenv("USER_CACHE_TTL", "5"))
+user_repository = UserRepository(
+    users_collection,
+    cache=MemoryCache(int(os.getenv("USER_CACHE_SIZE", "10000"))) if user_cache_ttl > 0 else None,
+    ttl=user_cache_ttl,
+)
+product_repository = ProductRepository(products_collection)
+
+"""
+@brief community ratings, written behind through a local queue (see rating_queue.py).
+@details queued changes are folded into the products every RATING_FOLD_INTERVAL seconds
+(default 1); RATING_WRITE_BEHIND=0 folds every rating at once instead.
+"""
+rating_fold_interval = float(os.getenv("RATING_FOLD_INTERVAL", "1"))
+community_ratings_manager = CommunityRatingsManager(
+    products_collection, database.ratings, queue=create_rating_queue()
+)
+
+
+async def migrate_community_ratings():
+    try:
+        await community_ratings_manager.migrate()
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        logger.exception("community rating migration failed")
+
+"""
+@brief compiled in-memory index of the 'rules' collection.
+@details reloaded whenever the collection changes, so rule checks never query MongoDB.
+"""
+rule_index = RuleIndex(rules_collection)
+
+"""
+@brief resolves scraped ingredient lists to property tags in a single query.
+@details set INGREDIENTS_PRELOAD=1 to keep the 'ingredients' collection in memory instead.
+"""
+ingredient_resolver = IngredientResolver(
+    ingredients_collection, preload=os.getenv("INGREDIENTS_PRELOAD") == "1"
+)
+
+"""
+@brief full-text index of the products already stored in the database.
+@details searches are answered from it first and only scrape Incidecoder on a miss.
+"""
+catalog_index = CatalogIndex(products_collection)
+
+"""
+@brief in-memory tag postings and scores of the products users can add.
+@details rebuilt in the background every RECOMMENDATION_REFRESH_INTERVAL seconds (default 300).
+"""
+recommendation_index = RecommendationIndex(
+    products_collection,
+    [skin_type.value for skin_type in SkinType],
+    refresh_interval=float(os.getenv("RECOMMENDATION_REFRESH_INTERVAL", "300")),
+)
 
 """
 @brief hardcoded urls
@@ -121,6 +258,8 @@ async def callback(request: Request):
     token = await oauth.auth0.authorize_access_token(request)
 
     request.session["user"] = token
+    # a session id set before logging in must not carry the login
+    rotate_session(request)
     # print("Token: ", token)
 
     # extracting user info from the token
@@ -130,15 +269,13 @@ async def callback(request: Request):
     given_name = user_info.get("given_name")
     user_id = user_info.get("sub")
 
-    print("Given Name: ", given_name)
-    print("User ID: ", user_id)
+    logger.info("user logged in", extra={"user_id": user_id})
 
     request.session["user_id"] = user_id
-    print("Session after saving token:", request.session)
+    logger.debug("session after saving token: %s", request.session)
 
     # debugging
-    session_cookie = request.cookies.get("session")
-    print("Session Cookie (use in curl):", session_cookie)
+    logger.debug("session cookie (use in curl): %s", request.cookies.get("session"))
 
     if given_name == None:
         given_name = user_info.get("nickname")
@@ -146,11 +283,9 @@ async def callback(request: Request):
     # storing userID in MongoDB
     if user_id:
         # checking if user already exists
-        print("user_id is populated")
-        existing_user = users_collection.find_one({"auth0_id": user_id})
-        if not existing_user:
+        if not await user_repository.exists(user_id):
             # creating a new user entry
-            users_collection.insert_one(
+            await user_repository.create(
                 {
                     "auth0_id": user_id,
                     "given_name": given_name,
@@ -158,10 +293,8 @@ async def callback(request: Request):
                     "skin_type": "",
                 }
             )
-            print("this is a new user")
+            logger.info("created new user", extra={"user_id": user_id})
             return RedirectResponse(f"{frontend_url}/newuser?name={given_name}")
-        else:
-            print("user already exists")
 
     # redirecting user back to React app with a success status
     return RedirectResponse(f"{frontend_url}/landing?name={given_name}")
@@ -189,6 +322,18 @@ async def logout(request: Request):
         )
     )
 
+"""
+@fn metrics
+@brief exposes request, MongoDB, scraping and cache metrics for Prometheus.
+@return the metrics in the Prometheus text format.
+"""
+
+
+@app.get("/metrics")
+async def metrics():
+    return Response(render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 """
 @fn session
 @brief retrieves the current user session information.
@@ -203,9 +348,54 @@ async def session(request: Request):
     else:
         return JSONResponse(content={"error": "Not authenticated"}, status_code=401)
 
+"""
+@fn current_user_id
+@brief dependency resolving the auth0 id of the logged in user from the session.
+@details rejects unauthenticated requests before any database work.
+@param request the http request object.
+@return the auth0 id of the user.
+"""
+
+
+def current_user_id(request: Request) -> str:
+    user = request.session.get("user") or {}
+    user_id = user.get("userinfo", {}).get("sub")
+    if not user_id:
+        raise HTTPException(status_code=401, detail="User ID not found in session")
+    return user_id
+
+
+"""
+@fn current_user
+@brief dependency loading the logged in user's document once per request.
+@details FastAPI resolves a dependency once per request however many parameters use it,
+and the document itself comes from the user cache when it is fresh. only the routine of
+the route's {day} is loaded, none for routes without one (e.g. /skintype).
+@param request the http request object.
+@param user_id the auth0 id resolved by current_user_id.
+@return the user's skin type and routine of the day (see repository.UserContext).
+"""
+
+
+async def current_user(request: Request, user_id: str = Depends(current_user_id)) -> UserContext:
+    day = request.path_params.get("day")
+    # the path parameter itself is validated by the route
+    if day not in {time_of_day.value for time_of_day in TimeOfDay}:
+        day = None
+    user_doc = await user_repository.find_context(user_id, day)
+    if not user_doc:
+        raise HTTPException(status_code=404, detail="User not found")
+    return user_doc
+
+
+# maximum number of results returned by a search
+SEARCH_RESULT_LIMIT = 5
+
 """
 @fn search_product_endpoint
 @brief searches for products based on user input query.
+@details results come from the local catalog first and are topped up with scraped results,
+deduplicated by name and brand.
 @param search_input SearchInput object containing the search query.
 @return dictionary containing search results or HTTPException if query is empty.
 """
@@ -217,149 +407,209 @@ async def search_product_endpoint(search_input: SearchInput):
     user_input = search_input.query
     if not user_input:
         raise HTTPException(status_code=400, detail="Search query is required")
-        
-    search_results = get_search_results(user_input)
+
+    # answering from our own catalog first, scraping only when it has too few matches
+    search_results = await catalog_index.search(user_input, limit=SEARCH_RESULT_LIMIT)
+    if len(search_results) < SEARCH_RESULT_LIMIT:
+        scraped_results = await get_search_results(user_input, SEARCH_RESULT_LIMIT)
+        search_results = merge_results(search_results, scraped_results, SEARCH_RESULT_LIMIT)
     return {"results": search_results}
 
 @app.get("/{day}/products/{product_id}/rating")
-async def get_product_rating(day: TimeOfDay, product_id: str, request: Request):
-    user = request.session.get("user")
-    user_info = user.get("userinfo", {})
-    user_id = user_info.get("sub")
-    print("getting the rating for this product from this user: ", user_id)
+async def get_product_rating(day: TimeOfDay, product_id: str, user: UserContext = Depends(current_user)):
+    user_id = user["auth0_id"]
 
-    if not user_id:
-        raise HTTPException(status_code=401, detail="User ID not found in session")
+    try:
+        product_id = ObjectId(product_id)
+    except Exception:
+        raise HTTPException(status_code=404, detail="Product not found in user's routine")
 
-    user_doc = users_collection.find_one({"auth0_id": user_id})
+    entry = next(
+        (entry for entry in user.get("products", {}).get(day.value, []) if entry["_id"] == product_id),
+        None,
+    )
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Product not found in user's routine")
 
-    if not user_doc:
-        raise HTTPException(status_code=404, detail="User not found")
+    product_rating = entry.get("rating", 0)
 
-    day_products = user_doc.get("products", {}).get(day.value, [])
+    product_docs = await product_repository.find_community_ratings([product_id])
+    if not product_docs:
+        raise HTTPException(status_code=404, detail="Product not found in the product collection")
+    # ratings still queued are counted too, so the user sees their own rating at once
+    pending = (await community_ratings_manager.pending([product_id])).get(str(product_id))
+    averaged_community_rating = community_averages(product_docs[0].get("community_rating", {}), pending)
 
-    for product in day_products:
-        if str(product["_id"]) == product_id:
-            product_rating = product.get("rating", 0)
-            print("this is the rating: ", product_rating)
-        
-            product_doc = products_collection.find_one({"_id": ObjectId(product_id)})
-            if not product_doc:
-                raise HTTPException(status_code=404, detail="Product not found in the product collection")
-            community_rating = product_doc.get("community_rating", {})
-            print("Community rating: ", community_rating)
+    logger.debug(
+        "rating of %s for %s: %s, community: %s",
+        product_id, user_id, product_rating, averaged_community_rating,
+    )
+    return {
+        "user_rating": product_rating,
+        "community_rating": averaged_community_rating,
+    }
 
-            averaged_community_rating = {}
-            for skin_type, (rating_sum, rating_count) in community_rating.items():
-                averaged_community_rating[skin_type] = (
-                    rating_sum / rating_count if rating_count > 0 else 0
-                )
 
-            print("Averaged community rating: ", averaged_community_rating)
+"""
+@fn get_routine_ratings
+@brief returns the user's and the averaged community ratings of every product in the routine.
 
-            return {
-                "user_rating": product_rating,
-                "community_rating": averaged_community_rating,
-            }
+@details
+one user query for the day's routine and one $in query for the products' community
+ratings, instead of a request per product card.
 
-    raise HTTPException(status_code=404, detail="Product not found in user's routine")
+@param day time of day (am or pm).
+@return dictionary mapping product ids to their user_rating and community_rating.
+"""
+
+
+@app.get("/{day}/ratings")
+async def get_routine_ratings(day: TimeOfDay, user: UserContext = Depends(current_user)):
+    day_products = user.get("products", {}).get(day.value, [])
+    product_docs = await product_repository.find_community_ratings(
+        entry["_id"] for entry in day_products
+    )
+    pending = await community_ratings_manager.pending(product_doc["_id"] for product_doc in product_docs)
+    community_ratings = {
+        product_doc["_id"]: community_averages(
+            product_doc.get("community_rating", {}), pending.get(str(product_doc["_id"]))
+        )
+        for product_doc in product_docs
+    }
+
+    ratings = {}
+    for entry in day_products:
+        # products missing from the product collection are left out, as in get_product_rating
+        if entry["_id"] not in community_ratings:
+            continue
+        ratings[str(entry["_id"])] = {
+            "user_rating": entry.get("rating", 0),
+            "community_rating": community_ratings[entry["_id"]],
+        }
+    return {"ratings": ratings}
 
 
 @app.patch("/{day}/products/{product_id}/{rating}/{old_rating}")
 async def update_product_rating(
-    day: TimeOfDay, product_id: str, rating: int, old_rating: int, request: Request
+    day: TimeOfDay, product_id: str, rating: int, old_rating: int,
+    user_id: str = Depends(current_user_id),
 ):
-    user = request.session.get("user")
-    user_info = user.get("userinfo", {})
-    user_id = user_info.get("sub")
-
-    print("My rating being updated to: ", rating)
-    print("Old rating: ", old_rating)
-
-    if not user_id:
-        raise HTTPException(status_code=401, detail="User ID not found in session")
-    
-    user_doc = users_collection.find_one({"auth0_id": user_id})
-    if not user_doc:
-        raise HTTPException(status_code=404, detail="User not found in the user collection")
-    
-    skin_type = user_doc.get("skin_type", "normal")
-    print("User's skin type: ", skin_type)
+    try:
+        product_id = ObjectId(product_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid product ID format")
 
-    update_result = users_collection.update_one(
-        {"auth0_id": user_id, f"products.{day.value}._id": ObjectId(product_id)},
-        {"$set": {f"products.{day.value}.$.rating": rating}},
+    # setting the user's rating, reading back the previous one in the same round trip
+    user_before = await user_repository.set_product_rating(
+        user_id, day.value, product_id, rating
     )
+    if not user_before:
+        raise HTTPException(
+            status_code=404, detail="Product not found or rating unchanged"
+        )
 
-    if update_result.modified_count == 0:
+    # the stored rating is authoritative, the client's old_rating may be stale
+    old_rating = user_before["products"][day.value][0].get("rating", 0)
+    if old_rating == rating:
         raise HTTPException(
             status_code=404, detail="Product not found or rating unchanged"
         )
 
-    product_doc = products_collection.find_one({"_id": ObjectId(product_id)})
-    if not product_doc:
+    skin_type = user_before.get("skin_type") or SkinType.normal.value
+    logger.debug(
+        "rating of %s for %s changed from %s to %s (%s skin)",
+        product_id, user_id, old_rating, rating, skin_type,
+    )
+
+    # recording the user's rating and folding the change into the community averages
+    result = await community_ratings_manager.rate(product_id, user_id, skin_type, rating)
+    if result == "product_not_found":
         raise HTTPException(status_code=404, detail="Product not found in the product collection")
 
-    community_rating = product_doc.get("community_rating", {})
-    rating_sum, rating_count = community_rating.get(skin_type, [0, 0])  # Default values
+    return {"message": "Rating updated successfully"}
 
-    rating_sum = rating_sum - old_rating + rating
 
-    # (old_rating == 0 means no previous rating existed)
-    if old_rating == 0:
-        rating_count += 1
+"""
+@fn get_leaderboard
+@brief returns the best rated or trending products for a skin type.
 
-    # updating community rating for the skin type
-    community_rating[skin_type] = [rating_sum, rating_count]
+@details
+top ranks by the bayesian average of the skin type's ratings, trending by the number of
+recent ratings (see ratings.py). both are kept up to date on the products as ratings are
+folded in and read from descending indexes, so no request scans the catalog. ratings still
+waiting in the rating queue are counted once folded, within RATING_FOLD_INTERVAL.
 
-    products_collection.update_one(
-        {"_id": ObjectId(product_id)},
-        {
-            "$set": {
-                f"community_rating.{skin_type}": community_rating[skin_type],
-            }
-        },
-    )
+@param skin_type the skin type.
+@param kind "top" (default) or "trending".
+@param limit number of products returned (1 to 50, default 10).
+@return dictionary with the ranked products.
+"""
 
-    print("Updated community rating: ", community_rating)
 
-    return {"message": "Rating updated successfully"}
+@app.get("/leaderboards/{skin_type}")
+async def get_leaderboard(
+    skin_type: SkinType, kind: LeaderboardKind = LeaderboardKind.top, limit: int = Query(10, ge=1, le=50)
+):
+    field = "score" if kind == LeaderboardKind.top else "trend"
+    product_docs = await product_repository.find_leaderboard(skin_type.value, field, limit)
+    products = []
+    for product_doc in product_docs:
+        rating = product_doc.get("community_rating", {}).get(skin_type.value, {})
+        products.append({
+            "id": str(product_doc["_id"]),
+            "brand": product_doc.get("brand"),
+            "name": product_doc.get("name"),
+            "image": product_doc.get("image"),
+            "community_rating": rating.get("average", 0),
+            "rating_count": rating.get("count", 0),
+            "score": rating.get("score", 0),
+        })
+    return {"skin_type": skin_type.value, "kind": kind.value, "products": products}
+
+
+"""
+@fn get_safe_products
+@brief recommends catalog products that can be added to a routine without an avoid conflict.
 
+@details
+the routine's tags are looked up in the compiled rules for every tag it must not meet, and
+the products carrying one of them are dropped through the recommendation index's tag
+postings (see recommendations.py). the rest are ranked by their bayesian community rating
+for the user's skin type, as the top leaderboard is. usewith and usewhen rules only advise
+and do not exclude products.
 
-@app.get("/skintype", response_model=Dict[str, SkinType])
-async def get_skintype(request: Request):
-   user = request.session.get("user")
-   user_info = user.get("userinfo", {})
-   user_id = user_info.get("sub")
+@param day time of day ("AM" or "PM").
+@param limit number of products returned (1 to 50, default 10).
+@return dictionary with the ranked products.
+"""
 
-   if not user_id:
-       raise HTTPException(status_code=401, detail="User ID not found in session")
 
-   user_doc = users_collection.find_one({"auth0_id": user_id})
-   if not user_doc:
-       raise HTTPException(status_code=404, detail="User not found")
+@app.get("/{day}/recommendations")
+async def get_safe_products(
+    day: TimeOfDay, limit: int = Query(10, ge=1, le=50), user: UserContext = Depends(current_user)
+):
+    skin_type = user.get("skin_type") or SkinType.normal.value
+    product_ids = [entry["_id"] for entry in user.get("products", {}).get(day.value, [])]
+    routine_products = await product_repository.find_tags(product_ids) if product_ids else []
+
+    compiled = await rule_index.get()
+    data = await recommendation_index.get()
+    products = data.recommend(routine_products, product_ids, compiled, skin_type, limit)
+    return {"day": day.value, "skin_type": skin_type, "products": products}
 
-   skin_type = user_doc.get("skin_type", SkinType.normal.value)
+
+@app.get("/skintype", response_model=Dict[str, SkinType])
+async def get_skintype(user: UserContext = Depends(current_user)):
+   skin_type = user.get("skin_type", SkinType.normal.value)
    return {"skin_type": SkinType(skin_type)}
 
 
 @app.post("/{skintype}")
-async def setting_skintype(skintype: SkinType, request: Request):
-    user = request.session.get("user")
-    user_info = user.get("userinfo", {})
-    user_id = user_info.get("sub")
-    
-    if not user_id:
-        raise HTTPException(status_code=401, detail="User ID not found in session")
+async def setting_skintype(skintype: SkinType, user_id: str = Depends(current_user_id)):
+    update_result = await user_repository.set_skin_type(user_id, skintype.value)
 
-    user_doc = users_collection.find_one({"auth0_id": user_id})
-    if not user_doc:
+    if update_result.matched_count == 0:
         raise HTTPException(status_code=404, detail="User not found")
-
-    update_result = users_collection.update_one(
-        {"auth0_id": user_id}, {"$set": {"skin_type": skintype.value}}
-    )
-    
     if update_result.modified_count == 0:
         raise HTTPException(status_code=500, detail="Failed to update skin type")
 
@@ -393,122 +643,56 @@ def product_serializer(product) -> dict:
 
 
 @app.get("/{day}/rules/")
-async def get_user_rules(day: TimeOfDay, request: Request):
-    user = request.session.get("user")
-    user_info = user.get("userinfo", {})
-    user_id = user_info.get("sub")
+async def get_user_rules(day: TimeOfDay, user: UserContext = Depends(current_user)):
+    user_id = user["auth0_id"]
+
+    # returning the precomputed result while it still matches the routine and the rules
+    compiled = await rule_index.get()
+    product_ids = [entry["_id"] for entry in user.get("products", {}).get(day.value, [])]
+    cached = await user_repository.find_routine_rules(user_id, day.value)
+    if cached and RoutineRules(cached).is_current(product_ids, compiled):
+        return cached["result"]
+
+    # evaluating the whole routine against the in-memory rule index
+    products = await load_routine_products(user, day)
+    with RULE_EVALUATION_DURATION.time():
+        routine_rules = RoutineRules.compute(products, product_ids, day.value, compiled)
+    await user_repository.set_routine_rules(user_id, day.value, routine_rules.state)
+    product_rules = routine_rules.state["result"]
+
+    logger.debug("rules of %s %s: %s", user_id, day.value, product_rules)
+    return product_rules
 
-    if not user_id:
-        raise HTTPException(status_code=401, detail="User ID not found in session")
 
-    # fetching products for the user and day using session-based user_id
-    products = await get_user_products(day, request)
-
-    product_rules = {"avoid": [], "usewith": [], "usewhen": []}
-    product_count = 0
-
-    # fetching all the rules given the tags from the products
-    for product in products:
-        print("Product", product_count, ": ", product.get("name"))
-        product_count += 1
-        tags = product.get("tags", [])
-        print("tags:", tags)
-        avoid = []
-        usewith = []
-        usewhen = []
-        count = 0
-
-        for tag in tags:
-            rule = rules_collection.find_one({"_id": {"$in": [tag]}})
-            print("Rule", count, ": ", rule)
-            count += 1
-            if rule:
-                avoid.extend(rule.get("rules", {}).get("avoid", []))
-                print("260", avoid)
-                usewith.extend(
-                    [
-                        {
-                            "rule": rule_data,
-                            "source": product["id"],
-                        }
-                        for rule_data in rule.get("rules", {}).get("usewith", [])
-                    ]
-                )
-
-                if rule.get("rules", {}).get("usewhen", []):
-                    for rule_data in rule.get("rules", {}).get("usewhen", []):
-                        if rule_data.get("tag") != day.value:
-                            usewhen.append(
-                                {
-                                    "rule": rule_data,
-                                    "source": product["id"],
-                                }
-                            )
-
-        print("265 Avoid:", avoid)
-        for product_comp in products:
-            # skip self
-            if product_comp["id"] == product["id"]:
-                continue
-            print("Product Comp:", product_comp.get("tags", []))
-            for tag in product_comp.get("tags", []):
-                # check with avoid list
-                for avoid_rule in avoid:
-                    print("Avoid Rule Tag:", avoid_rule["tag"])
-                    print("Avoid Rule Message:", avoid_rule["message"])
-                    if tag == avoid_rule["tag"]:
-                        product_rules["avoid"].append(
-                            {
-                                "source": product["id"],
-                                "comp": product_comp["id"],
-                                "rule": avoid_rule,
-                                # "og_tag": extracted_other_tag
-                            }
-                        )
-                    for usewith_index in range(len(usewith) - 1, -1, -1):
-                        if tag == usewith[usewith_index]["rule"]["tag"]:
-                            del usewith[usewith_index]
-
-        product_rules["usewith"].extend(usewith)
-        product_rules["usewhen"].extend(usewhen)
-
-    # print("Product Rules for avoid:", product_rules["avoid"])
-    # print("Product Rules for usewith:", product_rules["usewith"])
-    # print("Product rules for usewhen: ", product_rules["usewhen"])
-
-    # convert product IDs to names for output
-    product_names = {product["id"]: product["name"] for product in products}
-
-    product_rules["avoid"] = [
-        {
-            **rule,
-            "source": product_names.get(rule["source"]),
-            "source_id:": rule["source"],
-            "comp": product_names.get(rule["comp"]),
-            "comp_id": rule["comp"],
-        }
-        for rule in product_rules["avoid"]
-    ]
-    product_rules["usewith"] = [
-        {
-            **rule,
-            "source": product_names.get(rule["source"]),
-            "source_id:": rule["source"],
-        }
-        for rule in product_rules["usewith"]
-    ]
-
-    product_rules["usewhen"] = [
-        {
-            **rule,
-            "source": product_names.get(rule["source"]),
-            "source_id:": rule["source"],
-        }
-        for rule in product_rules["usewhen"]
-    ]
+"""
+@fn refresh_routine_rules
+@brief incrementally updates the precomputed rules of a routine after it changed.
+@details only the pairs involving the added or removed product are evaluated. if the cached
+result was already stale it is left alone and recomputed on the next read.
+@param user_id the id of the user.
+@param day time of day ("AM" or "PM").
+@param user_before user document (routine and cached rules) from before the change.
+@param added serialized product added to the routine, if any.
+@param removed_id id of the product removed from the routine, if any.
+"""
 
-    print("Product Rules:", product_rules)
-    return product_rules
+
+async def refresh_routine_rules(user_id, day: TimeOfDay, user_before, added=None, removed_id=None):
+    cached = user_before.get("rules_cache", {}).get(day.value)
+    if not cached:
+        return
+
+    compiled = await rule_index.get()
+    routine_rules = RoutineRules(cached)
+    previous_ids = [entry["_id"] for entry in user_before.get("products", {}).get(day.value, [])]
+    if not routine_rules.is_current(previous_ids, compiled):
+        return
+
+    if added is not None:
+        routine_rules = routine_rules.add_product(added, previous_ids, day.value, compiled)
+    else:
+        routine_rules = routine_rules.remove_product(str(removed_id), previous_ids, day.value, compiled)
+    await user_repository.set_routine_rules(user_id, day.value, routine_rules.state)
 
 
 """
@@ -521,30 +705,29 @@ async def get_user_rules(day: TimeOfDay, request: Request):
 
 
 @app.get("/{day}/products/")
-async def get_user_products(day: TimeOfDay, request: Request):
-    user = request.session.get("user")
-    user_info = user.get("userinfo", {})
-    user_id = user_info.get("sub")
+async def get_user_products(day: TimeOfDay, user: UserContext = Depends(current_user)):
+    logger.debug("user doc: %s", user)
 
-    if not user_id:
-        raise HTTPException(status_code=401, detail="User ID not found in session")
+    return await load_routine_products(user, day)
 
-    user_doc = users_collection.find_one({"auth0_id": user_id})
 
-    if not user_doc:
-        raise HTTPException(status_code=404, detail="User not found")
+"""
+@fn load_routine_products
+@brief fetches the products of one routine of a user document.
+@param user_doc the user document.
+@param day time of day ("AM" or "PM").
+@return a list of serialized product dictionaries.
+"""
 
-    print("User Doc:", user_doc)
-    product_ids = user_doc.get("products", [])
-    print("Product IDs:", product_ids)
 
+async def load_routine_products(user_doc, day: TimeOfDay):
     # fetching product details based on AM or PM
-    products = user_doc["products"].get(day.value, [])
+    products = user_doc.get("products", {}).get(day.value, [])
     product_ids = [entry["_id"] for entry in products]
     product_ratings = {str(entry["_id"]): entry["rating"] for entry in products}
-    user_products = list(products_collection.find({"_id": {"$in": product_ids}}))
+    user_products = await product_repository.find_by_ids(product_ids)
 
-    print(f"User Products for {day.value}:", user_products)
+    logger.debug("user products for %s: %s", day.value, user_products)
     for product in user_products:
         product_id_str = str(product["_id"])
         product["rating"] = product_ratings.get(product_id_str, 0)
@@ -562,93 +745,123 @@ async def get_user_products(day: TimeOfDay, request: Request):
 """
 
 @app.post("/{day}/products")
-async def add_selected_product(day: TimeOfDay, product_input: ProductUrlInput, request: Request):
-        
-    user = request.session.get("user")
-    user_info = user.get("userinfo", {})
-    user_id = user_info.get("sub")
-    
-    if not user_id:
-        raise HTTPException(status_code=401, detail="User ID not found in session")
-    
-    # Get full product details using the stored URL
-    product_data = get_product_data_by_url(product_input.product_url)
-    
-    if not product_data:
-        raise HTTPException(status_code=404, detail="Product not found")
-        
-    product_name = product_data.get("name")
-    product_brand = product_data.get("brand")
-    
-    # Check if product already exists in database
-    existing_product = products_collection.find_one(
-        {"name": product_name, "brand": product_brand}
-    )
+async def add_selected_product(
+    day: TimeOfDay, product_input: ProductUrlInput, user: UserContext = Depends(current_user)
+):
+    user_id = user["auth0_id"]
+
+    # products ingested ahead of time (see ingest.py) are a local lookup, no scraping needed
+    existing_product = await product_repository.find_by_url(product_input.product_url)
+
+    if not existing_product:
+        # Get full product details using the stored URL
+        product_data = await get_product_data_by_url(product_input.product_url)
+
+        # pages whose name or brand could not be parsed would all collide on name and brand
+        if not product_data or not is_parsed(product_data):
+            raise HTTPException(status_code=404, detail="Product not found")
+
+        product_name = product_data.get("name")
+        product_brand = product_data.get("brand")
+
+        # Check if product already exists in database
+        existing_product = await product_repository.find_by_name_brand(product_name, product_brand)
+        if not existing_product:
+            new_product = await create_product(product_data, product_input.product_url)
+            if new_product is None:
+                # a concurrent add or the ingestion job inserted it since the lookup above
+                existing_product = await product_repository.find_by_name_brand(product_name, product_brand)
+                if not existing_product:
+                    raise HTTPException(status_code=409, detail="Product changed while adding it, please retry")
     
     if existing_product:
         product_id = existing_product["_id"]
         # Check if product is already in user's routine
-        user = users_collection.find_one(
-            {"auth0_id": user_id, f"products.{day.value}": product_id}
-        )
-        if user:
+        if was_in_routine(user, day, product_id):
             return {"message": "Product already in user's products list"}
             
-        # Update user's products list with existing product
-        update_result = users_collection.update_one(
-            {"auth0_id": user_id},
-            {
-                "$addToSet": {
-                    f"products.{day.value}": {"_id": product_id, "rating": 0}
-                }
-            }
-        )
+        # Update user's products list with existing product, unless a concurrent add beat us
+        user_before = await user_repository.add_product(user_id, day.value, product_id)
+        added = user_before is not None
         message = (
             "Existing product added to user's products"
-            if update_result.modified_count > 0
+            if added
             else "Product already in user's products list"
         )
+        product_doc = existing_product
     else:
-        # Add new product to database
-        ingredients = product_data.get("ingredients", [])
-        community_rating = {
-            SkinType.oily.value: [0, 0],
-            SkinType.dry.value: [0, 0], 
-            SkinType.normal.value: [0, 0],
-            SkinType.combination.value: [0, 0],
-            SkinType.sensitive.value: [0, 0],
-        }
-        
-        # Process tags
-        tags = []
-        for i in ingredients:
-            ingredient = i.lower().replace(" ", "")
-            ingredient_id = ingredients_collection.find_one({"_id": ingredient})
-            if ingredient_id and "categories" in ingredient_id:
-                tags.extend(ingredient_id["categories"])
-                
-        tags = list(set(tags))
-        product_data["tags"] = tags
-        product_data["community_rating"] = community_rating
-        
-        # Insert new product
-        inserted_product = products_collection.insert_one(product_data)
-        product_id = inserted_product.inserted_id
-        
+        product_id = new_product["_id"]
+
         # Add to user's routine
-        update_result = users_collection.update_one(
-            {"auth0_id": user_id},
-            {"$addToSet": {f"products.{day.value}": {"_id": product_id, "rating": 0}}}
-        )
+        user_before = await user_repository.add_product(user_id, day.value, product_id)
+        added = user_before is not None
         
         message = (
             "New product created and added to user's products"
-            if update_result.modified_count > 0
+            if added
             else "Failed to add product to user's products list"
         )
+        product_doc = new_product
+
+    if added:
+        await refresh_routine_rules(
+            user_id, day, user_before, added=product_serializer(product_doc)
+        )
     
     return {"message": message}
 
+"""
+@fn create_product
+@brief tags a scraped product and inserts it into the 'products' collection.
+@param product_data product scraped from its page.
+@param product_url url of the product page.
+@return the inserted product document, or None if a product with the same name and brand
+was inserted concurrently (name_brand_unique).
+"""
+
+
+async def create_product(product_data, product_url):
+    # Process tags, resolving the whole ingredient list in one query
+    resolution = await ingredient_resolver.resolve(product_data.get("ingredients", []))
+    if resolution.unresolved:
+        logger.info(
+            "unresolved ingredients",
+            extra={"product": product_data.get("name"), "ingredients": resolution.unresolved},
+        )
+    product_doc = {
+        **product_data,
+        "tags": resolution.tags,
+        "community_rating": empty_community_rating(),
+        "url": product_url,
+    }
+
+    try:
+        product_id = await product_repository.insert(dict(product_doc))
+    except DuplicateKeyError:
+        return None
+    product_doc["_id"] = product_id
+    catalog_index.add(product_doc)
+    recommendation_index.add(product_doc)
+    return product_doc
+
+
+"""
+@fn was_in_routine
+@brief tells whether a product was in a routine before it was updated.
+@param user_before user document from before the update, None if the user does not exist.
+@param day time of day ("AM" or "PM").
+@param product_id the id of the product.
+@return True if the routine contained the product.
+"""
+
+
+def was_in_routine(user_before, day: TimeOfDay, product_id: ObjectId) -> bool:
+    if user_before is None:
+        return False
+    entries = user_before.get("products", {}).get(day.value, [])
+    return any(entry["_id"] == product_id for entry in entries)
+
+
 """
 @fn delete_user_product
 @brief deletes a product from a user's product list for a specified time (AM/PM).
@@ -660,35 +873,23 @@ async def add_selected_product(day: TimeOfDay, product_input: ProductUrlInput, r
 
 
 @app.delete("/{day}/products/{product_id}")
-async def delete_user_product(day: TimeOfDay, product_id: str, request: Request):
-    user = request.session.get("user")
-    user_info = user.get("userinfo", {})
-    user_id = user_info.get("sub")
-    if not user_id:
-        raise HTTPException(status_code=401, detail="User ID not found in session")
-
+async def delete_user_product(day: TimeOfDay, product_id: str, user_id: str = Depends(current_user_id)):
     try:
         product_id = ObjectId(product_id)
     except Exception as e:
         raise HTTPException(status_code=400, detail="Invalid product ID format")
 
-    product_key = f"products.{day.value}"
-    print("this is the product key: ", product_key)
-    result = users_collection.update_one(
-        {"auth0_id": user_id}, {"$pull": {product_key: {"_id": product_id}}}
-    )
+    user_before = await user_repository.remove_product(user_id, day.value, product_id)
 
     # checking if any documents were modified
-    if result.modified_count == 0:
+    if not was_in_routine(user_before, day, product_id):
         raise HTTPException(
             status_code=404, detail="Product not found or user not found"
         )
 
+    await refresh_routine_rules(user_id, day, user_before, removed_id=product_id)
     return {"message": "Product deleted successfully"}
 
 
-# initialize RatingsManager with the products collection
-community_ratings_manager = CommunityRatingsManager(products_collection)
-
 if __name__ == "__main__":
     uvicorn.run(app, host="127.0.0.1", log_level="info")
\ No newline at end of file
@@ -0,0 +1,275 @@
+import hashlib
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from starlette.datastructures import MutableHeaders
+from starlette.requests import HTTPConnection
+
+"""
+@file sessions.py
+@brief server-side session storage, with only an opaque session id kept in the cookie.
+
+@details
+starlette's SessionMiddleware signs the whole session into the cookie, so the Auth0 token
+stored at login (id_token, access_token, userinfo) travelled with every request and was
+verified every time. ServerSessionMiddleware keeps the session data in a session store and
+the cookie only carries a random 256-bit session id; the store is keyed by its sha256, so
+the stored ids cannot be replayed as cookies.
+
+two interchangeable stores sharing the SessionStore base are provided, like the scrape
+caches (see cache.py):
+- MemorySessionStore: per-process dictionary, for tests and single-worker runs.
+- SQLiteSessionStore: local SQLite file shared by every uvicorn worker on the machine and
+  kept across restarts.
+
+a session is written back only when the handler changed it, and expires max_age seconds
+after its last write, like a SessionMiddleware cookie. when a user logs in, rotate_session
+moves the session to a new id, so an id planted before authentication (session fixation)
+is never authenticated.
+"""
+
+# default lifetime of a session, in seconds
+SESSION_MAX_AGE = 14 * 24 * 60 * 60
+
+
+def session_key(session_id: str) -> str:
+    return hashlib.sha256(session_id.encode("utf-8")).hexdigest()
+
+
+"""
+@class SessionStore
+@brief base of the session stores, which implement load, save and delete.
+@param max_age seconds a session is kept after its last write.
+"""
+
+
+class SessionStore:
+    def __init__(self, max_age: int = SESSION_MAX_AGE):
+        self.max_age = max_age
+
+    def load(self, session_id: str):
+        """
+        returns the serialized session data, or None if the session is unknown or expired.
+        """
+        raise NotImplementedError
+
+    def save(self, session_id: str, data: str):
+        raise NotImplementedError
+
+    def delete(self, session_id: str):
+        raise NotImplementedError
+
+    def create(self, session: dict) -> str:
+        """
+        stores a new session and returns its id (e.g. to log in users in benchmarks).
+        """
+        session_id = secrets.token_urlsafe(32)
+        self.save(session_id, json.dumps(session))
+        return session_id
+
+
+"""
+@class MemorySessionStore
+@brief in-process session store.
+@param max_age seconds a session is kept after its last write.
+"""
+
+
+class MemorySessionStore(SessionStore):
+    def __init__(self, max_age: int = SESSION_MAX_AGE):
+        super().__init__(max_age)
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def load(self, session_id: str):
+        key = session_key(session_id)
+        with self._lock:
+            entry = self._sessions.get(key)
+            if entry is None or entry[0] <= time.time():
+                self._sessions.pop(key, None)
+                return None
+            return entry[1]
+
+    def save(self, session_id: str, data: str):
+        with self._lock:
+            self._sessions[session_key(session_id)] = (time.time() + self.max_age, data)
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_key(session_id), None)
+
+
+"""
+@class SQLiteSessionStore
+@brief session store in a local SQLite database shared across processes.
+@param path path of the SQLite database file.
+@param max_age seconds a session is kept after its last write.
+"""
+
+
+class SQLiteSessionStore(SessionStore):
+    def __init__(self, path: str, max_age: int = SESSION_MAX_AGE):
+        super().__init__(max_age)
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " key TEXT PRIMARY KEY,"
+            " data TEXT NOT NULL,"
+            " expires_at REAL NOT NULL)"
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite connections must not be shared between threads
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            # WAL lets several workers read while one writes
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def load(self, session_id: str):
+        row = self._connection().execute(
+            "SELECT data, expires_at FROM sessions WHERE key = ?", (session_key(session_id),)
+        ).fetchone()
+        if row is None or row[1] <= time.time():
+            return None
+        return row[0]
+
+    def save(self, session_id: str, data: str):
+        self._connection().execute(
+            "INSERT OR REPLACE INTO sessions (key, data, expires_at) VALUES (?, ?, ?)",
+            (session_key(session_id), data, time.time() + self.max_age),
+        )
+        self._writes += 1
+        # expired sessions are only swept now and then, not on every write
+        if self._writes % 100 == 0:
+            self.evict()
+
+    def delete(self, session_id: str):
+        self._connection().execute("DELETE FROM sessions WHERE key = ?", (session_key(session_id),))
+
+    def evict(self):
+        self._connection().execute("DELETE FROM sessions WHERE expires_at <= ?", (time.time(),))
+
+
+"""
+@fn create_session_store
+@brief creates the session store configured through the environment.
+
+@details
+SESSION_BACKEND selects "sqlite" (default) or "memory"; SESSION_STORE_PATH sets the SQLite
+file (default "sessions.sqlite3" next to this module).
+
+@param max_age seconds a session is kept after its last write.
+@return a MemorySessionStore or SQLiteSessionStore.
+"""
+
+
+def create_session_store(max_age: int = SESSION_MAX_AGE):
+    if os.getenv("SESSION_BACKEND", "sqlite") == "memory":
+        return MemorySessionStore(max_age)
+
+    default_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sessions.sqlite3")
+    return SQLiteSessionStore(os.getenv("SESSION_STORE_PATH", default_path), max_age)
+
+
+"""
+@fn rotate_session
+@brief moves the request's session to a new session id once the response starts.
+@details the record stored under the old id is deleted. call it whenever the session is
+authenticated.
+@param request the request whose session is rotated.
+"""
+
+
+def rotate_session(request: HTTPConnection):
+    request.scope["session_rotate"] = True
+
+
+"""
+@class ServerSessionMiddleware
+@brief drop-in replacement for starlette's SessionMiddleware backed by a session store.
+
+@details
+request.session is a plain dictionary loaded from the store by the id in the cookie. after
+the response starts, the session is saved if its serialized form changed (under a new
+random id for a new session or a rotated one, see rotate_session) and deleted, with the
+cookie expired, once cleared. unknown or expired ids start an empty session.
+
+@param app the ASGI application.
+@param store the session store.
+@param session_cookie name of the cookie holding the session id.
+@param path cookie path.
+@param same_site cookie SameSite attribute.
+@param https_only adds the Secure attribute.
+"""
+
+
+class ServerSessionMiddleware:
+    def __init__(
+        self,
+        app,
+        store,
+        session_cookie: str = "session",
+        path: str = "/",
+        same_site: str = "lax",
+        https_only: bool = False,
+    ):
+        self.app = app
+        self.store = store
+        self.session_cookie = session_cookie
+        self.path = path
+        self.security_flags = "httponly; samesite=" + same_site
+        if https_only:
+            self.security_flags += "; secure"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+
+        session_id = HTTPConnection(scope).cookies.get(self.session_cookie)
+        initial = self.store.load(session_id) if session_id else None
+        if initial is None:
+            session_id = None
+        scope["session"] = json.loads(initial) if initial is not None else {}
+
+        async def send_wrapper(message):
+            nonlocal session_id
+            if message["type"] == "http.response.start":
+                session = scope["session"]
+                data = json.dumps(session) if session else None
+                rotated = scope.get("session_rotate", False)
+                if rotated and session_id is not None:
+                    self.store.delete(session_id)
+                    session_id = None
+                if data is not None and (data != initial or rotated):
+                    if session_id is None:
+                        session_id = secrets.token_urlsafe(32)
+                    self.store.save(session_id, data)
+                    # the cookie expires along with the stored session
+                    MutableHeaders(scope=message).append(
+                        "Set-Cookie",
+                        f"{self.session_cookie}={session_id}; path={self.path}; "
+                        f"Max-Age={self.store.max_age}; {self.security_flags}",
+                    )
+                elif data is None and (session_id is not None or rotated):
+                    # the session has been cleared (a rotated one was deleted above)
+                    if session_id is not None:
+                        self.store.delete(session_id)
+                    MutableHeaders(scope=message).append(
+                        "Set-Cookie",
+                        f"{self.session_cookie}=null; path={self.path}; "
+                        f"expires=Thu, 01 Jan 1970 00:00:00 GMT; {self.security_flags}",
+                    )
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
@@ -0,0 +1,45 @@
+import asyncio
+
+"""
+@file singleflight.py
+@brief module coalescing concurrent identical async calls into one.
+
+@details
+while a call for a key is in flight, later callers for the same key await that call
+instead of starting their own, and all of them receive its result (or its exception).
+the key is forgotten as soon as the call finishes, so results are not cached here; the
+caches in cache.py keep them afterwards. coalescing is per process and per event loop.
+"""
+
+
+"""
+@class SingleFlight
+@brief runs at most one call per key at a time and shares its outcome with every caller.
+"""
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls = {}
+
+    def in_flight(self, key) -> bool:
+        return key in self._calls
+
+    async def do(self, key, function, *args):
+        """
+        awaits function(*args), or the call already in flight for key.
+        """
+        future = self._calls.get(key)
+        if future is None:
+            future = asyncio.ensure_future(function(*args))
+            self._calls[key] = future
+            future.add_done_callback(lambda done: self._forget(key, done))
+        # a cancelled caller must not cancel the call the others are waiting for
+        return await asyncio.shield(future)
+
+    def _forget(self, key, future):
+        if self._calls.get(key) is future:
+            del self._calls[key]
+        if not future.cancelled():
+            # marks the exception as retrieved when every caller was cancelled
+            future.exception()
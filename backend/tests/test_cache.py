@@ -0,0 +1,93 @@
+# tests/test_cache.py
+import time
+import pytest
+from cache import MISS, MemoryCache, SQLiteCache
+
+
+def test_memory_cache_expires_entries():
+    """
+    tests that entries are returned until their TTL runs out.
+    """
+    cache = MemoryCache()
+    cache.set("fresh", {"name": "Serum"}, ttl=60)
+    cache.set("stale", {"name": "Toner"}, ttl=-1)
+
+    assert cache.get("fresh") == {"name": "Serum"}
+    assert cache.get("stale") is MISS
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_memory_cache_evicts_least_recently_used():
+    """
+    tests that the cache stays within max_entries.
+    """
+    cache = MemoryCache(max_entries=2)
+    cache.set("a", 1, ttl=60)
+    cache.set("b", 2, ttl=60)
+    cache.get("a")
+    cache.set("c", 3, ttl=60)
+
+    assert cache.get("b") is MISS
+    assert cache.get("a") == 1
+
+
+def test_sqlite_cache_is_shared_and_keeps_failures(tmp_path):
+    """
+    tests that a second cache on the same file (e.g. another worker) sees cached values,
+    including cached failures.
+    """
+    path = str(tmp_path / "cache.sqlite3")
+    writer = SQLiteCache(path, "products")
+    writer.set("https://incidecoder.com/products/serum", {"name": "Serum"}, ttl=60)
+    writer.set("https://incidecoder.com/products/broken", None, ttl=60)
+
+    reader = SQLiteCache(path, "products")
+    assert reader.get("https://incidecoder.com/products/serum") == {"name": "Serum"}
+    assert reader.get("https://incidecoder.com/products/broken") is None
+    assert reader.get("https://incidecoder.com/products/unknown") is MISS
+    assert SQLiteCache(path, "searches").get("https://incidecoder.com/products/serum") is MISS
+
+
+def test_sqlite_cache_evicts_least_recently_used(tmp_path):
+    """
+    tests that eviction trims a namespace to max_entries, keeping recently read keys.
+    """
+    cache = SQLiteCache(str(tmp_path / "cache.sqlite3"), "searches", max_entries=2)
+    for key in ("a", "b", "c"):
+        cache.set(key, key, ttl=60)
+        time.sleep(0.01)
+    cache.get("a")
+    cache.evict()
+
+    assert cache.get("b") is MISS
+    assert cache.get("a") == "a"
+    assert cache.get("c") == "c"
+
+
+def test_sqlite_cache_reads_do_not_write(tmp_path):
+    """
+    tests that hits only record their time in memory until the next eviction writes them.
+    """
+    cache = SQLiteCache(str(tmp_path / "cache.sqlite3"), "products")
+    cache.set("a", 1, ttl=60)
+    cache.set("expired", 2, ttl=-1)
+    statements = []
+    cache._connection().set_trace_callback(statements.append)
+
+    assert cache.get("a") == 1
+    assert cache.get("expired") is MISS
+    assert statements and all(statement.startswith("SELECT") for statement in statements)
+    cache.evict()
+    assert any(statement.startswith("UPDATE") for statement in statements)
+
+
+@pytest.mark.asyncio
+async def test_async_access_runs_in_a_thread(tmp_path):
+    """
+    tests that aget and aset reach the same SQLite file from a worker thread.
+    """
+    cache = SQLiteCache(str(tmp_path / "cache.sqlite3"), "products")
+    await cache.aset("a", {"name": "Serum"}, ttl=60)
+    assert await cache.aget("a") == {"name": "Serum"}
+    assert cache.get("a") == {"name": "Serum"}
+    assert await MemoryCache().aget("a") is MISS
@@ -0,0 +1,120 @@
+# tests/test_catalog.py
+import asyncio
+import pytest
+from catalog import CatalogData, CatalogIndex, merge_results, within_one_edit
+
+PRODUCTS = [
+    {
+        "_id": 1,
+        "brand": "CeraVe",
+        "name": "Hydrating Facial Cleanser",
+        "description": "A gentle cleanser for normal to dry skin.",
+        "ingredients": ["Aqua", "Glycerin", "Ceramide NP"],
+        "url": "https://incidecoder.com/products/cerave-hydrating-facial-cleanser",
+    },
+    {
+        "_id": 2,
+        "brand": "L'Oréal",
+        "name": "Revitalift Night Serum",
+        "description": "Retinol serum.",
+        "ingredients": ["Aqua", "Retinol"],
+        "url": "https://incidecoder.com/products/loreal-revitalift-night-serum",
+    },
+    {"_id": 3, "brand": "Unknown", "name": "Old Cleanser", "ingredients": []},
+]
+
+
+def make_catalog():
+    catalog = CatalogData()
+    for product in PRODUCTS:
+        catalog.add(product)
+    return catalog
+
+
+def test_search_matches_exact_prefix_and_typo():
+    """
+    tests exact, prefix and one-typo matches, ignoring accents and case.
+    """
+    catalog = make_catalog()
+    assert [p["name"] for p in catalog.search("cerave cleanser", 5)] == ["Hydrating Facial Cleanser"]
+    assert [p["name"] for p in catalog.search("revita", 5)] == ["Revitalift Night Serum"]
+    assert [p["name"] for p in catalog.search("ceravr", 5)] == ["Hydrating Facial Cleanser"]
+    assert [p["brand"] for p in catalog.search("loreal", 5)] == ["L'Oréal"]
+
+
+def test_search_requires_every_term_and_a_source_url():
+    """
+    tests that all query terms must match and products without a url are not indexed.
+    """
+    catalog = make_catalog()
+    assert catalog.search("cerave retinol", 5) == []
+    assert catalog.search("old cleanser", 5) == []
+    assert [p["name"] for p in catalog.search("aqua", 5)] == [
+        "Hydrating Facial Cleanser",
+        "Revitalift Night Serum",
+    ]
+
+
+def test_merge_results_deduplicates_by_name_and_brand():
+    """
+    tests that scraped results already in the catalog are dropped.
+    """
+    local = [{"name": "Revitalift Night Serum", "brand": "L'Oréal", "url": "a"}]
+    remote = [
+        {"name": "Revitalift  Night Serum", "brand": "L'Oreal", "url": "b"},
+        {"name": "Glycolic Toner", "brand": "Pixi", "url": "c"},
+    ]
+    assert [p["url"] for p in merge_results(local, remote, 5)] == ["a", "c"]
+    assert len(merge_results(local, remote, 1)) == 1
+
+
+def test_within_one_edit():
+    """
+    tests single insertions, deletions and substitutions.
+    """
+    assert within_one_edit("serum", "serun")
+    assert within_one_edit("serum", "seru")
+    assert within_one_edit("serum", "serumm")
+    assert not within_one_edit("serum", "sreum2")
+
+
+@pytest.mark.asyncio
+async def test_stale_index_is_rebuilt_in_the_background():
+    """
+    tests that searches keep using the previous snapshot while it is rebuilt, and that a
+    product added during the rebuild is in the new snapshot.
+    """
+    class Cursor:
+        def __init__(self, collection):
+            self.collection = collection
+
+        async def to_list(self, length=None):
+            await self.collection.release.wait()
+            return list(self.collection.docs)
+
+    class Products:
+        def __init__(self):
+            self.docs = PRODUCTS[:1]
+            self.release = asyncio.Event()
+            self.release.set()
+
+        def find(self, query, projection):
+            return Cursor(self)
+
+    products = Products()
+    index = CatalogIndex(products, refresh_interval=0)
+    first = await index.get()
+
+    products.docs = PRODUCTS
+    products.release.clear()
+    assert await index.get() is first
+    await asyncio.sleep(0)
+    index.add({**PRODUCTS[0], "_id": 4, "name": "Foaming Cleanser"})
+    products.release.set()
+    await index._refresh
+
+    rebuilt = await index.get()
+    assert rebuilt is not first
+    assert [product["name"] for product in rebuilt.search("serum", 5)] == ["Revitalift Night Serum"]
+    assert len(rebuilt.search("cleanser", 5)) == 2
+    await index.close()
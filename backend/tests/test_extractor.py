@@ -0,0 +1,41 @@
+# tests/test_extractor.py
+import json
+import os
+import pytest
+from extractor import extract_product, extract_search_results
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures", "incidecoder")
+
+with open(os.path.join(FIXTURES_DIR, "expected.json")) as f:
+    EXPECTED = json.load(f)
+
+
+def read_fixture(page):
+    with open(os.path.join(FIXTURES_DIR, page)) as f:
+        return f.read()
+
+
+@pytest.mark.parametrize("page", [page for page in EXPECTED if page.startswith("product_")])
+def test_extract_product_from_saved_pages(page):
+    """
+    tests that every field is extracted from the saved product pages.
+    """
+    assert extract_product(read_fixture(page)) == EXPECTED[page]
+
+
+def test_extract_search_results_respects_limit():
+    """
+    tests that search result links are returned in page order up to the limit.
+    """
+    links = extract_search_results(read_fixture("search_cerave.html"), 5)
+    assert links == EXPECTED["search_cerave.html"][:5]
+
+
+def test_extract_product_from_empty_page():
+    """
+    tests that an empty page yields the not-found defaults instead of raising.
+    """
+    product = extract_product("")
+    assert product["brand"] == "Brand not found"
+    assert product["ingredients"] == []
+    assert product["image"] is None
@@ -0,0 +1,154 @@
+# tests/test_indexes.py
+import os
+from datetime import datetime, timezone
+from bson import ObjectId
+from pymongo import AsyncMongoClient, monitoring
+from pymongo.errors import ServerSelectionTimeoutError
+import pytest
+import pytest_asyncio
+from indexes import ensure_indexes, missing_indexes
+from ingredients import IngredientResolver
+from ratings import CommunityRatingsManager, empty_community_rating
+from repository import ProductRepository, UserRepository
+
+# commands whose query plan is checked
+PLANNED_COMMANDS = {"find", "findAndModify", "update", "delete", "count", "distinct"}
+# command fields explain does not accept
+SESSION_FIELDS = {"lsid", "$db", "$clusterTime", "txnNumber", "$readPreference", "writeConcern"}
+
+
+class CommandRecorder(monitoring.CommandListener):
+    """
+    records every command sent by the client.
+    """
+
+    def __init__(self):
+        self.commands = []
+
+    def started(self, event):
+        self.commands.append((event.command_name, dict(event.command)))
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+@pytest_asyncio.fixture
+async def indexed_db():
+    """
+    provides a scratch database with the indexes created, skipping when MongoDB is unreachable.
+    """
+    recorder = CommandRecorder()
+    client = AsyncMongoClient(
+        os.getenv("DB_STRING"), serverSelectionTimeoutMS=2000, event_listeners=[recorder]
+    )
+    try:
+        await client.admin.command("ping")
+    except ServerSelectionTimeoutError:
+        await client.close()
+        pytest.skip("MongoDB is not reachable")
+
+    await client.drop_database("LegallyChemieIndexTest")
+    db = client["LegallyChemieIndexTest"]
+    yield db, recorder
+    await client.drop_database("LegallyChemieIndexTest")
+    await client.close()
+
+
+def explained_commands(command_name, command):
+    """
+    splits a recorded command into the commands explain accepts (one statement each).
+    """
+    command = {key: value for key, value in command.items() if key not in SESSION_FIELDS}
+    if command_name == "update":
+        return [{**command, "updates": [statement]} for statement in command["updates"]]
+    if command_name == "delete":
+        return [{**command, "deletes": [statement]} for statement in command["deletes"]]
+    return [command]
+
+
+def stages(plan):
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            yield plan["stage"]
+        for value in plan.values():
+            yield from stages(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            yield from stages(value)
+
+
+@pytest.mark.asyncio
+async def test_indexes_are_created_and_verified(indexed_db):
+    """
+    tests that the bootstrap creates every index and the verification finds them.
+    """
+    db, _ = indexed_db
+    results = await ensure_indexes(db)
+    assert all(error is None for error in results.values())
+    assert await missing_indexes(db) == []
+    # running it again is a no-op
+    assert all(error is None for error in (await ensure_indexes(db)).values())
+
+
+@pytest.mark.asyncio
+async def test_repository_queries_never_collection_scan(indexed_db):
+    """
+    tests that no query issued by the repositories falls back to a COLLSCAN.
+    """
+    db, recorder = indexed_db
+    await ensure_indexes(db)
+
+    product_id = ObjectId()
+    await db.products.insert_one({
+        "_id": product_id, "name": "Serum", "brand": "Brand", "url": "https://example.com/serum",
+        "community_rating": empty_community_rating(),
+    })
+    await db.users.insert_one({
+        "auth0_id": "auth0|1", "skin_type": "oily",
+        "products": {"AM": [{"_id": product_id, "rating": 0}], "PM": []},
+    })
+    await db.ingredients.insert_one({"_id": "water", "categories": []})
+
+    recorder.commands.clear()
+    users = UserRepository(db.users)
+    products = ProductRepository(db.products)
+    ratings = CommunityRatingsManager(db.products, db.ratings)
+
+    await users.exists("auth0|1")
+    await users.find_context("auth0|1")
+    await users.set_product_rating("auth0|1", "AM", product_id, 4)
+    await users.set_routine_rules("auth0|1", "AM", {"hash": "x"})
+    await users.set_skin_type("auth0|1", "dry")
+    await users.add_product("auth0|1", "PM", product_id)
+    await users.remove_product("auth0|1", "PM", product_id)
+
+    await products.find_by_id(product_id)
+    await products.find_by_ids([product_id])
+    await products.find_community_ratings([product_id])
+    await products.find_by_url("https://example.com/serum")
+    await products.find_leaderboard("oily", "score", 10)
+    await products.find_leaderboard("dry", "trend", 10)
+    await products.find_by_name_brand("Serum", "Brand")
+    await products.find_ingested_urls(["https://example.com/serum"], datetime.now(timezone.utc))
+    await products.upsert_scraped(
+        [{"name": "Serum", "brand": "Brand", "url": "https://example.com/serum"}],
+        empty_community_rating(),
+    )
+
+    await ratings.rate(product_id, "auth0|1", "oily", 4)
+    await ratings.get_community_ratings(product_id)
+    await IngredientResolver(db.ingredients).resolve(["Water"])
+
+    recorded = [(name, command) for name, command in recorder.commands if name in PLANNED_COMMANDS]
+    assert recorded
+
+    collection_scans = []
+    for command_name, command in recorded:
+        for explained in explained_commands(command_name, command):
+            explanation = await db.command("explain", explained, verbosity="queryPlanner")
+            if "COLLSCAN" in stages(explanation["queryPlanner"]["winningPlan"]):
+                collection_scans.append(explained)
+    assert collection_scans == []
@@ -0,0 +1,155 @@
+# tests/test_ingest.py
+import time
+from types import SimpleNamespace
+import pytest
+import search
+from fixture_server import FixtureServer
+from ingest import Ingestor, Pacer
+from ingredients import IngredientResolver
+from repository import ProductRepository
+from tests.test_ingredients import RecordingCollection
+
+CLEANSER_PATH = "/products/cerave-hydrating-facial-cleanser"
+
+
+class MemoryProducts:
+    """
+    stand-in for the product repository keeping upserted products by url.
+    """
+
+    def __init__(self, fresh_urls=()):
+        self.products = {}
+        self.fresh_urls = set(fresh_urls)
+        self.bulk_writes = 0
+
+    async def find_ingested_urls(self, urls, since):
+        return {url for url in urls if url in self.fresh_urls}
+
+    async def upsert_scraped(self, product_docs, community_rating):
+        self.bulk_writes += 1
+        upserted = sum(1 for doc in product_docs if doc["url"] not in self.products)
+        for doc in product_docs:
+            self.products[doc["url"]] = {"community_rating": community_rating, **doc}
+        return SimpleNamespace(upserted_count=upserted, modified_count=len(product_docs) - upserted)
+
+
+class BulkCollection:
+    """
+    stand-in for the 'products' collection recording bulk_write calls.
+    """
+
+    def __init__(self):
+        self.requests = []
+
+    async def bulk_write(self, requests, ordered=True):
+        self.requests.append((requests, ordered))
+        return SimpleNamespace(upserted_count=len(requests), modified_count=0)
+
+
+@pytest.fixture
+def incidecoder(monkeypatch):
+    """
+    local fixture server replaying the recorded Incidecoder pages.
+    """
+    server = FixtureServer().start()
+    monkeypatch.setattr(search, "BASE_URL", server.base_url)
+    monkeypatch.setattr(search, "RETRY_BACKOFF", 0)
+    search._client = search.create_client()
+    search._fetch_limit = None
+    yield server
+    search._client = None
+    server.stop()
+
+
+def make_ingestor(products, batch_size=100):
+    resolver = IngredientResolver(
+        RecordingCollection([{"_id": "salicylicacid", "categories": ["BHA"]}]), preload=True
+    )
+    return Ingestor(products, resolver, concurrency=2, request_interval=0, batch_size=batch_size)
+
+
+@pytest.mark.asyncio
+async def test_ingest_tags_and_upserts_listed_products(incidecoder):
+    """
+    tests that every listed product page is fetched once, tagged and upserted in batches.
+    """
+    products = MemoryProducts()
+    report = await make_ingestor(products, batch_size=2).run(["cerave", "cerave"])
+
+    assert report.listed == 15
+    assert report.fetched == 3
+    assert report.failed == 12
+    assert report.upserted == 3
+    assert products.bulk_writes == 2
+    assert incidecoder.requests["/search"] == 1
+    assert incidecoder.requests[CLEANSER_PATH] == 1
+
+    exfoliant = products.products[
+        f"{incidecoder.base_url}/products/paula-s-choice-skin-perfecting-2-bha-liquid-exfoliant"
+    ]
+    assert exfoliant["tags"] == ["BHA"]
+    assert exfoliant["community_rating"]["oily"] == {"sum": 0, "count": 0, "average": 0}
+    assert "ingested_at" in exfoliant
+
+
+@pytest.mark.asyncio
+async def test_ingest_skips_recently_ingested_products(incidecoder):
+    """
+    tests that products ingested within max_age are not fetched again.
+    """
+    products = MemoryProducts(fresh_urls=[f"{incidecoder.base_url}{CLEANSER_PATH}"])
+    report = await make_ingestor(products).run(["cerave"])
+
+    assert report.skipped == 1
+    assert incidecoder.requests[CLEANSER_PATH] == 0
+
+
+@pytest.mark.asyncio
+async def test_upsert_scraped_uses_one_unordered_bulk_write():
+    """
+    tests that scraped products are upserted by name and brand in a single bulk_write.
+    """
+    collection = BulkCollection()
+    docs = [{"name": "Serum", "brand": "A", "url": "u1"}, {"name": "Toner", "brand": "B", "url": "u2"}]
+    await ProductRepository(collection).upsert_scraped(docs, {"oily": [0, 0]})
+
+    [(requests, ordered)] = collection.requests
+    assert ordered is False
+    assert [request._filter for request in requests] == [
+        {"name": "Serum", "brand": "A"}, {"name": "Toner", "brand": "B"}
+    ]
+    assert requests[0]._doc["$setOnInsert"] == {"community_rating": {"oily": [0, 0]}}
+    assert all(request._upsert for request in requests)
+
+
+@pytest.mark.asyncio
+async def test_upsert_scraped_keeps_tags_and_drops_duplicates():
+    """
+    tests that ingredients and tags are only set on insert and that two urls resolving to
+    the same name and brand are written once.
+    """
+    collection = BulkCollection()
+    docs = [
+        {"name": "Serum", "brand": "A", "url": "u1", "ingredients": ["water"], "tags": ["AHA"]},
+        {"name": "Serum", "brand": "A", "url": "u2", "ingredients": ["water"], "tags": ["AHA"]},
+    ]
+    await ProductRepository(collection).upsert_scraped(docs, {"oily": [0, 0]})
+
+    [(requests, _)] = collection.requests
+    [request] = requests
+    assert request._doc["$set"] == {"name": "Serum", "brand": "A", "url": "u2"}
+    assert request._doc["$setOnInsert"] == {
+        "ingredients": ["water"], "tags": ["AHA"], "community_rating": {"oily": [0, 0]},
+    }
+
+
+@pytest.mark.asyncio
+async def test_pacer_spaces_out_requests():
+    """
+    tests that request starts are spaced by the configured interval.
+    """
+    pacer = Pacer(0.02)
+    started = time.monotonic()
+    for _ in range(4):
+        await pacer.wait()
+    assert time.monotonic() - started >= 0.06
@@ -0,0 +1,84 @@
+# tests/test_ingredients.py
+import pytest
+from ingredients import IngredientResolver, normalize_ingredient
+
+
+class AsyncCursor:
+    """
+    async iterable over a list of documents, shaped like an AsyncMongoClient cursor.
+    """
+
+    def __init__(self, docs):
+        self.docs = iter(docs)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self.docs)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class RecordingCollection:
+    """
+    minimal stand-in for the 'ingredients' collection that records every find call.
+    """
+
+    def __init__(self, docs):
+        self.docs = {doc["_id"]: doc for doc in docs}
+        self.queries = []
+
+    def find(self, query, projection=None):
+        self.queries.append(query)
+        ids = query.get("_id", {}).get("$in") if query else None
+        if ids is None:
+            return AsyncCursor(list(self.docs.values()))
+        return AsyncCursor([self.docs[_id] for _id in ids if _id in self.docs])
+
+
+INGREDIENT_DOCS = [
+    {"_id": "salicylicacid", "categories": ["BHA", "exfoliant"]},
+    {"_id": "glycolicacid", "categories": ["AHA", "exfoliant"]},
+    {"_id": "water", "categories": []},
+]
+
+
+def test_normalize_ingredient():
+    """
+    tests that ingredient names are normalized the way they are stored.
+    """
+    assert normalize_ingredient("Salicylic Acid") == "salicylicacid"
+
+
+@pytest.mark.asyncio
+async def test_resolve_uses_a_single_query():
+    """
+    tests that a whole ingredient list is resolved with one $in query.
+    """
+    collection = RecordingCollection(INGREDIENT_DOCS)
+    resolver = IngredientResolver(collection)
+
+    resolution = await resolver.resolve(["Water", "Salicylic Acid", "Glycolic Acid", "Mystery Extract"])
+
+    assert len(collection.queries) == 1
+    assert resolution.tags == ["AHA", "BHA", "exfoliant"]
+    assert resolution.unresolved == ["mysteryextract"]
+    assert resolver.coverage_gaps["mysteryextract"] == 1
+
+
+@pytest.mark.asyncio
+async def test_resolve_from_preloaded_dictionary():
+    """
+    tests that a preloading resolver loads the collection once and reuses it.
+    """
+    collection = RecordingCollection(INGREDIENT_DOCS)
+    resolver = IngredientResolver(collection, preload=True)
+
+    await resolver.resolve(["Water"])
+    resolution = await resolver.resolve(["Glycolic Acid"])
+
+    assert collection.queries == [{}]
+    assert resolution.tags == ["AHA", "exfoliant"]
+    assert resolution.unresolved == []
@@ -0,0 +1,65 @@
+# tests/test_logs.py
+import io
+import json
+import logging
+from logs import DebugSampler, Lazy, configure_logging, parse_levels
+
+
+def test_lazy_argument_not_computed_when_level_disabled():
+    """
+    tests that a Lazy payload is only computed when its record is emitted.
+    """
+    stream = io.StringIO()
+    configure_logging(level="INFO", levels={}, stream=stream)
+    calls = []
+    payload = Lazy(lambda: calls.append(1) or "expensive")
+
+    logging.getLogger("lazytest").debug("payload: %s", payload)
+    assert calls == []
+
+    logging.getLogger("lazytest").info("payload: %s", payload)
+    assert calls
+    configure_logging(level="INFO", levels={})
+
+
+def test_json_records_include_extra_fields():
+    """
+    tests that records are written as JSON objects including the extra= fields.
+    """
+    stream = io.StringIO()
+    configure_logging(level="INFO", levels={}, stream=stream)
+    logging.getLogger("jsontest").info("user logged in", extra={"user_id": "auth0|1"})
+    configure_logging(level="INFO", levels={})
+
+    entry = json.loads(stream.getvalue().strip())
+    assert entry["message"] == "user logged in"
+    assert entry["logger"] == "jsontest"
+    assert entry["level"] == "INFO"
+    assert entry["user_id"] == "auth0|1"
+
+
+def test_per_module_levels():
+    """
+    tests that LOG_LEVELS style overrides enable debug records for one module only.
+    """
+    assert parse_levels("search=debug, rules=WARNING,bad") == {"search": "DEBUG", "rules": "WARNING"}
+
+    stream = io.StringIO()
+    configure_logging(level="INFO", levels={"leveltest.loud": "DEBUG"}, stream=stream)
+    logging.getLogger("leveltest.loud").debug("kept")
+    logging.getLogger("leveltest.quiet").debug("dropped")
+    logging.getLogger("leveltest.loud").setLevel(logging.NOTSET)
+    configure_logging(level="INFO", levels={})
+
+    messages = [json.loads(line)["message"] for line in stream.getvalue().splitlines()]
+    assert messages == ["kept"]
+
+
+def test_debug_sampler_only_samples_debug_records():
+    """
+    tests that the sampler drops DEBUG records at rate 0 but keeps higher levels.
+    """
+    sampler = DebugSampler(0)
+    assert not sampler.filter(logging.makeLogRecord({"levelno": logging.DEBUG}))
+    assert sampler.filter(logging.makeLogRecord({"levelno": logging.INFO}))
+    assert DebugSampler(1).filter(logging.makeLogRecord({"levelno": logging.DEBUG}))
@@ -0,0 +1,62 @@
+# tests/test_metrics.py
+from types import SimpleNamespace
+from fastapi.testclient import TestClient
+from cache import MemoryCache
+from metrics import REGISTRY, CommandMetrics, track_cache
+from server import app
+
+client = TestClient(app)
+
+
+def sample(name, labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def test_request_latency_recorded_by_route_template():
+    """
+    tests that requests are timed under their route template and exposed at /metrics.
+    """
+    labels = {"method": "GET", "route": "/session", "status": "401"}
+    before = sample("http_request_duration_seconds_count", labels)
+
+    client.get("/session")
+    assert sample("http_request_duration_seconds_count", labels) == before + 1
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert 'route="/session"' in response.text
+    assert "scrape_cache_hit_ratio" in response.text
+
+
+def test_command_listener_counts_mongo_commands():
+    """
+    tests that succeeded and failed MongoDB commands are counted and timed.
+    """
+    succeeded = {"command": "find", "outcome": "succeeded"}
+    failed = {"command": "find", "outcome": "failed"}
+    before = (sample("mongodb_commands_total", succeeded), sample("mongodb_commands_total", failed))
+
+    listener = CommandMetrics()
+    event = SimpleNamespace(command_name="find", duration_micros=1500)
+    listener.succeeded(event)
+    listener.succeeded(event)
+    listener.failed(event)
+
+    assert sample("mongodb_commands_total", succeeded) == before[0] + 2
+    assert sample("mongodb_commands_total", failed) == before[1] + 1
+
+
+def test_cache_hit_ratio():
+    """
+    tests that tracked caches report their hits, misses and hit ratio.
+    """
+    cache = MemoryCache()
+    track_cache("test", cache)
+    cache.set("key", "value", 60)
+    cache.get("key")
+    cache.get("key")
+    cache.get("missing")
+
+    assert sample("scrape_cache_hits_total", {"cache": "test"}) == 2
+    assert sample("scrape_cache_misses_total", {"cache": "test"}) == 1
+    assert sample("scrape_cache_hit_ratio", {"cache": "test"}) == 2 / 3
@@ -55,3 +55,64 @@ def test_delete_user_product(test_db, setup_user):
     assert response.status_code == 200
     assert response.json().get("message") == "Product deleted successfully"
 
+
+
+def test_add_product_survives_a_concurrent_insert(monkeypatch):
+    """
+    tests that a product inserted by another request between the lookup and the insert is
+    added from the database instead of failing, and that unparsed pages are not stored.
+    """
+    import server
+    from bson import ObjectId
+    from ingredients import TagResolution
+    from pymongo.errors import DuplicateKeyError
+
+    existing = {"_id": ObjectId(), "name": "Serum", "brand": "Brand", "tags": []}
+    scraped = {"name": "Serum", "brand": "Brand", "ingredients": []}
+
+    class RacingProducts:
+        def __init__(self):
+            self.lookups = 0
+            self.inserts = 0
+
+        async def find_by_url(self, url):
+            return None
+
+        async def find_by_name_brand(self, name, brand):
+            self.lookups += 1
+            # the concurrent insert lands after the first lookup
+            return existing if self.lookups > 1 else None
+
+        async def insert(self, product_doc):
+            self.inserts += 1
+            raise DuplicateKeyError("name_brand_unique")
+
+    class Users:
+        async def add_product(self, auth0_id, day, product_id):
+            return {"products": {day: []}}
+
+    class Resolver:
+        async def resolve(self, ingredients):
+            return TagResolution(tags=[], unresolved=[])
+
+    async def fetch(url):
+        return dict(scraped)
+
+    products = RacingProducts()
+    monkeypatch.setattr(server, "product_repository", products)
+    monkeypatch.setattr(server, "user_repository", Users())
+    monkeypatch.setattr(server, "ingredient_resolver", Resolver())
+    monkeypatch.setattr(server, "get_product_data_by_url", fetch)
+    server.app.dependency_overrides[server.current_user] = lambda: {"auth0_id": "user", "products": {}}
+    try:
+        test_client = TestClient(server.app)
+        response = test_client.post("/AM/products", json={"product_url": "https://incidecoder.com/products/serum"})
+        assert response.status_code == 200
+        assert response.json()["message"] == "Existing product added to user's products"
+
+        scraped.update(name="Name not found")
+        response = test_client.post("/AM/products", json={"product_url": "https://incidecoder.com/products/x"})
+        assert response.status_code == 404
+        assert products.inserts == 1
+    finally:
+        server.app.dependency_overrides.clear()
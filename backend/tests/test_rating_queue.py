@@ -0,0 +1,157 @@
+# tests/test_rating_queue.py
+import pytest
+from bson import ObjectId
+from rating_queue import RatingQueue
+from ratings import CommunityRatingsManager, community_averages, fold_updates
+
+
+class BulkProducts:
+    """
+    stand-in for the 'products' collection recording bulk_writes.
+    """
+
+    def __init__(self):
+        self.bulk_writes = []
+
+    async def bulk_write(self, requests, ordered=True):
+        self.bulk_writes.append(requests)
+
+
+class UpsertRatings:
+    """
+    stand-in for the 'ratings' collection keeping the users' ratings in a dictionary.
+    """
+
+    def __init__(self):
+        self.ratings = {}
+
+    async def find_one_and_update(self, query, update, projection=None, upsert=False, return_document=None):
+        key = (query["product_id"], query["auth0_id"])
+        previous = self.ratings.get(key)
+        self.ratings[key] = {"skin_type": update["$set"]["skin_type"], "rating": update["$set"]["rating"]}
+        return previous
+
+
+@pytest.fixture
+def queue(tmp_path):
+    """
+    provides an empty rating queue in a scratch SQLite file.
+    """
+    return RatingQueue(str(tmp_path / "rating_queue.sqlite3"), queue_id="test")
+
+
+def test_pending_changes_are_summed_per_product(queue):
+    """
+    tests that queued changes are summed per product and skin type.
+    """
+    first, second = ObjectId(), ObjectId()
+    queue.append(first, {"oily": (4, 1)})
+    queue.append(first, {"oily": (-2, 0), "dry": (5, 1)})
+    queue.append(second, {"dry": (3, 1)})
+
+    assert queue.pending([first]) == {str(first): {"oily": (2, 1), "dry": (5, 1)}}
+    assert queue.pending([]) == {}
+
+
+def test_claimed_batch_is_replayed_until_acknowledged(queue):
+    """
+    tests that a claimed batch stays the same (e.g. after a crash) until acknowledged, and
+    that changes queued meanwhile go to the next batch.
+    """
+    product_id = ObjectId()
+    queue.append(product_id, {"oily": (4, 1)})
+    upto, changes = queue.claim(100)
+    queue.append(product_id, {"oily": (1, 1)})
+
+    assert queue.claim(100) == (upto, changes)
+    queue.acknowledge(upto)
+    next_upto, next_changes = queue.claim(100)
+    assert next_upto > upto
+    assert next_changes == {str(product_id): {"oily": (1, 1)}}
+    queue.acknowledge(next_upto)
+    assert queue.claim(100) is None
+    assert queue.size() == 0
+
+
+@pytest.mark.asyncio
+async def test_burst_of_ratings_is_folded_in_one_bulk_write(queue):
+    """
+    tests that many ratings of one product become a single product update, that reads see
+    them while queued and that each update only applies a batch once.
+    """
+    products = BulkProducts()
+    manager = CommunityRatingsManager(products, UpsertRatings(), queue=queue)
+    product_id = ObjectId()
+
+    for index in range(50):
+        assert await manager.rate(product_id, f"user{index}", "oily", 4) == "added"
+    assert await manager.rate(product_id, "user0", "oily", 2) == "updated"
+
+    pending = (await manager.pending([product_id]))[str(product_id)]
+    assert community_averages({"oily": {"sum": 0, "count": 0, "average": 0}}, pending) == {
+        "oily": (50 * 4 - 2) / 50
+    }
+
+    # the batch flush() folds: every rating summed into one product change
+    assert queue.claim(1000) == (51, {str(product_id): {"oily": (198, 50)}})
+    assert await manager.flush() == 1
+    assert await manager.flush() == 0
+    assert [len(requests) for requests in products.bulk_writes] == [1]
+    assert await manager.pending([product_id]) == {}
+
+
+def test_fold_updates_apply_a_batch_once():
+    """
+    tests that every product update of a batch records the batch and only matches products
+    that have not recorded it yet.
+    """
+    product_id = ObjectId()
+    [(query, pipeline)] = fold_updates("test", 51, {str(product_id): {"oily": (198, 50)}})
+
+    assert query == {"_id": product_id, "rating_queue.test": {"$not": {"$gte": 51}}}
+    assert pipeline[0]["$set"]["rating_queue.test"] == 51
+    assert pipeline[0]["$set"]["community_rating.oily.sum"]["$add"][1] == 198
+
+
+def apply_guarded(product: dict, updates) -> int:
+    """
+    applies the queue markers of fold_updates' updates to a product dictionary while their
+    guard matches it, as MongoDB would; returns how many were applied.
+    """
+    applied = 0
+    for query, pipeline in updates:
+        [field] = [key for key in query if key.startswith("rating_queue.")]
+        if product.get(field, 0) >= query[field]["$not"]["$gte"]:
+            continue
+        product[field] = pipeline[0]["$set"][field]
+        applied += 1
+    return applied
+
+
+@pytest.mark.asyncio
+async def test_recreated_queue_file_gets_a_new_queue_id(tmp_path):
+    """
+    tests that a queue file recreated from scratch, restarting its sequence numbers, is not
+    mistaken for the old one and its changes are applied.
+    """
+    path = tmp_path / "rating_queue.sqlite3"
+    product = {}
+    product_id = ObjectId()
+
+    queue = RatingQueue(str(path))
+    assert RatingQueue(str(path)).queue_id == queue.queue_id
+    manager = CommunityRatingsManager(BulkProducts(), UpsertRatings(), queue=queue)
+    for index in range(5):
+        await manager.rate(product_id, f"user{index}", "oily", 4)
+    upto, changes = queue.claim(100)
+    assert apply_guarded(product, fold_updates(queue.queue_id, upto, changes)) == 1
+    # a replayed batch is not applied twice
+    assert apply_guarded(product, fold_updates(queue.queue_id, upto, changes)) == 0
+
+    path.unlink()
+    recreated = RatingQueue(str(path))
+    assert recreated.queue_id != queue.queue_id
+    manager = CommunityRatingsManager(BulkProducts(), UpsertRatings(), queue=recreated)
+    await manager.rate(product_id, "user9", "oily", 5)
+    upto, changes = recreated.claim(100)
+    assert apply_guarded(product, fold_updates(recreated.queue_id, upto, changes)) == 1
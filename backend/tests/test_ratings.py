@@ -0,0 +1,266 @@
+# tests/test_ratings.py
+import asyncio
+import os
+import pytest
+import pytest_asyncio
+from bson import ObjectId
+from pymongo import AsyncMongoClient
+from pymongo.errors import ServerSelectionTimeoutError
+from datetime import datetime, timedelta, timezone
+from ratings import (
+    CommunityRatingsManager, bayesian_score, community_averages, empty_community_rating, rating_changes,
+    trend_term,
+)
+from repository import ProductRepository
+
+CONCURRENT_RATINGS = 200
+
+
+@pytest_asyncio.fixture
+async def collections():
+    """
+    provides the products and ratings collections of the test database, skipping when
+    MongoDB is unreachable.
+    """
+    client = AsyncMongoClient(os.getenv("DB_STRING"), serverSelectionTimeoutMS=2000)
+    try:
+        await client.admin.command("ping")
+    except ServerSelectionTimeoutError:
+        await client.close()
+        pytest.skip("MongoDB is not reachable")
+
+    db = client["LegallyChemieTest"]
+    yield db["products"], db["ratings"]
+    products = await db["products"].find({"name": "Rating Stress Product"}, {"_id": 1}).to_list(None)
+    await db["ratings"].delete_many({"product_id": {"$in": [product["_id"] for product in products]}})
+    await db["products"].delete_many({"name": "Rating Stress Product"})
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_concurrent_ratings_are_not_lost(collections):
+    """
+    tests that many concurrent first-time ratings and re-ratings all land in the community
+    sums, counts and averages.
+    """
+    products, ratings = collections
+    inserted = await products.insert_one(
+        {"name": "Rating Stress Product", "community_rating": empty_community_rating()}
+    )
+    manager = CommunityRatingsManager(products, ratings)
+
+    values = [(index % 5) + 1 for index in range(CONCURRENT_RATINGS)]
+    results = await asyncio.gather(
+        *(manager.rate(inserted.inserted_id, f"user{index}", "oily", value)
+          for index, value in enumerate(values))
+    )
+    assert set(results) == {"added"}
+    # re-rating from 5 down to 1 changes the sum but not the count
+    await asyncio.gather(
+        *(manager.rate(inserted.inserted_id, f"user{index}", "oily", 1)
+          for index, value in enumerate(values) if value == 5)
+    )
+
+    product = await products.find_one({"_id": inserted.inserted_id})
+    expected_sum = sum(values) - 4 * values.count(5)
+    assert product["community_rating"]["oily"] == {
+        "sum": expected_sum, "count": CONCURRENT_RATINGS, "average": expected_sum / CONCURRENT_RATINGS
+    }
+    assert product["community_rating"]["dry"] == {"sum": 0, "count": 0, "average": 0}
+    # per-user ratings live in their own collection, not in the product document
+    assert await ratings.count_documents({"product_id": inserted.inserted_id}) == CONCURRENT_RATINGS
+    assert set(product) == {"_id", "name", "community_rating"}
+
+
+@pytest.mark.asyncio
+async def test_legacy_ratings_are_migrated(collections):
+    """
+    tests that [sum, count] pairs and communityRatings user maps are folded into the new model.
+    """
+    products, ratings = collections
+    inserted = await products.insert_one({
+        "name": "Rating Stress Product",
+        "community_rating": {"oily": [9, 2], "dry": [0, 0]},
+        "communityRatings": {"dry": {"totalRating": 7, "ratingCount": 2, "userRatings": {"a": 3, "b": 4}}},
+    })
+    manager = CommunityRatingsManager(products, ratings)
+
+    assert await manager.migrate() >= 1
+    assert await manager.migrate() == 0
+    assert await manager.get_community_ratings(inserted.inserted_id) == {
+        "oily": {"average": 4.5, "count": 2},
+        "dry": {"average": 3.5, "count": 2},
+        **{skin_type: {"average": 0, "count": 0} for skin_type in ("normal", "combination", "sensitive")},
+    }
+    assert await manager.rate(inserted.inserted_id, "a", "dry", 3) == "unchanged"
+
+
+@pytest.mark.asyncio
+async def test_leaderboard_ranks_by_bayesian_score(collections):
+    """
+    tests that leaderboard scores are kept up to date by rating changes and that the top
+    products are read in score order.
+    """
+    products, ratings = collections
+    manager = CommunityRatingsManager(products, ratings)
+    ids = []
+    for ratings_given in ([5], [5] * 20, [4] * 20):
+        inserted = await products.insert_one(
+            {"name": "Rating Stress Product", "community_rating": empty_community_rating()}
+        )
+        ids.append(inserted.inserted_id)
+        for index, value in enumerate(ratings_given):
+            await manager.rate(inserted.inserted_id, f"user{index}", "sensitive", value)
+
+    leaders = await ProductRepository(products).find_leaderboard("sensitive", "score", 3)
+    # one 5-star rating ranks below twenty 4-star ratings
+    assert [doc["_id"] for doc in leaders] == [ids[1], ids[2], ids[0]]
+    assert leaders[0]["community_rating"]["sensitive"]["score"] == bayesian_score(100, 20)
+
+
+def test_bayesian_score_needs_many_ratings_to_leave_the_prior():
+    """
+    tests that a single perfect rating scores below many good ratings.
+    """
+    assert bayesian_score(0, 0) == 3.0
+    assert bayesian_score(5, 1) < bayesian_score(80, 20)
+
+
+def test_trend_favours_recent_ratings():
+    """
+    tests that recent ratings outweigh more, older ratings and halve with each half-life.
+    """
+    now = datetime.now(timezone.utc)
+    assert trend_term(1, now) > trend_term(4, now - timedelta(days=9))
+    assert trend_term(2, now - timedelta(days=3)) == pytest.approx(trend_term(1, now))
+
+
+def test_rating_changes():
+    """
+    tests the sum and count changes of first ratings, re-ratings and skin type changes.
+    """
+    assert rating_changes(None, "oily", 4) == {"oily": (4, 1)}
+    assert rating_changes({"skin_type": "oily", "rating": 4}, "oily", 2) == {"oily": (-2, 0)}
+    assert rating_changes({"skin_type": "oily", "rating": 4}, "dry", 5) == {"oily": (-4, -1), "dry": (5, 1)}
+
+
+def test_community_averages():
+    """
+    tests that the precomputed averages are read per skin type, with unrated skin types at 0.
+    """
+    averaged = community_averages({"oily": {"average": 4.5}, "dry": {"average": 0}, "normal": {}})
+    assert averaged == {"oily": 4.5, "dry": 0, "normal": 0}
+
+
+def test_community_averages_count_queued_changes():
+    """
+    tests that queued changes are added to the stored totals before averaging.
+    """
+    stored = {"oily": {"sum": 9, "count": 2, "average": 4.5}, "dry": {"sum": 0, "count": 0, "average": 0}}
+    assert community_averages(stored, {"oily": (3, 1), "sensitive": (5, 1)}) == {
+        "oily": 4, "dry": 0, "sensitive": 5
+    }
+
+
+def test_leaderboard_endpoint_reads_the_ranked_products(monkeypatch):
+    """
+    tests that the leaderboard endpoint asks for the ranking field of the requested kind.
+    """
+    import server
+    from fastapi.testclient import TestClient
+
+    product_id = ObjectId()
+
+    class RankedProducts:
+        def __init__(self):
+            self.calls = []
+
+        async def find_leaderboard(self, skin_type, field, limit):
+            self.calls.append((skin_type, field, limit))
+            return [{
+                "_id": product_id, "name": "Serum", "brand": "Brand",
+                "community_rating": {skin_type: {"average": 4.5, "count": 20, "score": 4.2}},
+            }]
+
+    ranked = RankedProducts()
+    monkeypatch.setattr(server, "product_repository", ranked)
+    client = TestClient(server.app)
+
+    response = client.get("/leaderboards/oily")
+    assert response.json()["products"] == [{
+        "id": str(product_id), "brand": "Brand", "name": "Serum", "image": None,
+        "community_rating": 4.5, "rating_count": 20, "score": 4.2,
+    }]
+    client.get("/leaderboards/dry", params={"kind": "trending", "limit": 3})
+    assert ranked.calls == [("oily", "score", 10), ("dry", "trend", 3)]
+    assert client.get("/leaderboards/oily", params={"limit": 500}).status_code == 422
+
+
+def test_routine_ratings_endpoint_reads_every_product_at_once(monkeypatch):
+    """
+    tests that the routine ratings endpoint returns the user's and the averaged community
+    rating of every product in one response, counting queued changes and leaving out
+    products missing from the product collection.
+    """
+    import server
+    from fastapi.testclient import TestClient
+
+    rated, unrated, missing = ObjectId(), ObjectId(), ObjectId()
+
+    class RatedProducts:
+        def __init__(self):
+            self.calls = []
+
+        async def find_community_ratings(self, product_ids):
+            product_ids = list(product_ids)
+            self.calls.append(product_ids)
+            return [
+                {"_id": rated, "community_rating": {"oily": {"sum": 8, "count": 2, "average": 4}}},
+                {"_id": unrated, "community_rating": empty_community_rating()},
+            ]
+
+    class QueuedRatings:
+        async def pending(self, product_ids):
+            return {str(rated): {"oily": (1, 1)}}
+
+    products = RatedProducts()
+    monkeypatch.setattr(server, "product_repository", products)
+    monkeypatch.setattr(server, "community_ratings_manager", QueuedRatings())
+    server.app.dependency_overrides[server.current_user] = lambda: {
+        "auth0_id": "user", "skin_type": "oily", "products": {"AM": [
+            {"_id": rated, "rating": 5}, {"_id": unrated, "rating": 0}, {"_id": missing, "rating": 2},
+        ]},
+    }
+    try:
+        response = TestClient(server.app).get("/AM/ratings")
+    finally:
+        server.app.dependency_overrides.clear()
+
+    assert response.status_code == 200
+    assert response.json() == {"ratings": {
+        str(rated): {"user_rating": 5, "community_rating": {"oily": 3}},
+        str(unrated): {"user_rating": 0, "community_rating": dict.fromkeys(empty_community_rating(), 0)},
+    }}
+    assert products.calls == [[rated, unrated, missing]]
+
+
+def test_rating_a_malformed_product_id_is_rejected(monkeypatch):
+    """
+    tests that a product id that is not an ObjectId is answered with a 400 before any
+    database work, instead of failing with a 500.
+    """
+    import server
+    from fastapi.testclient import TestClient
+
+    class FailingUsers:
+        async def set_product_rating(self, auth0_id, day, product_id, rating):
+            raise AssertionError("rating stored for a malformed product id")
+
+    monkeypatch.setattr(server, "user_repository", FailingUsers())
+    server.app.dependency_overrides[server.current_user_id] = lambda: "user"
+    try:
+        response = TestClient(server.app).patch("/AM/products/zzz/4/0")
+    finally:
+        server.app.dependency_overrides.clear()
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Invalid product ID format"}
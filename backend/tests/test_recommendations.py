@@ -0,0 +1,188 @@
+# tests/test_recommendations.py
+import asyncio
+import pytest
+from bson import ObjectId
+from fastapi.testclient import TestClient
+from recommendations import RecommendationData, RecommendationIndex
+from rules import CompiledRules
+
+SKIN_TYPES = ["oily", "dry"]
+
+RULE_DOCS = [
+    {"_id": "retinoid", "rules": {"avoid": [{"tag": "AHA", "message": "too irritating together"}]}},
+    {"_id": "vitamin C", "rules": {"avoid": [{"tag": "niacinamide", "message": "may flush"}]}},
+]
+
+
+def make_product(name, tags, oily_score=None, url=True):
+    community_rating = {"oily": {"sum": 0, "count": 0, "average": 0}}
+    if oily_score is not None:
+        community_rating["oily"].update({"count": 10, "average": oily_score, "score": oily_score})
+    product = {"_id": ObjectId(), "name": name, "brand": "Brand", "tags": tags, "community_rating": community_rating}
+    if url:
+        product["url"] = f"https://incidecoder.com/products/{name}"
+    return product
+
+
+def routine(*tags):
+    return [{"tags": list(tags)}]
+
+
+def names(results):
+    return [product["name"] for product in results]
+
+
+def test_recommend_drops_products_conflicting_in_either_direction():
+    """
+    tests that products avoided by the routine, products avoiding the routine and products
+    already in the routine are left out, and the rest ranked by score.
+    """
+    serum = make_product("retinol serum", ["retinoid"])
+    docs = [
+        serum,
+        make_product("glycolic toner", ["AHA"], oily_score=4.9),
+        make_product("niacinamide serum", ["niacinamide"], oily_score=3.5),
+        make_product("moisturizer", ["ceramide"], oily_score=4.2),
+        make_product("vitamin c serum", ["vitamin C"], oily_score=4.0),
+    ]
+    data = RecommendationData.build(docs, SKIN_TYPES)
+    compiled = CompiledRules(RULE_DOCS)
+
+    results = data.recommend([serum], [serum["_id"]], compiled, "oily", 10)
+    assert names(results) == ["moisturizer", "vitamin c serum", "niacinamide serum"]
+    assert results[0]["community_rating"] == 4.2 and results[0]["url"].endswith("moisturizer")
+
+    # the retinol serum avoids the routine's AHA, the routine's vitamin C avoids niacinamide
+    results = data.recommend(routine("AHA", "vitamin C"), [], compiled, "oily", 10)
+    assert names(results) == ["glycolic toner", "moisturizer", "vitamin c serum"]
+
+
+def test_recommend_limits_and_scores_unrated_at_the_prior():
+    """
+    tests that only the best limit products are returned and that unrated products score
+    at the prior mean.
+    """
+    docs = [make_product(f"product {index}", [], oily_score=index / 4) for index in range(20)]
+    docs.append(make_product("unrated", []))
+    docs.append(make_product("not addable", [], oily_score=5.0, url=False))
+    data = RecommendationData.build(docs, SKIN_TYPES)
+
+    results = data.recommend([], [], CompiledRules(RULE_DOCS), "oily", 3)
+    assert names(results) == ["product 19", "product 18", "product 17"]
+    ranked = names(data.recommend([], [], CompiledRules(RULE_DOCS), "dry", 30))
+    # every dry score is the prior, so the catalog order is kept
+    assert ranked[0] == "product 0" and len(ranked) == 21
+
+
+def test_added_products_are_recommended():
+    """
+    tests that products inserted after the snapshot was built are indexed by tag and score.
+    """
+    data = RecommendationData.build([make_product("toner", ["AHA"], oily_score=3.0)], SKIN_TYPES)
+    data.add(make_product("peel", ["AHA"], oily_score=4.0))
+    data.add(make_product("cream", ["ceramide"], oily_score=3.5))
+
+    compiled = CompiledRules(RULE_DOCS)
+    assert names(data.recommend([], [], compiled, "oily", 10)) == ["peel", "cream", "toner"]
+    assert names(data.recommend(routine("retinoid"), [], compiled, "oily", 10)) == ["cream"]
+
+
+def test_catalog_is_encoded_once_per_rule_snapshot():
+    """
+    tests that the catalog bitsets are reused while the rules and rows are unchanged, and
+    encoded again after a rule change or an added product.
+    """
+    data = RecommendationData.build([make_product("toner", ["AHA"], oily_score=3.0)], SKIN_TYPES)
+    compiled = CompiledRules(RULE_DOCS)
+    tags, _ = data.encoded(compiled)
+    assert data.encoded(compiled)[0] is tags
+    assert data.encoded(CompiledRules(RULE_DOCS))[0] is tags
+
+    changed = CompiledRules(RULE_DOCS + [{"_id": "BHA", "rules": {"avoid": [{"tag": "AHA"}]}}])
+    assert data.encoded(changed)[0] is not tags
+    assert names(data.recommend(routine("BHA"), [], changed, "oily", 10)) == []
+
+    data.add(make_product("peel", ["BHA"], oily_score=4.0))
+    assert data.encoded(changed)[0].shape[0] == 2
+    assert names(data.recommend(routine("AHA"), [], changed, "oily", 10)) == ["toner"]
+
+
+@pytest.mark.asyncio
+async def test_index_serves_the_previous_snapshot_while_refreshing():
+    """
+    tests that a stale snapshot is returned at once and replaced in the background, and that
+    a product added during the rebuild is in the new snapshot.
+    """
+    class Cursor:
+        def __init__(self, collection):
+            self.collection = collection
+
+        async def to_list(self, length=None):
+            await self.collection.release.wait()
+            return list(self.collection.docs)
+
+    class Products:
+        def __init__(self):
+            self.docs = [make_product("toner", ["AHA"])]
+            self.release = asyncio.Event()
+            self.release.set()
+
+        def find(self, query, projection):
+            return Cursor(self)
+
+    products = Products()
+    index = RecommendationIndex(products, SKIN_TYPES, refresh_interval=0)
+    first = await index.get()
+    products.docs = products.docs + [make_product("cream", [])]
+
+    products.release.clear()
+    assert await index.get() is first
+    await asyncio.sleep(0)
+    index.add(make_product("peel", ["AHA"]))
+    products.release.set()
+    await index._refresh
+
+    rebuilt = await index.get()
+    assert rebuilt is not first
+    assert names(rebuilt.products) == ["toner", "cream", "peel"]
+    await index.close()
+
+
+def test_recommendations_endpoint_uses_the_routine_and_skin_type(monkeypatch):
+    """
+    tests that the endpoint filters by the tags of the user's routine and ranks for the
+    user's skin type.
+    """
+    import server
+
+    routine_id = ObjectId()
+    docs = [make_product("glycolic toner", ["AHA"], oily_score=4.9), make_product("cream", [], oily_score=4.0)]
+
+    class RoutineProducts:
+        async def find_tags(self, product_ids):
+            assert product_ids == [routine_id]
+            return [{"_id": routine_id, "tags": ["retinoid"]}]
+
+    class StaticRules:
+        async def get(self):
+            return CompiledRules(RULE_DOCS)
+
+    class StaticRecommendations:
+        async def get(self):
+            return RecommendationData.build(docs, SKIN_TYPES)
+
+    monkeypatch.setattr(server, "product_repository", RoutineProducts())
+    monkeypatch.setattr(server, "rule_index", StaticRules())
+    monkeypatch.setattr(server, "recommendation_index", StaticRecommendations())
+    server.app.dependency_overrides[server.current_user] = lambda: {
+        "auth0_id": "user", "skin_type": "oily", "products": {"PM": [{"_id": routine_id, "rating": 0}]},
+    }
+    try:
+        client = TestClient(server.app)
+        response = client.get("/PM/recommendations", params={"limit": 5})
+        assert response.json()["skin_type"] == "oily"
+        assert names(response.json()["products"]) == ["cream"]
+        assert names(client.get("/AM/recommendations").json()["products"]) == ["glycolic toner", "cream"]
+        assert client.get("/PM/recommendations", params={"limit": 0}).status_code == 422
+    finally:
+        server.app.dependency_overrides.clear()
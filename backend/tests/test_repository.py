@@ -0,0 +1,162 @@
+# tests/test_repository.py
+import asyncio
+import pytest
+from bson import ObjectId
+from cache import MemoryCache
+from repository import USER_CONTEXT_PROJECTION, UserRepository, context_projection
+
+
+class UsersCollection:
+    """
+    stand-in for the 'users' collection recording find_one filters and projections.
+    """
+
+    def __init__(self, result=None):
+        self.result = result
+        self.calls = []
+        self.release = None
+
+    async def find_one(self, query, projection=None):
+        self.calls.append((query, projection))
+        if self.release is not None:
+            await self.release.wait()
+        return self.result
+
+    async def update_one(self, query, update):
+        return None
+
+    async def find_one_and_update(self, query, update, projection=None, return_document=None):
+        self.calls.append((query, update))
+        return self.result
+
+
+USER_DOC = {"_id": ObjectId(), "auth0_id": "auth0|1", "skin_type": "oily", "products": {"AM": [], "PM": []}}
+
+
+@pytest.mark.asyncio
+async def test_user_reads_project_only_what_endpoints_need():
+    """
+    tests that user reads ask MongoDB for the endpoint fields only, not the whole document.
+    """
+    collection = UsersCollection()
+    users = UserRepository(collection)
+
+    await users.exists("auth0|1")
+    await users.find_context("auth0|1")
+    await users.find_context("auth0|1", "AM")
+    await users.find_routine_rules("auth0|1", "PM")
+
+    assert [projection for _, projection in collection.calls] == [
+        {"_id": 1}, {"auth0_id": 1, "skin_type": 1},
+        {"auth0_id": 1, "skin_type": 1, "products.AM": 1}, {"_id": 0, "rules_cache.PM": 1},
+    ]
+    assert context_projection() is USER_CONTEXT_PROJECTION
+    assert "given_name" not in context_projection("AM")
+    # the precomputed rules are only read by the rules endpoint, one day at a time
+    assert "rules_cache" not in context_projection("AM")
+
+
+@pytest.mark.asyncio
+async def test_user_context_is_cached_until_a_write():
+    """
+    tests that repeated reads are served from the cache and a write drops the cached document.
+    """
+    collection = UsersCollection(USER_DOC)
+    users = UserRepository(collection, cache=MemoryCache(), ttl=60)
+
+    assert await users.find_context("auth0|1") == USER_DOC
+    assert await users.find_context("auth0|1") == USER_DOC
+    assert len(collection.calls) == 1
+
+    await users.set_skin_type("auth0|1", "dry")
+    await users.find_context("auth0|1")
+    assert len(collection.calls) == 2
+
+    # each routine is cached on its own, and dropped by writes too
+    await users.find_context("auth0|1", "PM")
+    await users.find_context("auth0|1", "PM")
+    assert len(collection.calls) == 3
+    await users.set_skin_type("auth0|1", "oily")
+    await users.find_context("auth0|1", "PM")
+    assert len(collection.calls) == 4
+
+
+@pytest.mark.asyncio
+async def test_missing_users_are_not_cached():
+    """
+    tests that a user created after a failed lookup is found on the next read.
+    """
+    collection = UsersCollection(None)
+    users = UserRepository(collection, cache=MemoryCache(), ttl=60)
+
+    assert await users.find_context("auth0|1") is None
+    collection.result = USER_DOC
+    assert await users.find_context("auth0|1") == USER_DOC
+
+
+@pytest.mark.asyncio
+async def test_read_racing_a_write_is_not_cached():
+    """
+    tests that a document read before a concurrent write is not kept in the cache.
+    """
+    collection = UsersCollection(USER_DOC)
+    collection.release = asyncio.Event()
+    users = UserRepository(collection, cache=MemoryCache(), ttl=60)
+
+    read = asyncio.create_task(users.find_context("auth0|1"))
+    await asyncio.sleep(0)
+    await users.set_skin_type("auth0|1", "dry")
+    collection.release.set()
+    await read
+
+    await users.find_context("auth0|1")
+    assert len(collection.calls) == 2
+
+
+@pytest.mark.asyncio
+async def test_add_product_skips_routines_already_holding_it():
+    """
+    tests that adding a product only matches a routine without it, so two concurrent adds
+    cannot both push an entry, whatever the rating of the existing one.
+    """
+    collection = UsersCollection()
+    users = UserRepository(collection)
+    product_id = ObjectId()
+
+    assert await users.add_product("auth0|1", "AM", product_id) is None
+    [(query, update)] = collection.calls
+    assert query == {"auth0_id": "auth0|1", "products.AM._id": {"$ne": product_id}}
+    assert update == {"$push": {"products.AM": {"_id": product_id, "rating": 0}}}
+
+
+def test_routes_load_only_their_own_routine(monkeypatch):
+    """
+    tests that the current user is loaded with the routine of the route's day, and with no
+    routine at all for routes without one.
+    """
+    import server
+    from fastapi.testclient import TestClient
+
+    class RecordingUsers:
+        def __init__(self):
+            self.days = []
+
+        async def find_context(self, auth0_id, day=None):
+            self.days.append(day)
+            return {"auth0_id": auth0_id, "skin_type": "oily", "products": {day: []} if day else {}}
+
+    class NoProducts:
+        async def find_community_ratings(self, product_ids):
+            return []
+
+    users = RecordingUsers()
+    monkeypatch.setattr(server, "user_repository", users)
+    monkeypatch.setattr(server, "product_repository", NoProducts())
+    server.app.dependency_overrides[server.current_user_id] = lambda: "auth0|1"
+    try:
+        client = TestClient(server.app)
+        assert client.get("/skintype").json() == {"skin_type": "oily"}
+        assert client.get("/PM/ratings").json() == {"ratings": {}}
+    finally:
+        server.app.dependency_overrides.clear()
+    assert users.days == [None, "PM"]
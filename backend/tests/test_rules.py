@@ -16,3 +16,166 @@ def test_get_user_rules():
         response = test_client.get("/AM/rules/", cookies={"session": "mock_session_token"})
     
     assert response.status_code == 200  # Expected success status
+
+
+# tests for the compiled rule index
+import numpy as np
+from rules import CompiledRules, RoutineRules, conflicting_candidates, evaluate_rules, find_routine_conflicts
+
+RULE_DOCS = [
+    {
+        "_id": "retinoid",
+        "rules": {
+            "avoid": [{"tag": "AHA", "message": "too irritating together"}],
+            "usewith": [{"tag": "moisturizer", "message": "buffer with a moisturizer"}],
+            "usewhen": [{"tag": "PM", "message": "use at night"}],
+        },
+    },
+    {"_id": "AHA", "rules": {"avoid": [{"tag": "retinoid", "message": "too irritating together"}]}},
+    {"_id": "moisturizer", "rules": {}},
+]
+
+
+def make_product(product_id, tags):
+    return {"id": product_id, "name": f"Product {product_id}", "tags": tags}
+
+
+def test_evaluate_rules_finds_avoid_conflicts_both_ways():
+    """
+    tests that an avoid conflict is reported from each product's point of view.
+    """
+    compiled = CompiledRules(RULE_DOCS)
+    products = [make_product("1", ["retinoid"]), make_product("2", ["AHA"])]
+    result = evaluate_rules(products, "PM", compiled)
+
+    pairs = [(rule["source_id:"], rule["comp_id"]) for rule in result["avoid"]]
+    assert pairs == [("1", "2"), ("2", "1")]
+    assert result["avoid"][0]["source"] == "Product 1"
+    assert result["avoid"][0]["comp"] == "Product 2"
+
+
+def test_evaluate_rules_drops_satisfied_usewith():
+    """
+    tests that a usewith rule disappears once another product provides the tag.
+    """
+    compiled = CompiledRules(RULE_DOCS)
+    alone = evaluate_rules([make_product("1", ["retinoid"])], "PM", compiled)
+    assert [rule["rule"]["tag"] for rule in alone["usewith"]] == ["moisturizer"]
+
+    paired = evaluate_rules(
+        [make_product("1", ["retinoid"]), make_product("2", ["moisturizer"])], "PM", compiled
+    )
+    assert paired["usewith"] == []
+
+
+def test_evaluate_rules_usewhen_depends_on_day():
+    """
+    tests that usewhen rules are only reported outside of their time of day.
+    """
+    compiled = CompiledRules(RULE_DOCS)
+    products = [make_product("1", ["retinoid"])]
+    assert evaluate_rules(products, "PM", compiled)["usewhen"] == []
+    assert len(evaluate_rules(products, "AM", compiled)["usewhen"]) == 1
+
+
+def avoid_pairs(result):
+    return sorted((rule["source_id:"], rule["comp_id"], rule["rule"]["tag"]) for rule in result["avoid"])
+
+
+def test_routine_rules_incremental_updates_match_full_evaluation():
+    """
+    tests that adding and removing products incrementally gives the same findings as
+    evaluating the whole routine again.
+    """
+    compiled = CompiledRules(RULE_DOCS)
+    retinoid = make_product("1", ["retinoid"])
+    acid = make_product("2", ["AHA"])
+    moisturizer = make_product("3", ["moisturizer"])
+
+    routine = RoutineRules.compute([retinoid], ["1"], "AM", compiled)
+    routine = routine.add_product(acid, ["1"], "AM", compiled).add_product(moisturizer, ["1", "2"], "AM", compiled)
+    full = evaluate_rules([retinoid, acid, moisturizer], "AM", compiled)
+    assert avoid_pairs(routine.state["result"]) == avoid_pairs(full)
+    assert routine.state["result"]["usewith"] == full["usewith"] == []
+    assert routine.is_current(["3", "1", "2"], compiled)
+
+    routine = routine.remove_product("2", ["3", "1", "2"], "AM", compiled)
+    assert routine.state["result"]["avoid"] == []
+    assert routine.is_current(["1", "3"], compiled)
+    assert not routine.is_current(["1", "2", "3"], compiled)
+
+
+def test_routine_rules_are_stale_after_rules_change():
+    """
+    tests that a precomputed result is not reused once the rules collection changes.
+    """
+    routine = RoutineRules.compute([make_product("1", ["retinoid"])], ["1"], "PM", CompiledRules(RULE_DOCS))
+    assert routine.is_current(["1"], CompiledRules(RULE_DOCS))
+    assert not routine.is_current(["1"], CompiledRules(RULE_DOCS[:1]))
+
+
+def test_routine_rules_stay_current_with_duplicate_and_deleted_entries():
+    """
+    tests that a routine with a duplicate entry and an entry whose product was deleted is
+    current right after it was computed, so reads do not recompute it every time.
+    """
+    compiled = CompiledRules(RULE_DOCS)
+    # "1" was added twice, "9" no longer exists so only two products load
+    routine_ids = ["1", "2", "1", "9"]
+    products = [make_product("1", ["retinoid"]), make_product("2", ["AHA"])]
+    routine = RoutineRules.compute(products, routine_ids, "AM", compiled)
+    assert routine.is_current(routine_ids, compiled)
+
+    routine = routine.add_product(make_product("3", ["moisturizer"]), routine_ids, "AM", compiled)
+    assert routine.is_current(routine_ids + ["3"], compiled)
+    routine = routine.remove_product("1", routine_ids + ["3"], "AM", compiled)
+    assert routine.is_current(["2", "9", "3"], compiled)
+
+
+def reference_conflicts(products, compiled):
+    # pairwise set intersections, as the routine check did before bitsets
+    avoid = []
+    for product in products:
+        for product_comp in products:
+            if product_comp is product:
+                continue
+            for tag in product["tags"]:
+                for avoid_rule in compiled.avoid.get(tag, []):
+                    if avoid_rule["tag"] in product_comp["tags"]:
+                        avoid.append({"source": product["id"], "comp": product_comp["id"], "rule": avoid_rule})
+    return avoid
+
+
+def test_bitset_conflicts_match_set_intersections():
+    """
+    tests that the vectorized avoid check finds the same findings, in the same order, as the
+    pairwise set intersections, including vocabularies spanning several uint64 words.
+    """
+    tags = [f"tag{index}" for index in range(150)]
+    rule_docs = [
+        {"_id": tag, "rules": {"avoid": [{"tag": tags[(index * 7 + step) % len(tags)], "message": f"{tag} {step}"}
+                                         for step in (1, 50, 99)]}}
+        for index, tag in enumerate(tags)
+    ]
+    compiled = CompiledRules(rule_docs)
+    assert compiled.words == 3
+
+    products = [make_product(index, [tags[(index * 13) % 150], tags[(index * 29 + 5) % 150], "untagged"])
+                for index in range(60)]
+    expected = reference_conflicts(products, compiled)
+    assert expected
+    assert find_routine_conflicts(products, compiled) == expected
+
+
+def test_conflicting_candidates_checks_both_directions():
+    """
+    tests that candidates avoiding a routine tag, or avoided by one, are flagged.
+    """
+    compiled = CompiledRules(RULE_DOCS)
+    routine = [make_product(1, ["moisturizer"]), make_product(2, ["retinoid"])]
+    tags, avoids = compiled.encode([["AHA"], ["moisturizer"], ["retinoid", "AHA"], []])
+
+    flagged = conflicting_candidates(routine, tags, avoids, compiled)
+    assert flagged.tolist() == [True, False, True, False]
+    assert not conflicting_candidates([], tags, avoids, compiled).any()
+    assert isinstance(flagged, np.ndarray)
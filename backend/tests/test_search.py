@@ -0,0 +1,180 @@
+# tests/test_search.py
+import asyncio
+from collections import Counter
+import httpx
+import pytest
+import search
+from cache import MemoryCache
+from fixture_server import FixtureServer
+
+SEARCH_PAGE = """
+<html><body>
+  <a class="klavika simpletextlistitem" href="/products/gentle-cleanser">Gentle Cleanser</a>
+  <a class="klavika simpletextlistitem" href="/products/night-serum">Night Serum</a>
+</body></html>
+"""
+
+PRODUCT_PAGE = """
+<html><body>
+  <a class="underline" href="/brands/test-brand">Test Brand</a>
+  <span id="product-title">{name}</span>
+  <span id="product-details">A product for testing.</span>
+  <picture><img src="https://example.com/{slug}.jpg"></picture>
+  <div class="showmore-section ingredlist-short-like-section">
+    <a class="ingred-link black" href="/ingredients/water">Water</a>
+    <a class="ingred-link black" href="/ingredients/retinol">Retinol</a>
+  </div>
+</body></html>
+"""
+
+
+@pytest.fixture
+def incidecoder():
+    """
+    routes the shared scraping client to an in-memory Incidecoder and counts requests per path.
+    """
+    requests_seen = Counter()
+
+    def handler(request):
+        requests_seen[request.url.path] += 1
+        if request.url.path == "/search":
+            return httpx.Response(200, text=SEARCH_PAGE)
+        slug = request.url.path.rsplit("/", 1)[-1]
+        name = slug.replace("-", " ").title()
+        return httpx.Response(200, text=PRODUCT_PAGE.format(name=name, slug=slug))
+
+    search._client = search.create_client(httpx.MockTransport(handler))
+    search.product_cache = MemoryCache()
+    search.search_cache = MemoryCache()
+    yield requests_seen
+    search._client = None
+
+
+@pytest.mark.asyncio
+async def test_search_fetches_each_product_page_once(incidecoder):
+    """
+    tests that a search fetches the results page and each product page exactly once.
+    """
+    results = await search.search_products("serum", limit=5)
+
+    assert [product["name"] for product in results] == ["Gentle Cleanser", "Night Serum"]
+    assert results[1]["image"] == "https://example.com/night-serum.jpg"
+    assert results[1]["url"] == f"{search.BASE_URL}/products/night-serum"
+    assert incidecoder == {"/search": 1, "/products/gentle-cleanser": 1, "/products/night-serum": 1}
+
+
+@pytest.mark.asyncio
+async def test_get_product_data_by_url_parses_every_field(incidecoder):
+    """
+    tests that one fetch of a product page yields all of its fields.
+    """
+    product = await search.get_product_data_by_url(f"{search.BASE_URL}/products/night-serum")
+
+    assert product == {
+        "brand": "Test Brand",
+        "name": "Night Serum",
+        "description": "A product for testing.",
+        "ingredients": ["Water", "Retinol"],
+        "image": "https://example.com/night-serum.jpg",
+    }
+    assert incidecoder["/products/night-serum"] == 1
+
+
+@pytest.fixture
+def replay(monkeypatch):
+    """
+    points the scraper at a local fixture server replaying the recorded Incidecoder pages.
+    the server is configured by the test through replay(**options).
+    """
+    servers = []
+
+    def start(**options):
+        server = FixtureServer(**options).start()
+        servers.append(server)
+        monkeypatch.setattr(search, "BASE_URL", server.base_url)
+        monkeypatch.setattr(search, "RETRY_BACKOFF", 0)
+        search._client = search.create_client()
+        search._fetch_limit = None
+        search.product_cache = MemoryCache()
+        search.search_cache = MemoryCache()
+        return server
+
+    yield start
+    search._client = None
+    for server in servers:
+        server.stop()
+
+
+@pytest.mark.asyncio
+async def test_search_against_recorded_pages(replay):
+    """
+    tests a search over HTTP against the recorded pages, including results never recorded.
+    """
+    server = replay()
+    results = await search.get_search_results("cerave", 5)
+
+    assert [product["name"] for product in results] == [
+        "Hydrating Facial Cleanser",
+        "Retinol 0.5% in Squalane",
+        "Skin Perfecting 2% BHA Liquid Exfoliant",
+    ]
+    assert server.requests["/search"] == 1
+    assert server.requests["/products/cerave-product-0"] == 1
+
+
+@pytest.mark.asyncio
+async def test_fetch_retries_injected_errors(replay):
+    """
+    tests that 503 responses are retried until the page is served.
+    """
+    server = replay(fail_first=2)
+    product = await search.get_product_data_by_url(
+        f"{server.base_url}/products/cerave-hydrating-facial-cleanser"
+    )
+
+    assert product["name"] == "Hydrating Facial Cleanser"
+    assert server.requests["/products/cerave-hydrating-facial-cleanser"] == 3
+
+
+@pytest.mark.asyncio
+async def test_fetch_gives_up_after_retries_and_caches_failure(replay):
+    """
+    tests that a page failing every attempt is given up on and not refetched while cached.
+    """
+    server = replay(error_rate=1.0)
+    url = f"{server.base_url}/products/cerave-hydrating-facial-cleanser"
+
+    assert await search.get_product_data_by_url(url) is None
+    assert await search.get_product_data_by_url(url) is None
+    assert server.requests["/products/cerave-hydrating-facial-cleanser"] == search.RETRY_TOTAL + 1
+
+
+@pytest.mark.asyncio
+async def test_repeated_searches_are_served_from_cache(replay):
+    """
+    tests that repeating a search does not reach Incidecoder again.
+    """
+    server = replay(latency=0.01)
+    first = await search.get_search_results("cerave", 5)
+    second = await search.get_search_results("cerave", 5)
+
+    assert first == second
+    assert sum(server.requests.values()) == 6
+    assert search.search_cache.hits == 1
+
+
+@pytest.mark.asyncio
+async def test_concurrent_identical_scrapes_are_coalesced(replay):
+    """
+    tests that concurrent identical searches and product fetches reach Incidecoder once.
+    """
+    server = replay(latency=0.05)
+    url = f"{server.base_url}/products/cerave-hydrating-facial-cleanser"
+
+    searches = await asyncio.gather(*(search.get_search_results("cerave", 5) for _ in range(20)))
+    products = await asyncio.gather(*(search.get_product_data_by_url(url) for _ in range(20)))
+
+    assert all(results == searches[0] for results in searches)
+    assert all(product == products[0] for product in products)
+    assert server.requests["/search"] == 1
+    assert server.requests["/products/cerave-hydrating-facial-cleanser"] == 1
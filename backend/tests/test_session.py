@@ -1,7 +1,11 @@
 
 # tests/test_session.py
 from fastapi.testclient import TestClient
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
 from server import app
+from sessions import MemorySessionStore, SQLiteSessionStore, ServerSessionMiddleware, rotate_session
 
 client = TestClient(app)
 
@@ -13,6 +17,23 @@ def test_session_not_authenticated():
     assert response.status_code == 401
     assert response.json() == {"error": "Not authenticated"}
 
+def test_routes_reject_unauthenticated_requests_before_database_work(monkeypatch):
+    """
+    tests that routes needing a user answer 401 without looking the user up.
+    """
+    import server
+
+    class FailingUsers:
+        async def find_context(self, auth0_id, day=None):
+            raise AssertionError("user looked up for an unauthenticated request")
+
+    monkeypatch.setattr(server, "user_repository", FailingUsers())
+    for method, path in [("get", "/AM/rules/"), ("get", "/PM/products/"), ("get", "/skintype"),
+                         ("get", "/AM/ratings"), ("delete", "/AM/products/abc")]:
+        response = getattr(client, method)(path)
+        assert response.status_code == 401
+        assert response.json() == {"detail": "User ID not found in session"}
+
 def test_logout():
     """
     tests the /logout route to ensure it logs out the user.
@@ -21,3 +42,118 @@ def test_logout():
     assert response.status_code == 200  # Expected success status
 
 
+TOKEN = {"access_token": "a" * 800, "id_token": "i" * 1200, "userinfo": {"sub": "auth0|1"}}
+
+
+def make_client(store):
+    async def visit(request):
+        request.session["state"] = "oauth state"
+        return JSONResponse({})
+
+    async def login(request):
+        request.session["user"] = TOKEN
+        rotate_session(request)
+        return JSONResponse({})
+
+    async def me(request):
+        user = request.session.get("user")
+        return JSONResponse({"sub": user["userinfo"]["sub"] if user else None})
+
+    async def logout(request):
+        request.session.clear()
+        return JSONResponse({})
+
+    async def rotate(request):
+        rotate_session(request)
+        return JSONResponse({})
+
+    session_app = Starlette(routes=[
+        Route("/visit", visit), Route("/login", login), Route("/me", me), Route("/logout", logout),
+        Route("/rotate", rotate),
+    ])
+    session_app.add_middleware(ServerSessionMiddleware, store=store)
+    return TestClient(session_app)
+
+
+def test_cookie_only_carries_the_session_id():
+    """
+    tests that the token is kept in the store and the cookie holds a short opaque id.
+    """
+    store = MemorySessionStore()
+    client = make_client(store)
+
+    response = client.get("/login")
+    session_id = client.cookies["session"]
+    assert len(session_id) < 64
+    assert "auth0|1" not in response.headers["set-cookie"]
+    assert client.get("/me").json() == {"sub": "auth0|1"}
+    # an unchanged session is neither written back nor sent again
+    assert "set-cookie" not in client.get("/me").headers
+
+
+def test_cleared_and_unknown_sessions():
+    """
+    tests that clearing a session deletes it and that unknown ids start an empty session.
+    """
+    store = MemorySessionStore()
+    client = make_client(store)
+    client.get("/login")
+    session_id = client.cookies["session"]
+
+    response = client.get("/logout")
+    assert "1970" in response.headers["set-cookie"]
+    assert store.load(session_id) is None
+
+    client.cookies.set("session", "forged")
+    assert client.get("/me").json() == {"sub": None}
+
+
+def test_login_rotates_the_session_id():
+    """
+    tests that a session id obtained before logging in is not authenticated by the login
+    (session fixation) and that the rest of the session moves to the new id.
+    """
+    store = MemorySessionStore()
+    client = make_client(store)
+    client.get("/visit")
+    planted_id = client.cookies["session"]
+
+    client.get("/login")
+    assert client.cookies["session"] != planted_id
+    assert store.load(planted_id) is None
+    assert client.get("/me").json() == {"sub": "auth0|1"}
+    assert '"state": "oauth state"' in store.load(client.cookies["session"])
+
+
+def test_rotating_without_a_session():
+    """
+    tests that rotating an empty session, with or without a session cookie, does not fail
+    and leaves no session behind.
+    """
+    store = MemorySessionStore()
+    client = make_client(store)
+    response = client.get("/rotate")
+    assert response.status_code == 200
+
+    session_id = store.create({"state": "oauth state"})
+    response = client.get("/rotate", cookies={"session": "forged"})
+    assert response.status_code == 200
+    assert "1970" in response.headers["set-cookie"]
+    # only the session named by the cookie is affected
+    assert store.load(session_id) is not None
+
+
+def test_sqlite_store_is_shared_and_expires(tmp_path):
+    """
+    tests that a second store on the same file (e.g. another worker) sees the session and
+    that expired sessions are not returned.
+    """
+    path = str(tmp_path / "sessions.sqlite3")
+    session_id = SQLiteSessionStore(path).create({"user": TOKEN})
+    assert make_client(SQLiteSessionStore(path)).get(
+        "/me", cookies={"session": session_id}
+    ).json() == {"sub": "auth0|1"}
+
+    expired = SQLiteSessionStore(path, max_age=-1)
+    expired_id = expired.create({"user": TOKEN})
+    assert expired.load(expired_id) is None
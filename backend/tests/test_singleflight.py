@@ -0,0 +1,68 @@
+# tests/test_singleflight.py
+import asyncio
+import pytest
+from singleflight import SingleFlight
+
+
+@pytest.mark.asyncio
+async def test_concurrent_calls_share_one_call():
+    """
+    tests that concurrent callers for one key share a single call and its result.
+    """
+    flights = SingleFlight()
+    calls = []
+
+    async def fetch(value):
+        calls.append(value)
+        await asyncio.sleep(0.01)
+        return {"value": value}
+
+    results = await asyncio.gather(*(flights.do("key", fetch, 1) for _ in range(10)))
+    other = await flights.do("other", fetch, 2)
+
+    assert calls == [1, 2]
+    assert all(result is results[0] for result in results)
+    assert other == {"value": 2}
+    assert not flights.in_flight("key")
+
+
+@pytest.mark.asyncio
+async def test_exception_is_shared_and_key_released():
+    """
+    tests that a failing call raises in every waiter and the next call starts afresh.
+    """
+    flights = SingleFlight()
+    attempts = []
+
+    async def fail():
+        attempts.append(1)
+        await asyncio.sleep(0.01)
+        raise ValueError("upstream failed")
+
+    results = await asyncio.gather(*(flights.do("key", fail) for _ in range(5)), return_exceptions=True)
+    assert all(isinstance(result, ValueError) for result in results)
+    assert len(attempts) == 1
+
+    with pytest.raises(ValueError):
+        await flights.do("key", fail)
+    assert len(attempts) == 2
+
+
+@pytest.mark.asyncio
+async def test_cancelled_caller_does_not_cancel_shared_call():
+    """
+    tests that cancelling one waiter leaves the call running for the others.
+    """
+    flights = SingleFlight()
+
+    async def fetch():
+        await asyncio.sleep(0.02)
+        return "done"
+
+    first = asyncio.ensure_future(flights.do("key", fetch))
+    second = asyncio.ensure_future(flights.do("key", fetch))
+    await asyncio.sleep(0)
+    first.cancel()
+
+    assert await second == "done"
+    assert first.cancelled()